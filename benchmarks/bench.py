@@ -0,0 +1,330 @@
+"""Benchmarks for the roster, sheet I/O and battle handlers at different scales.
+
+Generates synthetic campaigns (data/ trees with N sheets, battles with M
+combatants), times the handlers from dnd-manager.py against them and reports
+latency percentiles and peak memory per handler and size:
+
+    python benchmarks/bench.py                    # 100 / 10k sheets, 10 / 500 combatants
+    python benchmarks/bench.py --full             # adds 100k sheets and 5k combatants
+    python benchmarks/bench.py --save-baseline    # record benchmarks/baseline.json
+    python benchmarks/bench.py --compare          # fail (exit 1) on regressions vs the baseline
+
+Synthetic trees are generated once and reused from --work-dir. Timings are
+taken without tracing; peak memory comes from a second, traced pass.
+"""
+import argparse
+import gc
+import importlib.util
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+import numpy as np
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from dmbuddy.sessions import BattleView  # noqa: E402
+from dmbuddy.sheet import CharacterSheet, dumps  # noqa: E402
+from dmbuddy.storage import TYPE_FOLDERS, JsonStorage, sheet_key  # noqa: E402
+
+SHEET_COUNTS = [100, 10_000]
+COMBATANT_COUNTS = [10, 500]
+FULL_SHEET_COUNTS = SHEET_COUNTS + [100_000]
+FULL_COMBATANT_COUNTS = COMBATANT_COUNTS + [5_000]
+
+# Share of generated sheets per character type
+TYPE_MIX = {"player": 0.2, "npc": 0.3, "enemy": 0.5}
+
+DEFAULT_BASELINE = Path(__file__).resolve().parent / "baseline.json"
+DEFAULT_WORK_DIR = Path(tempfile.gettempdir()) / "dmbuddy-bench"
+
+ITEMS = ["Dagger", "Shortbow", "Rope", "Torch", "Arrows x20", "Potion of Healing (2)", "Rations", "Shield"]
+
+
+def synthetic_sheet(character_type, name, rng):
+    """A filled-in sheet with random stats"""
+    sheet = CharacterSheet(character_type)
+    sheet.update({
+        "name": name,
+        "class": rng.choice(["Fighter", "Wizard", "Rogue", "Cleric", "Ranger"]),
+        "level": rng.randint(1, 20),
+        "race": rng.choice(["Human", "Elf", "Dwarf", "Goblin", "Orc"]),
+        "armor_class": rng.randint(10, 20),
+        "initiative_bonus": rng.randint(-1, 5),
+        "hit_points_max": rng.randint(5, 120),
+        "hit_dice_total": f"{rng.randint(1, 10)}d{rng.choice([6, 8, 10, 12])}",
+        "gold": rng.randint(0, 50),
+        "equipment": ", ".join(rng.sample(ITEMS, rng.randint(1, 4))),
+    })
+    sheet.hit_points_current = sheet.hit_points_max
+    sheet.abilities = tuple(rng.randint(6, 20) for _ in sheet.abilities)
+    return sheet
+
+
+def sheet_names(count):
+    """(character_type, name) for each sheet of a tree with count sheets"""
+    names = []
+    for character_type, share in TYPE_MIX.items():
+        names += [(character_type, f"{character_type} {i:06d}") for i in range(max(int(count * share), 1))]
+    return names
+
+
+def build_tree(directory, count, seed=0):
+    """Make directory a data/ tree with count synthetic sheets (skipped if it's already there)"""
+    marker = directory / ".complete"
+    if marker.exists():
+        return directory
+    rng = random.Random(seed)
+    for folder in TYPE_FOLDERS.values():
+        (directory / folder).mkdir(parents=True, exist_ok=True)
+    for character_type, name in sheet_names(count):
+        path = directory / TYPE_FOLDERS[character_type] / f"{sheet_key(name)}-{character_type}.json"
+        with open(path, 'w') as f:
+            f.write(dumps(synthetic_sheet(character_type, name, rng)))
+    marker.touch()
+    return directory
+
+
+def load_app(work_dir):
+    """Import dnd-manager.py (its data folder is created relative to the working directory)"""
+    os.chdir(work_dir)
+    spec = importlib.util.spec_from_file_location("dnd_manager", ROOT / "dnd-manager.py")
+    app = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(app)
+    return app
+
+
+def save_args(character_type, name, rng):
+    """Positional arguments for save_character, as the Character tabs send them"""
+    a = synthetic_sheet(character_type, name, rng).to_dict()
+    abilities = [a["abilities"][k] for k in ("strength", "dexterity", "constitution", "intelligence", "wisdom", "charisma")]
+    return [
+        character_type, name, a["class"], a["level"], a["race"], a["background"], a["alignment"],
+        a["armor_class"], a["initiative_bonus"], a["speed"], a["hit_points_max"], a["hit_points_current"],
+        a["temporary_hp"], a["hit_dice_total"], a["hit_dice_remaining"], *abilities,
+        False, False, False, False, False, False,
+        a["spellcasting_ability"], a["spell_save_dc"], a["spell_attack_bonus"],
+        a["equipment"], a["features"], a["spells"], a["proficiency_bonus"], a["gold"],
+    ]
+
+
+def measure(run, repeat):
+    """Call run(i) repeat times; returns latencies in seconds and the traced peak memory in bytes"""
+    latencies = []
+    # Like timeit, keep garbage collection pauses out of the timings
+    gc.collect()
+    gc.disable()
+    try:
+        for i in range(repeat):
+            started = time.perf_counter()
+            run(i)
+            latencies.append(time.perf_counter() - started)
+    finally:
+        gc.enable()
+    # A second, shorter pass under tracemalloc for peak memory (tracing slows everything down)
+    tracemalloc.start()
+    try:
+        for i in range(min(repeat, 20)):
+            run(i)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return latencies, peak
+
+
+def summarise(latencies, peak):
+    ms = np.array(latencies) * 1000
+    p50, p90, p99 = np.percentile(ms, [50, 90, 99])
+    return {
+        "runs": len(ms),
+        "p50_ms": round(float(p50), 4),
+        "p90_ms": round(float(p90), 4),
+        "p99_ms": round(float(p99), 4),
+        "max_ms": round(float(ms.max()), 4),
+        "peak_kb": round(peak / 1024, 1),
+    }
+
+
+def bench_roster(app, tree, count, repeat, rng):
+    """Handlers that read the roster and sheets, plus saves"""
+    app.set_storage(JsonStorage(tree))
+    names = sheet_names(count)
+    results = {}
+
+    def scan(_):
+        app.CAMPAIGN.roster.__init__(app.CAMPAIGN.storage)
+        app.CAMPAIGN.roster.load()
+    results["roster_scan"] = measure(scan, max(repeat // 10, 3))
+
+    results["get_character_list"] = measure(lambda i: app.get_character_list(names[i % len(names)][0]), repeat)
+
+    # One typeahead keystroke: a page of names matching the first few letters of a sheet's name
+    prefixes = [(t, name[:len(name) - 2]) for t, name in (rng.choice(names) for _ in range(repeat))]
+    results["filter_picker"] = measure(lambda i: app.filter_picker(*prefixes[i]), repeat)
+
+    picks = [rng.choice(names) for _ in range(repeat)]
+    results["load_character"] = measure(lambda i: app.load_character(*picks[i]), repeat)
+
+    saves = [save_args(*rng.choice(names), rng) for _ in range(repeat)]
+    results["save_character"] = measure(lambda i: app.save_character(*saves[i]), repeat)
+
+    # Save until the sheet is actually on disk, not just queued
+    def save_to_disk(i):
+        app.save_character(*saves[i])
+        app.CAMPAIGN.writer.flush()
+    results["save_to_disk"] = measure(save_to_disk, max(repeat // 5, 5))
+    return results
+
+
+def bench_battle(app, tree, combatants, repeat, rng):
+    """Battle handlers on a battle with the given number of combatants"""
+    app.set_storage(JsonStorage(tree))
+    enemies = [f"{name} (enemy)" for t, name in sheet_names(100) if t == "enemy"]
+    results = {}
+
+    def build():
+        view = BattleView()
+        for i in range(combatants):
+            app.add_agent_to_battle(view, enemies[i % len(enemies)])
+        return view
+
+    def battle_state(view):
+        return app.BATTLES.peek(view.session_id).battle_state
+
+    # Time every add of a full build
+    view = BattleView()
+    adds = []
+    if not app.CAMPAIGN.names("enemy"):
+        raise SystemExit(f"No enemy sheets in {tree}")
+    gc.collect()
+    gc.disable()
+    for i in range(combatants):
+        started = time.perf_counter()
+        app.add_agent_to_battle(view, enemies[i % len(enemies)])
+        adds.append(time.perf_counter() - started)
+    gc.enable()
+    tracemalloc.start()
+    build()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    results["add_agent_to_battle"] = (adds, peak)
+
+    results["start_battle"] = measure(lambda i: app.start_battle(view, True), max(repeat // 10, 5))
+
+    def turn(i):
+        # A couple of hits per turn; refill the battle when too many have dropped
+        nonlocal view
+        if len(battle_state(view)) < combatants // 2 + 1:
+            view = build()
+            app.start_battle(view, True)
+        count = len(battle_state(view))
+        for row in rng.sample(range(count), min(2, count)):
+            view.table.record_edit(row, 7, rng.randint(1, 30))
+        app.advance_turn(view)
+    results["advance_turn"] = measure(turn, repeat)
+    return results
+
+
+def run(args):
+    sheet_counts = FULL_SHEET_COUNTS if args.full else SHEET_COUNTS
+    combatant_counts = FULL_COMBATANT_COUNTS if args.full else COMBATANT_COUNTS
+    work_dir = Path(args.work_dir)
+    work_dir.mkdir(parents=True, exist_ok=True)
+    rng = random.Random(args.seed)
+
+    trees = {}
+    for count in sorted(set(sheet_counts) | {100}):
+        started = time.perf_counter()
+        trees[count] = build_tree(work_dir / f"sheets-{count}", count)
+        elapsed = time.perf_counter() - started
+        if elapsed > 1:
+            print(f"Generated {count:,} sheets in {elapsed:.1f}s", file=sys.stderr)
+
+    app = load_app(work_dir)
+    results = {}
+    for count in sheet_counts:
+        for name, (latencies, peak) in bench_roster(app, trees[count], count, args.repeat, rng).items():
+            results[f"{name}@{count}_sheets"] = summarise(latencies, peak)
+    for combatants in combatant_counts:
+        for name, (latencies, peak) in bench_battle(app, trees[100], combatants, args.repeat, rng).items():
+            results[f"{name}@{combatants}_combatants"] = summarise(latencies, peak)
+    app.CAMPAIGN.writer.flush()
+    return results
+
+
+def compare(results, baseline, tolerance, min_ms):
+    """Benchmarks whose median latency or peak memory grew more than the baseline allows.
+
+    Tail percentiles are reported but not compared; on a busy machine they are too noisy to gate on.
+    """
+    regressions = []
+    for key, current in results.items():
+        before = baseline.get(key)
+        if before is None:
+            continue
+        if current["p50_ms"] > before["p50_ms"] * (1 + tolerance) and current["p50_ms"] - before["p50_ms"] > min_ms:
+            regressions.append(f"{key}: p50_ms {before['p50_ms']:.3f} -> {current['p50_ms']:.3f}")
+        if current["peak_kb"] > before["peak_kb"] * (1 + tolerance) and current["peak_kb"] - before["peak_kb"] > 64:
+            regressions.append(f"{key}: peak_kb {before['peak_kb']:.0f} -> {current['peak_kb']:.0f}")
+    return regressions
+
+
+def print_table(results):
+    print(f"{'benchmark':48} {'runs':>6} {'p50 ms':>10} {'p90 ms':>10} {'p99 ms':>10} {'peak KB':>10}")
+    for key, r in results.items():
+        print(f"{key:48} {r['runs']:>6} {r['p50_ms']:>10.3f} {r['p90_ms']:>10.3f} {r['p99_ms']:>10.3f} {r['peak_kb']:>10.0f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="DMBuddy handler benchmarks")
+    parser.add_argument("--full", action="store_true", help="Include 100k sheets and 5k combatants")
+    parser.add_argument("--repeat", type=int, default=200, help="Timed calls per handler (default: 200)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--work-dir", default=str(DEFAULT_WORK_DIR), help="Where synthetic data trees are generated and reused")
+    parser.add_argument("--baseline", default=str(DEFAULT_BASELINE), help="Baseline file (default: benchmarks/baseline.json)")
+    parser.add_argument("--save-baseline", action="store_true", help="Write the results to the baseline file")
+    parser.add_argument("--compare", action="store_true", help="Exit with status 1 if anything regressed against the baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed slowdown before it counts as a regression (default: 0.25 = 25%%)")
+    parser.add_argument("--min-ms", type=float, default=0.05, help="Ignore latency differences smaller than this (default: 0.05 ms)")
+    parser.add_argument("--output", help="Also write the results to this JSON file")
+    args = parser.parse_args(argv)
+    baseline_path = Path(args.baseline).resolve()
+    output_path = Path(args.output).resolve() if args.output else None
+
+    results = run(args)
+    print_table(results)
+    report = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "results": results,
+    }
+    if output_path:
+        output_path.write_text(json.dumps(report, indent=2))
+    if args.save_baseline:
+        baseline_path.write_text(json.dumps(report, indent=2))
+        print(f"Baseline written to {baseline_path}")
+    if args.compare:
+        if not baseline_path.exists():
+            print(f"No baseline at {baseline_path}; run with --save-baseline first")
+            return 1
+        baseline = json.loads(baseline_path.read_text())["results"]
+        regressions = compare(results, baseline, args.tolerance, args.min_ms)
+        if regressions:
+            print("Regressions against the baseline:")
+            for line in regressions:
+                print(f"  {line}")
+            return 1
+        print("No regressions against the baseline.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
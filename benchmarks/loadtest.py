@@ -0,0 +1,179 @@
+"""Load test: how request throughput scales with the number of browsers.
+
+Starts dnd-manager.py on a generated campaign and drives it with simulated
+clients through Gradio's REST API (plain httpx, which costs the client far
+less than gradio_client), for a fixed time per client count. Clients mostly
+load sheets and type into the name filters, with some searches and saves mixed
+in, back to back without think time:
+
+    python benchmarks/loadtest.py                          # 1, 2, 4, 8 and 16 clients
+    python benchmarks/loadtest.py --concurrency 1 8        # compare server settings
+    python benchmarks/loadtest.py --clients 1 32 --seconds 10
+
+For each server setting and client count it prints completed requests per
+second and latency percentiles. Synthetic data is reused from --work-dir.
+"""
+import argparse
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from bench import DEFAULT_WORK_DIR, build_tree, save_args, sheet_names  # noqa: E402
+
+CLIENT_COUNTS = [1, 2, 4, 8, 16]
+SEARCH_WORDS = ["dagger", "rope", "shield", "torch", "arrows", "potion*"]
+
+# (share of requests, operation name)
+MIX = [(0.55, "load_character"), (0.25, "filter_picker"), (0.1, "search_characters"), (0.1, "save_character")]
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(work_dir, concurrency, io_workers, timeout=180):
+    """Run dnd-manager.py against work_dir/data; returns (process, url) once it answers"""
+    port = free_port()
+    env = dict(os.environ, GRADIO_SERVER_PORT=str(port), GRADIO_ANALYTICS_ENABLED="False")
+    command = [sys.executable, str(ROOT / "dnd-manager.py"), "--concurrency", str(concurrency), "--io-workers", str(io_workers)]
+    process = subprocess.Popen(command, cwd=work_dir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    url = f"http://127.0.0.1:{port}/"
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"dnd-manager.py exited with status {process.returncode}")
+        try:
+            urllib.request.urlopen(url, timeout=1).close()
+            return process, url
+        except OSError:
+            time.sleep(0.5)
+    process.terminate()
+    raise RuntimeError(f"dnd-manager.py didn't answer on {url} within {timeout}s")
+
+
+def call(client, api_name, *data):
+    """One request through the REST API: queue it, then read the result stream"""
+    response = client.post(f"/gradio_api/call/{api_name}", json={"data": list(data)})
+    response.raise_for_status()
+    event_id = response.json()["event_id"]
+    event = None
+    with client.stream("GET", f"/gradio_api/call/{api_name}/{event_id}") as stream:
+        for line in stream.iter_lines():
+            if line.startswith("event:"):
+                event = line.split(":", 1)[1].strip()
+            elif line.startswith("data:") and event in ("complete", "error"):
+                if event == "error":
+                    raise RuntimeError(json.loads(line[5:]) or "handler error")
+                return json.loads(line[5:])
+    raise RuntimeError("no result")
+
+
+def client_loop(client, players, client_id, stop, latencies, errors, seed):
+    """Send requests back to back until stop is set, recording each latency"""
+    rng = random.Random(seed)
+    saves = 0
+    while not stop.is_set():
+        roll = rng.random()
+        for share, operation in MIX:
+            roll -= share
+            if roll < 0:
+                break
+        started = time.perf_counter()
+        try:
+            if operation == "load_character":
+                call(client, "load_character", rng.choice(players))
+            elif operation == "filter_picker":
+                call(client, "filter_picker", rng.choice("pne") + str(rng.randint(0, 9)))
+            elif operation == "search_characters":
+                call(client, "search_characters", rng.choice(SEARCH_WORDS), "Any", "", "", "Any", None, None)
+            else:
+                # Each client saves its own few sheets, so saves to one sheet queue up behind each other
+                args = save_args("player", f"player load {client_id} {saves % 3}", rng)
+                args[6] = "True Neutral"  # alignment has to be one of the dropdown's choices
+                saves += 1
+                call(client, "save_character", *args[1:])
+        except Exception as e:
+            errors.append(f"{operation}: {e}")
+            continue
+        if not stop.is_set():
+            latencies.append(time.perf_counter() - started)
+
+
+def run_clients(url, count, seconds, players, seed):
+    """Drive the server with count clients for seconds; returns (requests/s, latencies, errors)"""
+    import httpx
+
+    clients = [httpx.Client(base_url=url, timeout=60) for _ in range(count)]
+    stop = threading.Event()
+    latencies, errors = [], []
+    threads = [
+        threading.Thread(target=client_loop, args=(client, players, i, stop, latencies, errors, seed + i))
+        for i, client in enumerate(clients)
+    ]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    elapsed = time.perf_counter() - started
+    for thread in threads:
+        thread.join()
+    for client in clients:
+        client.close()
+    return len(latencies) / elapsed, sorted(latencies), errors
+
+
+def percentile(values, share):
+    if not values:
+        return 0.0
+    return values[min(int(len(values) * share), len(values) - 1)] * 1000
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="DMBuddy load test")
+    parser.add_argument("--clients", type=int, nargs="+", default=CLIENT_COUNTS, help="Client counts to try (default: 1 2 4 8 16)")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[8], help="Server --concurrency settings to try (default: 8)")
+    parser.add_argument("--io-workers", type=int, default=8, help="Server --io-workers (default: 8)")
+    parser.add_argument("--seconds", type=float, default=5.0, help="How long each client count runs (default: 5)")
+    parser.add_argument("--sheets", type=int, default=1000, help="Sheets in the generated campaign (default: 1000)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--work-dir", default=str(DEFAULT_WORK_DIR), help="Where the synthetic campaign is generated and reused")
+    args = parser.parse_args(argv)
+
+    work_dir = Path(args.work_dir).resolve() / f"loadtest-{args.sheets}"
+    build_tree(work_dir / "data", args.sheets, args.seed)
+    # The Load Character picker starts on its first page, so load from those names;
+    # the sheets clients save ("player load ...") sort after them
+    players = sorted(name.lower() for character_type, name in sheet_names(args.sheets) if character_type == "player")[:40]
+
+    print(f"{'concurrency':>11} {'clients':>8} {'req/s':>8} {'p50 ms':>9} {'p95 ms':>9} {'errors':>7}")
+    for concurrency in args.concurrency:
+        process, url = start_server(work_dir, concurrency, args.io_workers)
+        try:
+            run_clients(url, 1, 1.0, players, args.seed)  # Warm up caches and indexes
+            for count in args.clients:
+                rate, latencies, errors = run_clients(url, count, args.seconds, players, args.seed)
+                print(f"{concurrency:>11} {count:>8} {rate:>8.1f} {percentile(latencies, 0.5):>9.1f} {percentile(latencies, 0.95):>9.1f} {len(errors):>7}")
+                for error in errors[:3]:
+                    print(f"    {error}")
+        finally:
+            process.terminate()
+            process.wait()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
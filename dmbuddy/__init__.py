@@ -0,0 +1 @@
+"""Core helpers for DMBuddy that don't depend on the Gradio UI"""
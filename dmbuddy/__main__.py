@@ -0,0 +1,5 @@
+import sys
+
+from dmbuddy.cli import main
+
+sys.exit(main())
@@ -0,0 +1,323 @@
+"""Campaign archives: every sheet in one compressed file, for backups and moves.
+
+An archive is a gzipped tar stream:
+
+* ``archive.json`` first: format, when it was made and whether it's incremental.
+* ``sheets/<type>/<key>.json`` for each sheet, as compact JSON. Each member
+  carries the sheet's stored name and the SHA-256 of its content in its tar
+  headers, so an import knows both before reading the content.
+* ``manifest.jsonl`` last: one line per sheet in the campaign when the archive
+  was made (name, hash, size, and whether its content is in this archive).
+
+Export streams: the sheets are read, hashed and compressed one at a time, and
+the manifest lines go to a temporary file until the end, so memory doesn't
+grow with the roster beyond a name and a hash per sheet.
+
+A state file next to the data (see sidecar_path) remembers, per sheet, the
+storage signature and content hash it had when it was last exported or
+imported. An incremental export writes only the sheets whose signature has
+changed since they were last exported, without reading the others. An import
+skips every sheet whose hash matches what the campaign already has, again
+without reading it when its signature hasn't moved, and saves the rest in
+batches. With prune it also deletes sheets the manifest doesn't list, so a
+full archive followed by its incrementals reproduces the campaign exactly.
+"""
+import gzip
+import hashlib
+import io
+import json
+import os
+import tarfile
+import tempfile
+import time
+from pathlib import Path
+
+from dmbuddy.sheet import dumps
+from dmbuddy.storage import CHARACTER_TYPES, atomic_write, check_sheet_name, sheet_key
+
+ARCHIVE_FORMAT = 1
+STATE_FILENAME = "archive-state.json"
+BATCH_SIZE = 500
+# gzip level: 6 compresses sheets nearly as well as 9 in a fraction of the time
+COMPRESS_LEVEL = 6
+
+# Tar header fields carrying each sheet's stored name and content hash
+_NAME_HEADER = "DMBUDDY.name"
+_HASH_HEADER = "DMBUDDY.sha256"
+
+
+class _Damaged(ValueError):
+    """Part of an archive can't be read or trusted; the sheets read before it are still imported"""
+
+
+def _members(tar):
+    """The archive's members one at a time, with read errors raised as _Damaged"""
+    members = iter(tar)
+    while True:
+        try:
+            member = next(members)
+        except StopIteration:
+            return
+        except (tarfile.TarError, EOFError, OSError) as e:
+            raise _Damaged(f"Damaged campaign archive: {e}") from None
+        tar.members.clear()  # TarFile remembers every member it reads; we never look back
+        yield member
+
+
+def _read(tar, member):
+    try:
+        return tar.extractfile(member).read()
+    except (tarfile.TarError, EOFError, OSError) as e:
+        raise _Damaged(f"Damaged campaign archive: {member.name}: {e}") from None
+
+
+def _member_key(character_type, name):
+    return f"{character_type}/{sheet_key(name)}"
+
+
+def _signature(signature):
+    return list(signature) if signature is not None else None
+
+
+class ArchiveState:
+    """What the campaign's sheets looked like when they were last exported or imported"""
+
+    def __init__(self, storage):
+        self.path = storage.sidecar_path(STATE_FILENAME)
+        self.sheets = {}  # "type/key" -> [signature, sha256, exported]
+        self.exported_at = None
+        try:
+            with open(self.path, 'r') as f:
+                saved = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return
+        if saved.get("format") == ARCHIVE_FORMAT:
+            self.sheets = saved["sheets"]
+            self.exported_at = saved.get("exported_at")
+
+    def known_hash(self, key, signature):
+        """Content hash of a sheet if it hasn't changed since we last saw it, else None"""
+        entry = self.sheets.get(key)
+        if entry is not None and entry[0] == _signature(signature):
+            return entry[1]
+        return None
+
+    def exported(self, key, signature):
+        """True if the sheet is unchanged since an export included it"""
+        entry = self.sheets.get(key)
+        return entry is not None and entry[2] and entry[0] == _signature(signature)
+
+    def record(self, key, signature, digest, exported):
+        self.sheets[key] = [_signature(signature), digest, exported]
+
+    def save(self):
+        atomic_write(self.path, json.dumps(
+            {"format": ARCHIVE_FORMAT, "exported_at": self.exported_at, "sheets": self.sheets}, separators=(',', ':')
+        ))
+
+
+def _add_bytes(tar, name, data, mtime, pax_headers=None):
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    info.mtime = mtime
+    info.mode = 0o644
+    if pax_headers:
+        info.pax_headers = pax_headers
+    tar.addfile(info, io.BytesIO(data))
+    tar.members.clear()  # TarFile remembers every member it writes; we never look back
+
+
+def export_archive(campaign, out, incremental=False, progress=None):
+    """Write the campaign's sheets to out (a path, or a binary file object) as a compressed archive.
+
+    With incremental only sheets changed since the last export are written;
+    the manifest still lists every sheet. A path is only replaced once the
+    whole archive is on disk. Returns a report of the counts.
+    """
+    if not isinstance(out, (str, Path)):
+        return _export(campaign, out, incremental, progress, None)
+    out = Path(out)
+    fd, temp_path = tempfile.mkstemp(dir=out.parent, prefix=f".{out.name}.", suffix=".tmp")
+    try:
+        os.chmod(temp_path, 0o644)  # mkstemp makes it owner-only
+        with os.fdopen(fd, 'wb') as f:
+            def finish():
+                f.flush()
+                os.fsync(f.fileno())
+                os.replace(temp_path, out)
+            return _export(campaign, f, incremental, progress, finish)
+    except BaseException:
+        try:
+            os.unlink(temp_path)
+        except FileNotFoundError:
+            pass
+        raise
+
+
+def _export(campaign, out, incremental, progress, finish):
+    storage = campaign.storage
+    if campaign.writer:
+        campaign.writer.flush()
+    state = ArchiveState(storage)
+    started = time.time()
+    report = {"sheets": 0, "written": 0, "unchanged": 0, "bytes": 0, "incremental": incremental, "since": state.exported_at}
+    # Entries move from the old state to the new one as their sheets are seen, so
+    # sheets deleted since the last export are forgotten and the state never grows
+    previous, state.sheets = state.sheets, {}
+    with gzip.GzipFile(fileobj=out, mode='wb', compresslevel=COMPRESS_LEVEL) as compressed, \
+            tarfile.open(fileobj=compressed, mode='w|', format=tarfile.PAX_FORMAT) as tar, \
+            tempfile.TemporaryFile() as manifest:
+        header = {"format": ARCHIVE_FORMAT, "created": round(started, 3), "incremental": incremental, "since": state.exported_at}
+        _add_bytes(tar, "archive.json", json.dumps(header).encode('utf-8'), started)
+        for character_type in CHARACTER_TYPES:
+            for name, signature in sorted(storage.signatures(character_type).items()):
+                key = _member_key(character_type, name)
+                entry = {"type": character_type, "name": name, "key": key}
+                known = previous.pop(key, None)
+                if known is not None:
+                    state.sheets[key] = known
+                if incremental and state.exported(key, signature):
+                    entry["sha256"], entry["archived"] = known[1], False
+                    report["unchanged"] += 1
+                else:
+                    try:
+                        data = dumps(storage.load(character_type, name)).encode('utf-8')
+                    except FileNotFoundError:
+                        state.sheets.pop(key, None)
+                        continue  # Deleted since the scan
+                    digest = hashlib.sha256(data).hexdigest()
+                    _add_bytes(tar, f"sheets/{key}.json", data, signature[0] / 1e9,
+                               {_NAME_HEADER: name, _HASH_HEADER: digest})
+                    state.record(key, signature, digest, True)
+                    entry.update(sha256=digest, size=len(data), archived=True)
+                    report["written"] += 1
+                    report["bytes"] += len(data)
+                manifest.write(json.dumps(entry, separators=(',', ':')).encode('utf-8') + b"\n")
+                report["sheets"] += 1
+                if progress:
+                    progress(report)
+        info = tarfile.TarInfo("manifest.jsonl")
+        info.size = manifest.tell()
+        info.mtime = started
+        info.mode = 0o644
+        manifest.seek(0)
+        tar.addfile(info, manifest)
+    if finish:
+        finish()  # The archive is in place before the state says its sheets are exported
+    state.exported_at = round(started, 3)
+    state.save()
+    return report
+
+
+def import_archive(campaign, source, prune=False, batch_size=BATCH_SIZE, progress=None):
+    """Read an archive from source (a binary file object) into the campaign.
+
+    Sheets whose content the campaign already has are skipped. With prune,
+    sheets the archive's manifest doesn't list are deleted afterwards. Raises
+    ValueError for a file that isn't a DMBuddy archive or a damaged sheet.
+    """
+    storage = campaign.storage
+    if campaign.writer:
+        campaign.writer.flush()
+    state = ArchiveState(storage)
+    report = {"sheets": 0, "imported": 0, "unchanged": 0, "removed": 0}
+    batch, listed, header = [], None, None
+
+    def save_batch():
+        records = batch[:]
+        batch.clear()
+        campaign.save_many([(character_type, name, data) for character_type, name, data, _, _ in records])
+        for character_type, name, _, key, digest in records:
+            state.record(key, storage.signature(character_type, name), digest, False)
+        report["imported"] += len(records)
+        if progress:
+            progress(report)
+
+    try:
+        tar = tarfile.open(fileobj=source, mode='r|*')
+    except tarfile.TarError as e:
+        raise ValueError(f"Not a campaign archive: {e}") from None
+    damaged = None
+    try:
+        try:
+            with tar:
+                for member in _members(tar):
+                    if member.name == "archive.json":
+                        try:
+                            header = json.loads(_read(tar, member))
+                        except json.JSONDecodeError as e:
+                            raise _Damaged(f"Damaged campaign archive: archive.json: {e}") from None
+                        if not isinstance(header, dict):
+                            raise _Damaged("Damaged campaign archive: archive.json isn't a JSON object")
+                        if header.get("format") != ARCHIVE_FORMAT:
+                            raise ValueError(f"Unsupported campaign archive format {header.get('format')!r}")
+                        continue
+                    if header is None:
+                        raise ValueError("Not a campaign archive: it doesn't start with archive.json")
+                    if member.name == "manifest.jsonl":
+                        try:
+                            listed = {json.loads(line)["key"] for line in _read(tar, member).splitlines()}
+                        except (ValueError, TypeError, KeyError) as e:
+                            raise _Damaged(f"Damaged campaign archive: manifest.jsonl: {e}") from None
+                        continue
+                    if not member.name.startswith("sheets/") or not member.isfile():
+                        continue
+                    character_type = member.name.split("/")[1]
+                    name = member.pax_headers.get(_NAME_HEADER)
+                    digest = member.pax_headers.get(_HASH_HEADER)
+                    if character_type not in CHARACTER_TYPES or not name or not digest:
+                        raise _Damaged(f"Damaged campaign archive: {member.name} is missing its type, name or hash")
+                    try:
+                        check_sheet_name(name)  # It becomes a file name; "../x" must not escape the data folder
+                    except ValueError as e:
+                        raise _Damaged(f"Damaged campaign archive: {member.name}: {e}") from None
+                    report["sheets"] += 1
+                    key = _member_key(character_type, name)
+                    signature = storage.signature(character_type, name)
+                    local = state.known_hash(key, signature)
+                    if local is None and signature is not None:
+                        try:
+                            local = hashlib.sha256(dumps(storage.load(character_type, name)).encode('utf-8')).hexdigest()
+                        except FileNotFoundError:
+                            local = None
+                        else:
+                            state.record(key, signature, local, False)
+                    if local == digest:
+                        report["unchanged"] += 1
+                        continue
+                    data = _read(tar, member)
+                    if hashlib.sha256(data).hexdigest() != digest:
+                        raise _Damaged(f"Damaged campaign archive: {member.name} doesn't match its hash")
+                    try:
+                        data = json.loads(data)
+                    except json.JSONDecodeError:
+                        data = None
+                    if not isinstance(data, dict):
+                        raise _Damaged(f"Damaged campaign archive: {member.name} isn't a character sheet")
+                    batch.append((character_type, name, data, key, digest))
+                    if len(batch) >= batch_size:
+                        save_batch()
+        except _Damaged as e:
+            damaged = e
+        # Everything read intact is kept, even before a damaged member, so running it
+        # again carries on; after any other error (a failed save) nothing more is written
+        if batch:
+            save_batch()
+    finally:
+        state.save()
+    if damaged is not None:
+        raise damaged
+    if header is None:
+        raise ValueError("Not a campaign archive: it's empty")
+    if prune:
+        if listed is None:
+            raise ValueError("The archive has no manifest, so nothing was pruned")
+        for character_type in CHARACTER_TYPES:
+            for name in campaign.names(character_type):
+                key = _member_key(character_type, name)
+                if key not in listed:
+                    campaign.delete_sheet(character_type, name)
+                    state.sheets.pop(key, None)
+                    report["removed"] += 1
+        state.save()
+    return report
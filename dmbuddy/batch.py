@@ -0,0 +1,190 @@
+"""Batch edits: one declarative change applied to many sheets at once.
+
+A batch is a list of rules, one per line, applied to every sheet in a
+selection (usually a search, see dmbuddy.search):
+
+    hit_points_current = hit_points_max   copy another number field
+    level += 1                            add to (or -= subtract from) a number
+    alignment = True Neutral              set a field to a value
+    gold split 250                        divide an amount evenly over the sheets
+
+split adds amount // count to every sheet and one more to each of the first
+amount % count, in the selection's order, so nothing is lost to rounding.
+
+plan_batch() reads each selected sheet once (through the campaign's cache),
+applies the rules to a copy and keeps only what actually changes, so the
+preview is the exact diff that will be written. A batch that would leave a
+field below its minimum (level under 1, negative hit points or gold) is
+refused before anything is previewed. BatchPlan.commit() writes the
+changed sheets as one all-or-nothing save (see Campaign.save_many), which
+first checks that none of them was saved by somebody else since the preview;
+the backend holds the sheets from that check until they are written.
+"""
+import re
+
+from dmbuddy.sheet import FIELDS
+from dmbuddy.storage import SheetsChanged
+
+# Fields a rule can change; name and type decide where a sheet is stored, so they can't
+_NUMBERS = {key for key, kind, _ in FIELDS if kind == "int"}
+_TEXTS = {key for key, kind, _ in FIELDS if kind == "str"} - {"name", "type"}
+
+# Lowest value a batch may leave in a field
+_MINIMUMS = {"level": 1, "hit_points_max": 0, "hit_points_current": 0, "temporary_hp": 0, "gold": 0}
+
+_RULE = re.compile(r"^(\w+)\s*(\+=|-=|=|\bsplit\b)\s*(.*)$")
+
+# Most changed fields listed in a preview
+PREVIEW_LIMIT = 500
+
+
+class BatchRule:
+    """One parsed rule: field, operator (=, +=, -= or split) and its operand"""
+
+    __slots__ = ("field", "op", "value", "source")
+
+    def __init__(self, field, op, value=None, source=None):
+        self.field = field
+        self.op = op
+        self.value = value    # number or text
+        self.source = source  # field copied from, for "field = other_field"
+
+    def __str__(self):
+        return f"{self.field} {self.op} {self.source if self.source else self.value}"
+
+
+def parse_rules(text):
+    """BatchRules from rule lines (blank lines and # comments skipped); raises ValueError naming the bad line"""
+    rules = []
+    lines = text.splitlines() if isinstance(text, str) else text
+    for number, line in enumerate(lines, 1):
+        line = line.split("#", 1)[0].strip()
+        if not line:
+            continue
+        match = _RULE.match(line)
+        if not match:
+            raise ValueError(f"Rule {number} ({line!r}) isn't 'field = value', 'field += n', 'field -= n' or 'field split n'")
+        field, op, operand = match[1], match[2], match[3].strip()
+        if field in _TEXTS:
+            if op != "=":
+                raise ValueError(f"Rule {number}: {field} is text, so it can only be set with =")
+            rules.append(BatchRule(field, op, value=operand))
+            continue
+        if field not in _NUMBERS:
+            raise ValueError(f"Rule {number}: {field!r} isn't a sheet field that can be batch edited")
+        if op == "=" and operand in _NUMBERS:
+            rules.append(BatchRule(field, op, source=operand))
+            continue
+        try:
+            value = int(operand)
+        except ValueError:
+            raise ValueError(f"Rule {number}: {operand!r} is neither a whole number nor a number field") from None
+        rules.append(BatchRule(field, op, value=value))
+    if not rules:
+        raise ValueError("No rules given")
+    return rules
+
+
+def select_sheets(campaign, character_type=None, text="", filters=None, level_min=None, level_max=None, names=None):
+    """(type, name) of the sheets a batch applies to: the named ones, or a search of the campaign"""
+    if names:
+        return [(character_type or "player", name) for name in names]
+    if campaign.writer:
+        campaign.writer.flush()  # Sheets saved a moment ago are edited too
+    return campaign.find(text, character_type, filters, level_min, level_max)
+
+
+def _apply(data, rules, index, count):
+    """Apply the rules to one sheet's dict in place; returns [(field, before, after)] of what changed"""
+    original = {rule.field: data.get(rule.field) for rule in rules}
+    for rule in rules:
+        current = data.get(rule.field)
+        if rule.source:
+            data[rule.field] = data.get(rule.source)
+        elif rule.op == "=":
+            data[rule.field] = rule.value
+        elif rule.op == "split":
+            share, remainder = divmod(rule.value, count)
+            data[rule.field] = current + share + (1 if index < remainder else 0)
+        else:
+            data[rule.field] = current + rule.value if rule.op == "+=" else current - rule.value
+    # A field a later rule puts back the way it was isn't a change
+    return [(field, before, data[field]) for field, before in original.items() if data[field] != before]
+
+
+class BatchPlan:
+    """The exact changes a batch would make, ready to preview and commit"""
+
+    def __init__(self, rules, selected, changes, records, signatures, missing):
+        self.rules = rules
+        self.selected = selected      # sheets the batch looked at
+        self.changes = changes        # [(type, name, [(field, before, after), ...])] of sheets that change
+        self.records = records        # [(type, name, new sheet dict)] to save
+        self.signatures = signatures  # stored signature of each changed sheet when it was read
+        self.missing = missing        # selected sheets that no longer exist
+        self.committed = False
+
+    def preview(self, limit=PREVIEW_LIMIT):
+        """[type, name, field, before, after] rows, one per changed field"""
+        rows = []
+        for character_type, name, fields in self.changes:
+            for field, before, after in fields:
+                if len(rows) >= limit:
+                    return rows
+                rows.append([character_type, name, field, before, after])
+        return rows
+
+    def summary(self):
+        """One line on what the batch would do (or did)"""
+        changed = len(self.changes)
+        text = f"{changed} of {len(self.selected)} sheet{'s' if len(self.selected) != 1 else ''} {'changed' if self.committed else 'would change'}"
+        if self.missing:
+            text += f"; {len(self.missing)} no longer exist"
+        return text + "."
+
+    def commit(self, campaign):
+        """Save every changed sheet in one all-or-nothing write; returns how many were saved.
+
+        Raises ValueError, writing nothing, if any of them was saved since the
+        plan was made (plan the batch again to see the new values).
+        """
+        if self.committed:
+            raise ValueError("This batch has already been applied")
+        try:
+            count = campaign.save_many(self.records, atomic=True, expected=self.signatures) if self.records else 0
+        except SheetsChanged as e:
+            stale = e.names
+            listed = ", ".join(stale[:5]) + (" and others" if len(stale) > 5 else "")
+            raise ValueError(f"{len(stale)} sheet{'s' if len(stale) != 1 else ''} changed since the preview ({listed}); preview the batch again") from None
+        self.committed = True
+        return count
+
+
+def plan_batch(campaign, selected, rules):
+    """Read each selected sheet once and work out what the rules change, without saving anything"""
+    if isinstance(rules, str):
+        rules = parse_rules(rules)
+    if campaign.writer:
+        campaign.writer.flush()  # So the signatures read below belong to what's being edited
+    storage = campaign.storage
+    sheets, missing = [], []
+    for character_type, name in selected:
+        signature = storage.signature(character_type, name)
+        try:
+            sheets.append((character_type, name, signature, campaign.load_sheet(character_type, name).to_dict()))
+        except FileNotFoundError:
+            missing.append((character_type, name))
+    changes, records, signatures, invalid = [], [], [], []
+    for index, (character_type, name, signature, data) in enumerate(sheets):
+        fields = _apply(data, rules, index, len(sheets))
+        invalid += [f"{name}: {field} {after}" for field, _, after in fields
+                    if field in _MINIMUMS and after < _MINIMUMS[field]]
+        if fields:
+            changes.append((character_type, name, fields))
+            records.append((character_type, name, data))
+            signatures.append(signature)
+    if invalid:
+        listed = ", ".join(invalid[:5]) + (" and others" if len(invalid) > 5 else "")
+        raise ValueError(f"The batch would leave {len(invalid)} field{'s' if len(invalid) != 1 else ''} out of range ({listed}); "
+                         "level must be at least 1, and hit points and gold can't go below 0")
+    return BatchPlan(rules, list(selected), changes, records, signatures, missing)
@@ -0,0 +1,574 @@
+"""Array-backed battle state.
+
+Each combatant field lives in its own column (a NumPy array for the numbers,
+plain lists for type and name), so damage, HP clamping and defeat detection are
+single vectorized operations no matter how many combatants are in the fight.
+Rows in the Battle tab's Dataframe are only built at the UI boundary
+(to_table / rows); edits coming back are handled by dmbuddy.delta.
+
+Combatants sit in fixed slots; the turn order is a separate initiative-sorted
+ring of slot ids with a pointer to whoever is up. Advancing a turn only moves
+the pointer, joiners are inserted at their initiative with a binary search and
+the defeated are unlinked in place, so nothing gets re-sorted or rebuilt.
+"""
+import bisect
+import sys
+
+import numpy as np
+
+from dmbuddy.dice import compile_dice
+
+# Dataframe columns, in display order
+TABLE_HEADERS = ["Type", "Name", "Default Initiative", "Rolled Initiative", "Total Initiative", "Armor Class", "HP", "Damage Taken"]
+TABLE_DATATYPES = ["str", "str", "number", "number", "number", "number", "number", "number"]
+
+# Column positions the handlers read edits from
+ROLLED_INITIATIVE_COLUMN = 3
+DAMAGE_TAKEN_COLUMN = 7
+
+# Rolled for anyone left without a Rolled Initiative when the battle starts
+INITIATIVE_DICE = "1d20"
+
+# Numeric columns, in the same order as TABLE_HEADERS[2:]
+INT_COLUMNS = ("default_initiative", "rolled_initiative", "total_initiative", "armor_class", "hp", "damage_taken")
+
+
+def to_int(value):
+    """Read a table cell as an int; blank or invalid input counts as 0"""
+    try:
+        return int(value)
+    except (ValueError, TypeError, OverflowError):
+        return 0
+
+
+def roll_hit_points(hit_dice, count, rng=None):
+    """Roll HP for count creatures from a hit dice string (e.g. "2d8+2"); None if it can't be read"""
+    try:
+        expression = compile_dice(hit_dice)
+    except ValueError:
+        return None
+    if not expression.terms:
+        return None
+    return np.maximum(expression.roll(count, rng), 1)
+
+
+def _missing(longer, longer_keys, shorter, shorter_keys):
+    """(position, (slot, key)) for each entry of longer that shorter lacks, if shorter is
+    longer with just those taken out; else None"""
+    longer_slots = np.array(longer, dtype=np.int64)
+    gone = ~np.isin(longer_slots, np.array(shorter, dtype=np.int64))
+    kept = np.flatnonzero(~gone).tolist()
+    if len(kept) != len(shorter) or longer_slots[kept].tolist() != shorter:
+        return None
+    if [longer_keys[i] for i in kept] != shorter_keys:
+        return None
+    return [(position, (longer[position], longer_keys[position])) for position in np.flatnonzero(gone).tolist()]
+
+
+def _order_change(old, old_keys, new, new_keys):
+    """How the turn order (slots, with their initiative keys) went from old to new, said briefly.
+
+    Combatants that were only removed or only added are kept as
+    (position, (slot, key)) lists; anything else (a re-sort after rolling
+    initiative) keeps both orders whole. None if the order didn't change.
+    """
+    if old == new and old_keys == new_keys:
+        return None
+    if len(new) < len(old):
+        removed = _missing(old, old_keys, new, new_keys)
+        if removed is not None:
+            return ("removed", removed)
+    elif len(new) > len(old):
+        inserted = _missing(new, new_keys, old, old_keys)
+        if inserted is not None:
+            return ("inserted", inserted)
+    return ("whole", list(zip(old, old_keys)), list(zip(new, new_keys)))
+
+
+def _put_back(order, keys, entries):
+    for position, (slot, key) in entries:
+        order.insert(position, slot)
+        keys.insert(position, key)
+
+
+def _take_out(order, keys, entries):
+    for position, _ in reversed(entries):
+        del order[position]
+        del keys[position]
+
+
+def _undo_order(order, keys, change):
+    if change is None:
+        return
+    if change[0] == "removed":
+        _put_back(order, keys, change[1])
+    elif change[0] == "inserted":
+        _take_out(order, keys, change[1])
+    else:
+        order[:] = [slot for slot, _ in change[1]]
+        keys[:] = [key for _, key in change[1]]
+
+
+def _redo_order(order, keys, change):
+    if change is None:
+        return
+    if change[0] == "removed":
+        _take_out(order, keys, change[1])
+    elif change[0] == "inserted":
+        _put_back(order, keys, change[1])
+    else:
+        order[:] = [slot for slot, _ in change[2]]
+        keys[:] = [key for _, key in change[2]]
+
+
+class BattleChange:
+    """What one battle action changed: the slots it touched, before and after, plus the turn order and counters"""
+
+    __slots__ = ("old_size", "size", "old_slots", "before", "slots", "after", "order_change", "scalars_before", "scalars_after", "nbytes")
+
+    def __init__(self, old_size, size, old_slots, before, slots, after, order_change, scalars_before, scalars_after):
+        self.old_size = old_size          # slot count before the action
+        self.size = size                  # and after it
+        self.old_slots = old_slots        # touched slots that existed before
+        self.before = before              # (numbers, identities) of old_slots before the action
+        self.slots = slots                # every touched slot
+        self.after = after                # (numbers, identities) of slots after the action
+        self.order_change = order_change  # see _order_change()
+        self.scalars_before = scalars_before
+        self.scalars_after = scalars_after
+        self.nbytes = self._measure()
+
+    def _measure(self):
+        """Approximate bytes held, counting the per-row tuples and the order entries"""
+        total = 400 + self.before[0].nbytes + self.after[0].nbytes + 120 * (len(self.before[1]) + len(self.after[1]))
+        if self.order_change is not None:
+            total += 72 * sum(len(entries) for entries in self.order_change[1:])
+        for scalars in (self.scalars_before, self.scalars_after):
+            total += 100 * len(scalars[4]) + 8 * len(scalars[5])
+        return total
+
+
+class BattleState:
+    """Column store and initiative ring for the combatants of one encounter.
+
+    Numeric columns are NumPy buffers indexed by slot, with spare capacity so
+    adding a combatant is amortised O(1); slots freed by the defeated are reused.
+    The public column attributes (state.hp etc.) are views over every slot.
+    """
+
+    def __init__(self, capacity=16):
+        self.types = []
+        self.names = []
+        self.sheets = []      # sheet each combatant was loaded from (names of spawned copies are numbered)
+        self._buffers = {column: np.zeros(capacity, dtype=np.int64) for column in INT_COLUMNS}
+        self._versions = np.zeros(capacity, dtype=np.int64)  # bumped whenever a slot's row changes
+        self._joined = []     # join sequence per slot, breaks initiative ties
+        self._free = []       # slots left behind by the defeated
+        self._members = {}    # (type, name) -> count, for the duplicate check
+        self._spawned = {}    # (type, sheet) -> highest copy number handed out
+        self._next_seq = 0
+        self._order = []      # slot ids sorted by initiative, highest first
+        self._keys = []       # (-total initiative, join sequence) for each entry of _order
+        self.current = 0      # position in _order of whoever's turn it is
+        self.started = False  # set once initiative has been rolled
+        self.round = 0        # 1 once initiative has been rolled, +1 each time the turn comes back round
+
+    def __len__(self):
+        return len(self._order)
+
+    def __getattr__(self, column):
+        # Expose each numeric column as a view over every slot, e.g. state.hp
+        buffers = self.__dict__.get("_buffers")
+        if buffers is not None and column in buffers:
+            return buffers[column][:len(self.types)]
+        raise AttributeError(column)
+
+    def _reserve(self, size):
+        """Make room in the buffers for size slots, at least doubling when they grow"""
+        first = len(self.types)
+        capacity = len(self._buffers[INT_COLUMNS[0]])
+        if size > capacity:
+            capacity = max(capacity * 2, size)
+            for column, buffer in self._buffers.items():
+                grown = np.zeros(capacity, dtype=np.int64)
+                grown[:first] = buffer[:first]
+                self._buffers[column] = grown
+            versions = np.zeros(capacity, dtype=np.int64)
+            versions[:first] = self._versions[:first]
+            self._versions = versions
+
+    def _allocate(self, count=1):
+        """Hand out free slots, growing the buffers at most once"""
+        reused = [self._free.pop() for _ in range(min(count, len(self._free)))]
+        first = len(self.types)
+        fresh = count - len(reused)
+        self._reserve(first + fresh)
+        self.types.extend([None] * fresh)
+        self.names.extend([None] * fresh)
+        self.sheets.extend([None] * fresh)
+        self._joined.extend([0] * fresh)
+        return reused + list(range(first, first + fresh))
+
+    def _key(self, slot):
+        return (-int(self._buffers["total_initiative"][slot]), self._joined[slot])
+
+    def _insert(self, slot):
+        """Link a slot into the ring at its initiative without disturbing whose turn it is"""
+        key = self._key(slot)
+        position = bisect.bisect_left(self._keys, key)
+        self._keys.insert(position, key)
+        self._order.insert(position, slot)
+        if position <= self.current and len(self._order) > 1:
+            self.current += 1
+        return position
+
+    def _unlink(self, position):
+        """Remove the entry at a ring position, keeping the pointer on the same combatant.
+
+        Returns True if the pointer had to wrap round to the top of the order.
+        """
+        del self._keys[position]
+        del self._order[position]
+        if position < self.current:
+            self.current -= 1
+        if self.current >= len(self._order):
+            self.current = 0
+            return True
+        return False
+
+    def append(self, character_type, name, default_initiative=0, armor_class=10, hp=10, rolled_initiative=0, sheet=None, seq=None):
+        """Add a combatant, placed into the turn order by total initiative.
+
+        Before the battle starts every total is 0, so new combatants simply queue
+        up in the order they were added. seq is the join sequence to give it
+        (for rebuilding a saved battle); by default it joins last.
+        """
+        slot = self._allocate()[0]
+        self.types[slot] = character_type
+        self.names[slot] = name
+        self.sheets[slot] = sheet or name
+        seq = self._next_seq if seq is None else int(seq)
+        self._joined[slot] = seq
+        self._next_seq = max(self._next_seq, seq + 1)
+        default_initiative = to_int(default_initiative)
+        rolled_initiative = to_int(rolled_initiative)
+        values = {
+            "default_initiative": default_initiative,
+            "rolled_initiative": rolled_initiative,
+            "total_initiative": default_initiative + rolled_initiative if self.started else 0,
+            "armor_class": to_int(armor_class),
+            "hp": to_int(hp),
+            "damage_taken": 0,
+        }
+        for column, value in values.items():
+            self._buffers[column][slot] = value
+        self._versions[slot] += 1
+        member = (character_type, name)
+        self._members[member] = self._members.get(member, 0) + 1
+        self._insert(slot)
+        return slot
+
+    def spawn(self, character_type, sheet, hps, default_initiative=0, armor_class=10):
+        """Add one numbered copy of a sheet per entry in hps, in a single update.
+
+        Copies are labelled "<sheet> 1", "<sheet> 2", ... continuing from any
+        copies already spawned in this battle. They share an initiative, so they
+        go into the turn order as one contiguous block. Returns the new labels.
+        """
+        hps = np.asarray(hps, dtype=np.int64)
+        count = len(hps)
+        if not count:
+            return []
+        first = self._spawned.get((character_type, sheet), 0) + 1
+        self._spawned[(character_type, sheet)] = first + count - 1
+        labels = [f"{sheet} {number}" for number in range(first, first + count)]
+
+        slots = self._allocate(count)
+        seqs = list(range(self._next_seq, self._next_seq + count))
+        self._next_seq += count
+        for slot, label, seq in zip(slots, labels, seqs):
+            self.types[slot] = character_type
+            self.names[slot] = label
+            self.sheets[slot] = sheet
+            self._joined[slot] = seq
+            self._members[(character_type, label)] = self._members.get((character_type, label), 0) + 1
+
+        index = np.array(slots, dtype=np.intp)
+        default_initiative = to_int(default_initiative)
+        total = default_initiative if self.started else 0
+        self._buffers["default_initiative"][index] = default_initiative
+        self._buffers["rolled_initiative"][index] = 0
+        self._buffers["total_initiative"][index] = total
+        self._buffers["armor_class"][index] = to_int(armor_class)
+        self._buffers["hp"][index] = hps
+        self._buffers["damage_taken"][index] = 0
+        self._versions[index] += 1
+
+        # Newest join sequence, same total: the block lands right after everyone already on that total
+        keys = [(-total, seq) for seq in seqs]
+        position = bisect.bisect_left(self._keys, keys[0])
+        self._keys[position:position] = keys
+        self._order[position:position] = slots
+        if position <= self.current and len(self._order) > count:
+            self.current += count
+        return labels
+
+    def contains(self, character_type, name):
+        """True if a combatant with this type and name is already in the battle"""
+        return self._members.get((character_type, name), 0) > 0
+
+    def turn_order(self):
+        """Slot ids in display order, starting with whoever's turn it is"""
+        return self._order[self.current:] + self._order[:self.current]
+
+    def _free_slot(self, slot):
+        member = (self.types[slot], self.names[slot])
+        self._members[member] -= 1
+        if not self._members[member]:
+            del self._members[member]
+        self.types[slot] = None
+        self.names[slot] = None
+        self.sheets[slot] = None
+        self._free.append(slot)
+
+    def roll_initiative(self, rolled):
+        """Set rolled initiative for each displayed row and put the top initiative first.
+
+        Only combatants whose total changed are moved in the ring; if most of them
+        changed (e.g. the first roll of the fight) the ring is rebuilt with one sort.
+        """
+        slots = np.array(self.turn_order(), dtype=np.intp)
+        rolled = np.asarray(rolled, dtype=np.int64)
+        old_total = self._buffers["total_initiative"][slots]
+        old_rolled = self._buffers["rolled_initiative"][slots]
+        self._buffers["rolled_initiative"][slots] = rolled
+        new_total = self._buffers["default_initiative"][slots] + rolled
+        self._buffers["total_initiative"][slots] = new_total
+        self._versions[slots[(old_rolled != rolled) | (old_total != new_total)]] += 1
+        changed = np.flatnonzero(old_total != new_total).tolist()
+
+        if len(changed) * 4 > len(slots):
+            keys = np.lexsort((np.array(self._joined)[slots], -new_total))
+            self._order = slots[keys].tolist()
+            self._keys = [self._key(slot) for slot in self._order]
+        else:
+            for i in changed:
+                # The ring is still sorted by the old total
+                old_key = (-int(old_total[i]), self._joined[slots[i]])
+                self._unlink(bisect.bisect_left(self._keys, old_key))
+            for i in changed:
+                self._insert(int(slots[i]))
+        self.current = 0
+        if not self.started:
+            self.round = 1
+        self.started = True
+
+    def apply_damage(self, damage):
+        """Subtract each displayed row's damage from HP (never below 0) and remove the defeated.
+
+        Only rows that took damage are changed, but everyone at 0 HP or less is
+        removed, including anyone whose HP was edited down to 0. Returns
+        (character_type, name, sheet) for each defeated combatant, in turn order.
+        """
+        count = len(self._order)
+        if not count:
+            return []
+        damage = np.asarray(damage, dtype=np.int64)
+        rows = np.flatnonzero(damage)
+        order = np.array(self._order, dtype=np.intp)
+        hp = self._buffers["hp"]
+        if len(rows):
+            slots = order[(self.current + rows) % count]
+            hp[slots] = np.maximum(hp[slots] - damage[rows], 0)
+            self._versions[slots] += 1
+        down = np.flatnonzero(hp[order] <= 0)
+        if not len(down):
+            return []
+        # Ring positions of the defeated, taken in turn order from whoever is up
+        positions = (self.current + np.sort((down - self.current) % count)) % count
+        defeated_agents = [(self.types[slot], self.names[slot], self.sheets[slot]) for slot in order[positions].tolist()]
+
+        # Unlink from the back so earlier ring positions stay valid
+        for position in sorted(positions.tolist(), reverse=True):
+            slot = self._order[position]
+            # If the combatant whose turn it was went down, the pointer slides to the next one
+            if self._unlink(position) and self.started:
+                self.round += 1  # They were last in the order, so the next turn starts a new round
+            self._free_slot(slot)
+        return defeated_agents
+
+    def advance(self):
+        """End the current turn: the pointer moves to the next combatant in the ring"""
+        if self._order:
+            self.current = (self.current + 1) % len(self._order)
+            if self.current == 0 and self.started:
+                self.round += 1
+
+    def to_dict(self):
+        """JSON-friendly snapshot of the battle (combatants listed in turn order, whoever's up first).
+
+        Each combatant keeps its join sequence, so from_dict() puts tied
+        initiatives back in the same order.
+        """
+        slots = self.turn_order()
+        columns = {column: self._buffers[column][slots].tolist() for column in INT_COLUMNS if column != "damage_taken"}
+        combatants = []
+        for i, slot in enumerate(slots):
+            combatant = {"type": self.types[slot], "name": self.names[slot], "sheet": self.sheets[slot], "seq": self._joined[slot]}
+            combatant.update((column, values[i]) for column, values in columns.items())
+            combatants.append(combatant)
+        return {
+            "started": self.started,
+            "round": self.round,
+            "next_seq": self._next_seq,
+            "combatants": combatants,
+            "spawned": [[character_type, sheet, count] for (character_type, sheet), count in self._spawned.items()],
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        """Rebuild a battle saved with to_dict(), in exactly the same turn order"""
+        state = cls(capacity=max(len(data.get("combatants", [])), 16))
+        state.started = bool(data.get("started"))
+        state.round = int(data.get("round") or (1 if state.started else 0))
+        for combatant in data.get("combatants", []):
+            state.append(
+                combatant["type"],
+                combatant["name"],
+                default_initiative=combatant.get("default_initiative", 0),
+                armor_class=combatant.get("armor_class", 10),
+                hp=combatant.get("hp", 10),
+                rolled_initiative=combatant.get("rolled_initiative", 0),
+                sheet=combatant.get("sheet"),
+                seq=combatant.get("seq"),  # Older saves have none: they join in the order listed
+            )
+        state._next_seq = max(state._next_seq, int(data.get("next_seq") or 0))
+        # Combatants were listed from whoever's up, so that's slot 0
+        state.current = state._order.index(0) if state._order else 0
+        for character_type, sheet, count in data.get("spawned", []):
+            state._spawned[(character_type, sheet)] = count
+        return state
+
+    # Undo support: an action's change is kept as the slots it touched, not a copy of the battle
+
+    def _scalars(self):
+        return (self.current, self.round, self.started, self._next_seq, dict(self._spawned), tuple(self._free))
+
+    def capture(self):
+        """Copy what an action might change, for changes_since() once it's done.
+
+        The copy is O(combatants) but short-lived: changes_since() keeps only the
+        combatants that actually changed.
+        """
+        size = len(self.types)
+        return {
+            "size": size,
+            "versions": self._versions[:size].copy(),
+            "numbers": np.stack([self._buffers[column][:size] for column in INT_COLUMNS], axis=1),
+            "identity": (list(self.types), list(self.names), list(self.sheets), list(self._joined)),
+            "order": (list(self._order), list(self._keys)),
+            "scalars": self._scalars(),
+        }
+
+    def changes_since(self, captured):
+        """A BattleChange from a capture() to now, or None if nothing changed"""
+        old_size, size = captured["size"], len(self.types)
+        freed = set(self._free) - set(captured["scalars"][5])
+        changed = np.flatnonzero(self._versions[:old_size] != captured["versions"])
+        slots = sorted(set(changed.tolist()) | freed | set(range(old_size, size)))
+        order_change = _order_change(*captured["order"], self._order, self._keys)
+        scalars = self._scalars()
+        if not slots and order_change is None and scalars == captured["scalars"]:
+            return None
+        old_slots = [slot for slot in slots if slot < old_size]
+        types, names, sheets, joined = captured["identity"]
+        before = (captured["numbers"][old_slots], [(types[slot], names[slot], sheets[slot], joined[slot]) for slot in old_slots])
+        after = self._rows_of(slots)
+        return BattleChange(old_size, size, old_slots, before, slots, after, order_change, captured["scalars"], scalars)
+
+    def _rows_of(self, slots):
+        numbers = np.stack([self._buffers[column][slots] for column in INT_COLUMNS], axis=1)
+        identity = [(self.types[slot], self.names[slot], self.sheets[slot], self._joined[slot]) for slot in slots]
+        return numbers, identity
+
+    def _set_rows(self, slots, rows):
+        """Overwrite whole slots (identity and numbers), keeping the member counts and row versions right"""
+        numbers, identity = rows
+        for slot, (character_type, name, sheet, joined) in zip(slots, identity):
+            if self.names[slot] is not None:
+                member = (self.types[slot], self.names[slot])
+                self._members[member] -= 1
+                if not self._members[member]:
+                    del self._members[member]
+            self.types[slot], self.names[slot], self.sheets[slot], self._joined[slot] = character_type, name, sheet, joined
+            if name is not None:
+                member = (character_type, name)
+                self._members[member] = self._members.get(member, 0) + 1
+        if slots:
+            index = np.array(slots, dtype=np.intp)
+            for i, column in enumerate(INT_COLUMNS):
+                self._buffers[column][index] = numbers[:, i]
+            self._versions[index] += 1  # Never reused, so browsers redraw the rows
+
+    def _set_scalars(self, scalars):
+        self.current, self.round, self.started, self._next_seq, spawned, free = scalars
+        self._spawned = dict(spawned)
+        self._free = list(free)
+
+    def _resize(self, size):
+        """Grow or shrink the slot lists to size (slots cut off must already be empty)"""
+        first = len(self.types)
+        if size > first:
+            self._reserve(size)
+            for items in (self.types, self.names, self.sheets):
+                items.extend([None] * (size - first))
+            self._joined.extend([0] * (size - first))
+        else:
+            for items in (self.types, self.names, self.sheets, self._joined):
+                del items[size:]
+
+    def revert(self, change):
+        """Undo a BattleChange; only the combatants it touched are rewritten"""
+        new_slots = [slot for slot in change.slots if slot >= change.old_size]
+        self._set_rows(new_slots, (np.zeros((len(new_slots), len(INT_COLUMNS)), dtype=np.int64), [(None, None, None, 0)] * len(new_slots)))
+        self._resize(change.old_size)
+        self._set_rows(change.old_slots, change.before)
+        _undo_order(self._order, self._keys, change.order_change)
+        self._set_scalars(change.scalars_before)
+
+    def reapply(self, change):
+        """Redo a BattleChange that revert() undid"""
+        self._resize(change.size)
+        self._set_rows(change.slots, change.after)
+        _redo_order(self._order, self._keys, change.order_change)
+        self._set_scalars(change.scalars_after)
+
+    def memory_usage(self):
+        """Approximate bytes held by the battle: column buffers plus the per-slot lists"""
+        total = sum(buffer.nbytes for buffer in self._buffers.values()) + self._versions.nbytes
+        for items in (self.types, self.names, self.sheets, self._joined, self._free, self._order, self._keys):
+            total += sys.getsizeof(items)
+        total += sum(sys.getsizeof(name) for name in self.names if name)
+        return total
+
+    def display_seqs(self):
+        """Join sequence of each displayed row: an id for each combatant that to_dict() keeps"""
+        return [self._joined[slot] for slot in self.turn_order()]
+
+    def display_column(self, column):
+        """One numeric column in display order, starting with whoever's turn it is"""
+        return self._buffers[column][self.turn_order()]
+
+    def row_versions(self, slots):
+        """Version stamp of each slot's row; it changes whenever the row's contents do"""
+        return self._versions[slots].tolist()
+
+    def rows(self, slots):
+        """Dataframe rows for the given slots"""
+        columns = [[self.types[slot] for slot in slots], [self.names[slot] for slot in slots]]
+        columns += [self._buffers[column][slots].tolist() for column in INT_COLUMNS]
+        return [list(row) for row in zip(*columns)]
+
+    def to_table(self):
+        """Rows for the Battle tab's Dataframe, starting with whoever's turn it is"""
+        return self.rows(self.turn_order())
@@ -0,0 +1,65 @@
+"""Bounded LRU cache for parsed character sheets"""
+import threading
+from collections import OrderedDict
+
+
+class SheetCache:
+    """Parsed sheets keyed by their storage location.
+
+    Every entry remembers the (mtime_ns, size) signature of the file it was
+    parsed from. get() only returns it while the caller's fresh signature still
+    matches, so a sheet edited outside the app is re-read instead of served stale.
+    The cache is bounded both by entry count and by the total size of the
+    source files, evicting least recently used sheets first.
+
+    Cached sheets are shared between callers and must be treated as read-only.
+    """
+
+    def __init__(self, max_entries=1024, max_bytes=64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # key -> (signature, value)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def _weight(signature):
+        return signature[1] if signature else 0
+
+    def get(self, key, signature):
+        """Return the cached value if its signature still matches, else None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != signature:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, signature, value):
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= self._weight(old[0])
+            self._entries[key] = (signature, value)
+            self._bytes += self._weight(signature)
+            while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+                _, (old_signature, _) = self._entries.popitem(last=False)
+                self._bytes -= self._weight(old_signature)
+
+    def discard(self, key):
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= self._weight(old[0])
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
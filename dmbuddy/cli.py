@@ -0,0 +1,337 @@
+"""Command line interface: python -m dmbuddy <command>
+
+Works on the same data folder (or SQLite database) as the web app, without
+importing Gradio. Input and output are JSON so commands can be chained:
+
+    python -m dmbuddy add-to-battle Goblin --type enemy --count 6 \
+        | python -m dmbuddy add-to-battle Thorin \
+        | python -m dmbuddy start \
+        | python -m dmbuddy next-turn --damage "Goblin 1=12" > battle.json
+
+Commands that work on a battle read it from stdin (nothing on stdin starts a
+new one) and write the updated battle to stdout.
+"""
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+from dmbuddy.archive import export_archive, import_archive
+from dmbuddy.batch import PREVIEW_LIMIT, parse_rules, plan_batch, select_sheets
+from dmbuddy.battle import BattleState
+from dmbuddy.core import CharacterSheet, Campaign, add_to_battle, collect_loot, next_turn, roll_initiative
+from dmbuddy.importer import BATCH_SIZE, MAPPINGS, WORKERS, BulkImport, custom_mapping
+from dmbuddy.journal import BattleJournal, list_battles
+from dmbuddy.loot import LootLedger
+from dmbuddy.storage import CHARACTER_TYPES, import_json_tree, open_storage
+
+
+def read_json(stream, default=None):
+    if stream.isatty():
+        return default  # Nothing piped in
+    text = stream.read()
+    if not text.strip():
+        return default
+    return json.loads(text)
+
+
+def write_json(data, stream):
+    json.dump(data, stream, indent=2)
+    stream.write("\n")
+
+
+def read_battle(stream):
+    """The battle document on stdin: a BattleState dict plus the loot ledger so far"""
+    data = read_json(stream, {}) or {}
+    return BattleState.from_dict(data), LootLedger.from_dict(data.get("loot") or {})
+
+
+def write_battle(battle_state, ledger, stream):
+    data = battle_state.to_dict()
+    data["loot"] = ledger.to_dict()
+    write_json(data, stream)
+
+
+def parse_damage(entries, battle_state):
+    """Per-row damage from "Name=amount" entries"""
+    rows = {battle_state.names[slot]: i for i, slot in enumerate(battle_state.turn_order())}
+    damage = [0] * len(battle_state)
+    for entry in entries:
+        name, _, amount = entry.rpartition("=")
+        if name not in rows:
+            raise ValueError(f"No combatant named {name!r} in the battle")
+        damage[rows[name]] += int(amount)
+    return damage
+
+
+def command_list(campaign, args, stdin, stdout):
+    types = [args.type] if args.type else CHARACTER_TYPES
+    if args.prefix or args.offset or args.limit is not None:
+        limit = args.limit if args.limit is not None else sys.maxsize
+        write_json({character_type: campaign.name_page(character_type, args.prefix, args.offset, limit)[0] for character_type in types}, stdout)
+    else:
+        write_json({character_type: campaign.names(character_type) for character_type in types}, stdout)
+
+
+def command_import(campaign, args, stdin, stdout):
+    if args.json_tree:
+        # Sheets that can't be read are skipped and listed in the report
+        write_json(import_json_tree(args.json_tree, campaign.storage), stdout)
+        return
+    sheets = read_json(stdin, [])
+    if isinstance(sheets, dict):
+        sheets = [sheets]
+    records = []
+    for data in sheets:
+        if not data.get("name"):
+            raise ValueError("Every imported sheet needs a name")
+        character_type = args.type or data.get("type") or "player"
+        # Fill in anything the sheet leaves out with the defaults a new sheet has
+        character = CharacterSheet(character_type)
+        character.update(data)
+        character.character_type = character_type
+        records.append((character_type, character.name, character.to_dict()))
+    count = campaign.save_many(records)
+    write_json({"imported": count}, stdout)
+
+
+def command_bulk_import(campaign, args, stdin, stdout):
+    mapping = MAPPINGS[args.format]
+    if args.map:
+        with open(args.map, 'r') as f:
+            mapping = custom_mapping(mapping, json.load(f))
+    last_report = [0.0]
+
+    def progress(report):
+        now = time.monotonic()
+        if args.quiet or now - last_report[0] < 1:
+            return
+        last_report[0] = now
+        share = report["offset"] / report["size"] * 100 if report["size"] else 100
+        rate = report["records"] / report["elapsed"] if report["elapsed"] else 0
+        print(f"{share:5.1f}%  {report['imported']} imported, {report['skipped']} skipped, {rate:.0f} records/s", file=sys.stderr)
+
+    bulk = BulkImport(
+        campaign, args.source, character_type=args.type, mapping=mapping, items_key=args.items,
+        batch_size=args.batch_size, workers=args.workers, restart=args.restart, progress=progress,
+    )
+    try:
+        report = bulk.run()
+    except KeyboardInterrupt:
+        raise SystemExit("dmbuddy: import interrupted; run the same command again to carry on") from None
+    write_json({key: report[key] for key in ("records", "imported", "skipped", "errors", "resumed", "done")}, stdout)
+
+
+def command_export(campaign, args, stdin, stdout):
+    types = [args.type] if args.type else CHARACTER_TYPES
+    if args.names:
+        sheets = [campaign.load_sheet(args.type or "player", name).to_dict() for name in args.names]
+    else:
+        sheets = [data for character_type in types for _, data in campaign.storage.iter_sheets(character_type)]
+    write_json(sheets, stdout)
+
+
+def command_export_archive(campaign, args, stdin, stdout):
+    if args.archive == "-":
+        # The archive itself goes to stdout, so the report goes to stderr
+        report = export_archive(campaign, stdout.buffer, incremental=args.incremental)
+        write_json(report, sys.stderr)
+    else:
+        write_json(export_archive(campaign, args.archive, incremental=args.incremental), stdout)
+
+
+def command_import_archive(campaign, args, stdin, stdout):
+    if args.archive == "-":
+        report = import_archive(campaign, stdin.buffer, prune=args.prune)
+    else:
+        with open(args.archive, 'rb') as f:
+            report = import_archive(campaign, f, prune=args.prune)
+    write_json(report, stdout)
+
+
+def command_search(campaign, args, stdin, stdout):
+    filters = {"class": args.character_class, "race": args.race, "alignment": args.alignment}
+    hits = campaign.find(" ".join(args.words), args.type, filters, args.level_min, args.level_max)
+    columns = ["type", "name", "class", "race", "level", "alignment"]
+    results = [dict(zip(columns, row)) for row in campaign.search.describe(hits[:args.limit])]
+    write_json({"count": len(hits), "results": results, "facets": campaign.search.facet_counts(hits)}, stdout)
+
+
+def command_batch(campaign, args, stdin, stdout):
+    rules = parse_rules([line for rule in args.rules for line in rule.splitlines()])
+    filters = {"class": args.character_class, "race": args.race, "alignment": args.alignment}
+    selected = select_sheets(campaign, args.type, " ".join(args.words), filters, args.level_min, args.level_max, args.names)
+    plan = plan_batch(campaign, selected, rules)
+    saved = 0 if args.dry_run else plan.commit(campaign)
+    columns = ["type", "name", "field", "before", "after"]
+    write_json({
+        "selected": len(plan.selected),
+        "changed": len(plan.changes),
+        "saved": saved,
+        "missing": [name for _, name in plan.missing],
+        "changes": [dict(zip(columns, row)) for row in plan.preview(args.limit)],
+    }, stdout)
+
+
+def command_add_to_battle(campaign, args, stdin, stdout):
+    battle_state, ledger = read_battle(stdin)
+    for name in args.names:
+        add_to_battle(campaign, battle_state, args.type, name, count=args.count, roll_hp=args.roll_hp)
+    write_battle(battle_state, ledger, stdout)
+
+
+def command_start(campaign, args, stdin, stdout):
+    battle_state, ledger = read_battle(stdin)
+    roll_initiative(battle_state, auto_roll=not args.no_auto_roll)
+    write_battle(battle_state, ledger, stdout)
+
+
+def command_next_turn(campaign, args, stdin, stdout):
+    battle_state, ledger = read_battle(stdin)
+    damage = parse_damage(args.damage, battle_state)
+    _, loot = next_turn(campaign, battle_state, damage)
+    ledger.add_many(loot)
+    write_battle(battle_state, ledger, stdout)
+
+
+def command_loot(campaign, args, stdin, stdout):
+    if args.names:
+        ledger = LootLedger()
+        ledger.add_many(collect_loot(campaign, [(args.type, name, name) for name in args.names]))
+    else:
+        _, ledger = read_battle(stdin)
+    write_json(ledger.to_dict(), stdout)
+
+
+def command_battles(campaign, args, stdin, stdout):
+    directory = campaign.storage.sidecar_path("battles")
+    write_json([{"battle": battle_id, "rounds": BattleJournal(directory, battle_id).rounds()} for battle_id in list_battles(directory)], stdout)
+
+
+def command_replay(campaign, args, stdin, stdout):
+    journal = BattleJournal(campaign.storage.sidecar_path("battles"), args.battle)
+    if not journal.path.exists():
+        raise FileNotFoundError(f"No battle journal named {args.battle!r}")
+    battle_state, ledger, _, _ = journal.restore(args.round)
+    write_battle(battle_state, ledger, stdout)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="dmbuddy", description="DMBuddy roster and battle tools (JSON in, JSON out)")
+    parser.add_argument("--data", default="data", help="Data folder (default: data)")
+    parser.add_argument("--storage", choices=["json", "sqlite"], default="json", help="Storage backend (default: json)")
+    parser.add_argument("--database", default=None, help="Path of the SQLite database (default: <data>/dmbuddy.db)")
+    parser.add_argument("--binary-sheets", action="store_true", help="Save sheets in the binary layout (SQLite only)")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    command = commands.add_parser("list", help="List saved sheet names by type")
+    command.add_argument("--type", choices=CHARACTER_TYPES)
+    command.add_argument("--prefix", default="", help="Only names starting with this")
+    command.add_argument("--offset", type=int, default=0, help="Skip this many matching names")
+    command.add_argument("--limit", type=int, default=None, help="Most names to list per type")
+    command.set_defaults(handler=command_list)
+
+    command = commands.add_parser("import", help="Save sheets read from stdin (one sheet or a list)")
+    command.add_argument("--type", choices=CHARACTER_TYPES, help="Type for every sheet (default: each sheet's own type)")
+    command.add_argument("--json-tree", type=Path, help="Copy a whole JSON data folder instead of reading stdin")
+    command.set_defaults(handler=command_import)
+
+    command = commands.add_parser("bulk-import", help="Stream a large JSON dump (bestiary, party export) into the campaign")
+    command.add_argument("source", type=Path, help="JSON array, JSON Lines, or an object holding the records under --items")
+    command.add_argument("--type", choices=CHARACTER_TYPES, help="Type for every sheet (default: the record's own, else enemy)")
+    command.add_argument("--format", choices=sorted(MAPPINGS), default="auto", help="How records map onto sheets (default: auto)")
+    command.add_argument("--map", type=Path, help='JSON file of extra {"sheet field": "source.path"} mappings')
+    command.add_argument("--items", help='Key holding the list of records (e.g. "results")')
+    command.add_argument("--batch-size", type=int, default=BATCH_SIZE, help=f"Sheets per write (default: {BATCH_SIZE})")
+    command.add_argument("--workers", type=int, default=WORKERS, help=f"Batches written at once (default: {WORKERS})")
+    command.add_argument("--restart", action="store_true", help="Ignore the progress saved by an interrupted run")
+    command.add_argument("--quiet", action="store_true", help="No progress lines on stderr")
+    command.set_defaults(handler=command_bulk_import)
+
+    command = commands.add_parser("export", help="Write sheets to stdout as a JSON list")
+    command.add_argument("names", nargs="*", help="Sheets to export (default: all of them)")
+    command.add_argument("--type", choices=CHARACTER_TYPES)
+    command.set_defaults(handler=command_export)
+
+    command = commands.add_parser("export-archive", help="Write every sheet into one compressed archive (backups, moving a campaign)")
+    command.add_argument("archive", help='Archive to write, e.g. campaign.tar.gz ("-" for stdout)')
+    command.add_argument("--incremental", action="store_true", help="Only the sheets changed since the last export")
+    command.set_defaults(handler=command_export_archive)
+
+    command = commands.add_parser("import-archive", help="Load the sheets of an archive, skipping the ones already up to date")
+    command.add_argument("archive", help='Archive to read ("-" for stdin)')
+    command.add_argument("--prune", action="store_true", help="Also delete sheets the archive doesn't list")
+    command.set_defaults(handler=command_import_archive)
+
+    command = commands.add_parser("search", help="Find sheets by words in their equipment, features or spells and by facets")
+    command.add_argument("words", nargs="*", help='Words that must all appear (e.g. fireball, or fire* for a prefix)')
+    command.add_argument("--type", choices=CHARACTER_TYPES)
+    command.add_argument("--class", dest="character_class")
+    command.add_argument("--race")
+    command.add_argument("--alignment")
+    command.add_argument("--level-min", type=int)
+    command.add_argument("--level-max", type=int)
+    command.add_argument("--limit", type=int, default=100, help="Most results to list (default: 100)")
+    command.set_defaults(handler=command_search)
+
+    command = commands.add_parser("batch", help="Apply rules (e.g. \"level += 1\") to many sheets in one all-or-nothing save")
+    command.add_argument("rules", nargs="+", help="Rules such as hit_points_current = hit_points_max, level += 1 or gold split 250")
+    command.add_argument("--type", choices=CHARACTER_TYPES)
+    command.add_argument("--name", dest="names", action="append", default=[], help="Only this sheet (repeatable; default: every match)")
+    command.add_argument("--words", nargs="+", default=[], help="Only sheets with these words in their equipment, features or spells")
+    command.add_argument("--class", dest="character_class")
+    command.add_argument("--race")
+    command.add_argument("--alignment")
+    command.add_argument("--level-min", type=int)
+    command.add_argument("--level-max", type=int)
+    command.add_argument("--dry-run", action="store_true", help="Only show what would change")
+    command.add_argument("--limit", type=int, default=PREVIEW_LIMIT, help=f"Most changed fields to list (default: {PREVIEW_LIMIT})")
+    command.set_defaults(handler=command_batch)
+
+    command = commands.add_parser("add-to-battle", help="Add sheets to the battle on stdin")
+    command.add_argument("names", nargs="+")
+    command.add_argument("--type", choices=CHARACTER_TYPES, default="player")
+    command.add_argument("--count", type=int, default=1, help="Numbered copies of an enemy to add")
+    command.add_argument("--roll-hp", action="store_true", help="Roll each enemy copy's HP from its hit dice")
+    command.set_defaults(handler=command_add_to_battle)
+
+    command = commands.add_parser("start", help="Roll initiative and sort the battle on stdin")
+    command.add_argument("--no-auto-roll", action="store_true", help="Keep rolled initiative at 0 instead of rolling a d20")
+    command.set_defaults(handler=command_start)
+
+    command = commands.add_parser("next-turn", help="Apply damage, collect loot from the defeated, pass the turn on")
+    command.add_argument("--damage", action="append", default=[], metavar="NAME=AMOUNT", help="Damage taken this turn (repeatable)")
+    command.set_defaults(handler=command_next_turn)
+
+    command = commands.add_parser("battles", help="List the journaled battles, newest first")
+    command.set_defaults(handler=command_battles)
+
+    command = commands.add_parser("replay", help="Rebuild a journaled battle, as it ended or as a round started")
+    command.add_argument("battle", help="Battle id, as listed by the battles command")
+    command.add_argument("--round", type=int, default=None, help="Stop at the start of this round")
+    command.set_defaults(handler=command_replay)
+
+    command = commands.add_parser("loot", help="Loot collected in the battle on stdin, or carried by the named sheets")
+    command.add_argument("names", nargs="*")
+    command.add_argument("--type", choices=CHARACTER_TYPES, default="enemy")
+    command.set_defaults(handler=command_loot)
+    return parser
+
+
+def main(argv=None, stdin=None, stdout=None):
+    stdin = stdin or sys.stdin
+    stdout = stdout or sys.stdout
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.binary_sheets and args.storage != "sqlite":
+        parser.error("--binary-sheets needs --storage sqlite")
+    campaign = Campaign(open_storage(args.storage, args.data, args.database, args.binary_sheets))
+    try:
+        args.handler(campaign, args, stdin, stdout)
+    except (FileNotFoundError, ValueError) as e:
+        print(f"dmbuddy: {e}", file=sys.stderr)
+        return 1
+    finally:
+        campaign.close()
+    return 0
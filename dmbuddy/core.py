@@ -0,0 +1,247 @@
+"""Roster and battle operations without the Gradio UI.
+
+The web app (dnd-manager.py) and the command line (python -m dmbuddy) both
+go through this module: a Campaign wraps one storage backend with its name
+index, parsed-sheet cache and optional write-behind queue, and the battle
+functions below operate on a BattleState given a Campaign to read sheets from.
+"""
+import numpy as np
+
+from dmbuddy.battle import INITIATIVE_DICE, roll_hit_points, to_int
+from dmbuddy.cache import SheetCache
+from dmbuddy.dice import roll_many
+from dmbuddy.roster import PAGE_SIZE, RosterIndex
+from dmbuddy.search import SearchIndex
+from dmbuddy.sheet import CharacterSheet
+from dmbuddy.storage import check_sheet_name
+from dmbuddy.writer import WriteBehind
+
+
+class Campaign:
+    """The character sheets in one storage backend.
+
+    With write_behind, saves are queued on a background writer (see
+    dmbuddy.writer) and return immediately; without it they are written
+    before save_sheet() returns, which is what short-lived scripts want.
+    """
+
+    def __init__(self, storage, write_behind=False, save_delay=0.5):
+        self.storage = storage
+        # Index of saved names so dropdowns don't rescan the storage on every click
+        self.roster = RosterIndex(storage)
+        # Words and facets of every sheet, loaded on the first search
+        self.search = SearchIndex(storage)
+        # Parsed sheets shared by loading, adding to battle and loot collection
+        self.cache = SheetCache()
+        self.writer = WriteBehind(storage, delay=save_delay, on_saved=self._written) if write_behind else None
+
+    def _written(self, character_type, name, data):
+        """Called by the background writer once a queued save is on disk"""
+        self.cache.put(self.storage.locator(character_type, name), self.storage.signature(character_type, name), CharacterSheet.from_dict(data))
+        self.roster.add(character_type, self.storage.listed_name(character_type, name))
+        self.search.written(character_type, self.storage.listed_name(character_type, name), self.storage.signature(character_type, name))
+
+    def load_sheet(self, character_type, name):
+        """Load a CharacterSheet, reusing the parsed copy while the stored sheet is unchanged.
+
+        The returned sheet is shared with other callers, so don't modify it.
+        Raises FileNotFoundError if the sheet doesn't exist.
+        """
+        # A save still waiting for the background writer is newer than what's stored
+        data = self.writer.pending(character_type, name) if self.writer else None
+        if data is not None:
+            return CharacterSheet.from_dict(data)
+        key = self.storage.locator(character_type, name)
+        signature = self.storage.signature(character_type, name)
+        if signature is None:
+            self.cache.discard(key)
+            raise FileNotFoundError(f"No {character_type} named {name!r}")
+        character = self.cache.get(key, signature)
+        if character is None:
+            character = self.storage.load_sheet(character_type, name)
+            self.cache.put(key, signature, character)
+        return character
+
+    def save_sheet(self, character_type, name, character):
+        """Save a CharacterSheet under its type and name.
+
+        Raises ValueError for a name that can't be stored (see
+        storage.check_sheet_name()), and writer.SaveError if an earlier
+        queued save had to be given up on.
+        """
+        check_sheet_name(name)
+        character.parse_equipment()
+        data = character.to_dict()
+        listed = self.storage.listed_name(character_type, name)
+        if self.writer:
+            self.writer.save(character_type, name, data)
+            self.search.add(character_type, listed, data)
+            self.writer.check()
+        else:
+            self.storage.save(character_type, name, data)
+            signature = self.storage.signature(character_type, name)
+            self.cache.put(self.storage.locator(character_type, name), signature, character)
+            self.search.add(character_type, listed, data, signature)
+            self.search.written(character_type, listed, signature)
+        self.roster.add(character_type, listed)
+
+    def save_many(self, records, atomic=False, expected=None):
+        """Save (character_type, name, attributes) records in one go (one transaction on SQLite).
+
+        Every record is checked (and migrated) as a CharacterSheet first, so a
+        bad one raises ValueError before anything is written. With atomic the
+        JSON backend also saves them all or nothing, and expected (each
+        record's signature when it was read) makes it raise
+        storage.SheetsChanged instead if a sheet was saved since (see
+        storage.save_all()).
+        """
+        checked = []
+        for character_type, name, attributes in records:
+            check_sheet_name(name)
+            character = CharacterSheet.from_dict(attributes, character_type)
+            character.parse_equipment()
+            checked.append((character_type, name, character.to_dict()))
+        records = checked
+        if self.writer:
+            self.writer.flush()
+        if atomic:
+            count = self.storage.save_all(records, expected)
+        else:
+            count = self.storage.save_many(records)
+        for character_type, name, attributes in records:
+            listed = self.storage.listed_name(character_type, name)
+            self.cache.discard(self.storage.locator(character_type, name))
+            self.roster.add(character_type, listed)
+            signature = self.storage.signature(character_type, name)
+            self.search.add(character_type, listed, attributes, signature)
+            self.search.written(character_type, listed, signature)
+        return count
+
+    def delete_sheet(self, character_type, name):
+        """Delete a sheet; raises FileNotFoundError if there is no such sheet"""
+        queued = self.writer.discard(character_type, name) if self.writer else False
+        self.cache.discard(self.storage.locator(character_type, name))
+        try:
+            self.storage.delete(character_type, name)
+        except FileNotFoundError:
+            if not queued:
+                raise  # A brand new sheet may not have reached the disk yet
+        self.roster.remove(character_type, self.storage.listed_name(character_type, name))
+        self.search.remove(character_type, self.storage.listed_name(character_type, name))
+
+    def names(self, character_type):
+        """Sorted names of the saved sheets of one type"""
+        return self.roster.names(character_type)
+
+    def all_agents(self):
+        """Sorted "name (type)" labels for every saved sheet"""
+        return self.roster.all_agents()
+
+    def name_page(self, character_type=None, prefix="", offset=0, limit=PAGE_SIZE):
+        """One page of saved names starting with prefix (every agent's "name (type)" without a type), and the total"""
+        return self.roster.page(character_type, prefix, offset, limit)
+
+    def find(self, text="", character_type=None, filters=None, level_min=None, level_max=None):
+        """(type, name) of the sheets matching a full-text and facet query (see dmbuddy.search)"""
+        return self.search.search(text, character_type, filters, level_min, level_max)
+
+    def close(self):
+        """Write anything still queued, save the search index and release the storage"""
+        if self.writer:
+            self.writer.close()
+        self.search.close()
+        self.storage.close()
+
+
+def add_to_battle(campaign, battle_state, character_type, name, count=1, roll_hp=False, journal=None):
+    """Add a sheet to the battle, or several numbered copies of an enemy (e.g. 12 x Goblin).
+
+    The sheet is read once. With roll_hp each copy gets HP rolled from the
+    sheet's hit dice; otherwise they all start at the sheet's current HP.
+    Players and NPCs can only be in a battle once. Returns the names added.
+    Raises FileNotFoundError if the sheet doesn't exist.
+
+    With a BattleJournal (see dmbuddy.journal) the battle functions here also
+    record what they did, so the battle can be recovered or replayed.
+    """
+    character = campaign.load_sheet(character_type, name)
+    if character_type != "enemy":
+        if battle_state.contains(character_type, name):
+            return []  # Agent already in battle
+        count, roll_hp = 1, False
+    count = max(int(count or 1), 1)
+
+    hps = None
+    if roll_hp:
+        hps = roll_hit_points(character.hit_dice_total, count)
+    if hps is None:
+        hps = np.full(count, character.hit_points_current, dtype=np.int64)
+
+    default_initiative = character.initiative_bonus
+    armor_class = character.armor_class
+    if count == 1:
+        battle_state.append(character_type, name, default_initiative=default_initiative, armor_class=armor_class, hp=hps[0])
+        added = [name]
+    else:
+        added = battle_state.spawn(character_type, name, hps, default_initiative=default_initiative, armor_class=armor_class)
+    if journal is not None:
+        journal.record(
+            "add", battle_state, type=character_type, sheet=name, spawn=count > 1,
+            hps=[to_int(hp) for hp in hps], default_initiative=default_initiative, armor_class=armor_class,
+        )
+    return added
+
+
+def roll_initiative(battle_state, rolled=None, auto_roll=False, rng=None, journal=None):
+    """Set everyone's rolled initiative (per displayed row) and put the top initiative first.
+
+    rolled defaults to the values already in the battle. With auto_roll,
+    everyone whose rolled initiative is still 0 gets a d20, all in one draw.
+    """
+    if not battle_state:
+        return
+    if rolled is None:
+        rolled = battle_state.display_column("rolled_initiative")
+    rolled = np.array(rolled, dtype=np.int64)
+    if auto_roll:
+        blank = np.flatnonzero(rolled == 0)
+        if len(blank):
+            rolled[blank] = roll_many([INITIATIVE_DICE] * len(blank), rng)
+    battle_state.roll_initiative(rolled)
+    if journal is not None:
+        journal.record("initiative", battle_state, rolled=rolled.tolist())
+
+
+def collect_loot(campaign, defeated_agents):
+    """Loot the defeated combatants carried: a (name, gold, [[item, quantity], ...]) tuple each"""
+    loot = []
+    for character_type, name, sheet in defeated_agents:
+        try:
+            character = campaign.load_sheet(character_type, sheet)
+        except FileNotFoundError:
+            continue  # Character not found, skip
+        loot.append((name, character.gold, character.loot_items()))
+    return loot
+
+
+def next_turn(campaign, battle_state, damage, journal=None):
+    """Apply each displayed row's damage, remove the defeated and pass the turn on.
+
+    Returns (defeated_agents, loot) with the loot the defeated dropped, as
+    given by collect_loot().
+    """
+    if not battle_state:
+        return [], []
+    damage = np.asarray(damage, dtype=np.int64)
+    rows = np.flatnonzero(damage)
+    # Rows move when the defeated leave, so the journal names combatants by join sequence
+    seqs = battle_state.display_seqs() if journal is not None else None
+    defeated_agents = battle_state.apply_damage(damage)
+    loot = collect_loot(campaign, defeated_agents)
+    battle_state.advance()
+    if journal is not None:
+        journal.record(
+            "turn", battle_state, hits=[[seqs[row], int(damage[row])] for row in rows],
+            defeated=[name for _, name, _ in defeated_agents], loot=[[name, gold, items] for name, gold, items in loot],
+        )
+    return defeated_agents, loot
@@ -0,0 +1,72 @@
+"""Row-versioned view of the battle table, so only changes travel to and from the browser.
+
+A TableView remembers which combatant (slot) and which row version sits on
+each line of the table the client is showing. Cell edits arrive one at a time
+(from the Dataframe's edit event, or by diffing a submitted table against the
+last one we sent) and are kept as deltas until a battle action consumes them.
+render() compares the current battle state with what the client has and
+returns nothing when it is unchanged, so an action that changes nothing sends
+nothing back. When something did change the whole table is sent, because
+Gradio's Dataframe can only be given a complete value.
+"""
+from dmbuddy.battle import to_int
+
+
+class TableView:
+    """What the browser's battle table is currently showing"""
+
+    def __init__(self):
+        self.rows = []      # (slot, version) for each displayed row
+        self.sent = []      # the row values last sent, for diffing submitted tables
+        self.edits = {}     # (row, column) -> value typed into the table since the last render
+
+    def record_edit(self, row, column, value):
+        """Remember one cell the user changed"""
+        if 0 <= row < len(self.rows):
+            self.edits[(row, column)] = value
+
+    def diff_table(self, table):
+        """Record every cell of a submitted table that differs from what we last sent"""
+        if table is None:
+            return
+        for row, (submitted, sent) in enumerate(zip(table, self.sent)):
+            if submitted == sent:
+                continue
+            for column, (new, old) in enumerate(zip(submitted, sent)):
+                if new != old:
+                    self.record_edit(row, column, new)
+
+    def edited_column(self, base, column, slots=None):
+        """Per-row values for a column: base values overridden by the user's edits.
+
+        slots is the battle's current turn order. If it no longer matches what
+        the browser shows (another browser changed the battle meanwhile), edits
+        follow their combatant to its current row, and edits to combatants who
+        have left are dropped.
+        """
+        values = base.copy()
+        positions = None
+        if slots is not None and [slot for slot, _ in self.rows] != list(slots):
+            positions = {slot: i for i, slot in enumerate(slots)}
+        for (row, edited_column), value in self.edits.items():
+            if edited_column != column:
+                continue
+            if positions is not None:
+                row = positions.get(self.rows[row][0])
+                if row is None:
+                    continue
+            if row < len(values):
+                values[row] = to_int(value)
+        return values
+
+    def render(self, battle_state):
+        """The rows to show, or None if the client already shows the current state"""
+        slots = battle_state.turn_order() if battle_state else []
+        rows = list(zip(slots, battle_state.row_versions(slots))) if slots else []
+        if rows == self.rows and not self.edits:
+            return None
+        table = battle_state.rows(slots) if slots else []
+        self.rows = rows
+        self.sent = table
+        self.edits = {}
+        return table
@@ -0,0 +1,164 @@
+"""Dice expressions: parse once, roll in vectorized batches.
+
+Supported syntax (case and spaces don't matter):
+
+* ``NdM`` – N dice with M sides (N defaults to 1, ``d%`` is a d100)
+* ``NdMkhK`` / ``NdMklK`` – keep the highest / lowest K dice (``kK`` means kh)
+* ``adv`` / ``dis`` after a die – roll it twice and keep the higher / lower,
+  e.g. ``d20 adv`` or ``1d20+5 dis``
+* any sum of the above and plain numbers, e.g. ``2d6 + 1d4 - 1``
+
+compile_dice() caches parsed expressions, and roll_many() rolls a whole list of
+expressions (say, everyone's initiative) with one random draw per distinct
+kind of dice term.
+"""
+import re
+from functools import lru_cache
+
+import numpy as np
+
+_TERM = re.compile(
+    r"""\s*(?P<sign>[+-])?\s*(?:
+        (?P<count>\d*)\s*d\s*(?P<sides>\d+|%)
+            (?:\s*(?P<keep>kh|kl|k)\s*(?P<kept>\d+))?
+            (?:\s*(?P<mode>advantage|adv|disadvantage|dis))?
+        |(?P<number>\d+)
+    )\s*""",
+    re.IGNORECASE | re.VERBOSE,
+)
+
+# "adv" / "dis" at the very end applies to the first die, so "1d20+5 adv" works
+_TRAILING_MODE = re.compile(r"\s+(advantage|adv|disadvantage|dis)\s*$", re.IGNORECASE)
+
+# Limits so a typo like "1000000d6" can't stall the server
+MAX_DICE = 1000
+MAX_SIDES = 10000
+
+
+class DiceTerm:
+    """count dice with `sides` sides, keeping `keep` of them (highest or lowest), times sign"""
+
+    __slots__ = ("count", "sides", "keep", "highest", "sign")
+
+    def __init__(self, count, sides, keep=None, highest=True, sign=1):
+        self.count = count
+        self.sides = sides
+        self.keep = keep if keep is not None and keep < count else None
+        self.highest = highest
+        self.sign = sign
+
+    @property
+    def group(self):
+        """Terms with the same group can be rolled in one draw"""
+        return (self.count, self.sides, self.keep, self.highest)
+
+    def roll(self, size, rng):
+        """Roll this term `size` times; returns an int array (sign applied)"""
+        dice = rng.integers(1, self.sides + 1, size=(size, self.count))
+        if self.keep is not None:
+            dice.sort(axis=1)
+            dice = dice[:, -self.keep:] if self.highest else dice[:, :self.keep]
+        return self.sign * dice.sum(axis=1)
+
+    def __repr__(self):
+        text = f"{self.count}d{self.sides}"
+        if self.keep is not None:
+            text += f"{'kh' if self.highest else 'kl'}{self.keep}"
+        return ("-" if self.sign < 0 else "") + text
+
+
+class DiceExpression:
+    """A parsed dice expression: dice terms plus a constant"""
+
+    __slots__ = ("text", "terms", "constant")
+
+    def __init__(self, text, terms, constant):
+        self.text = text
+        self.terms = tuple(terms)
+        self.constant = constant
+
+    def roll(self, size=None, rng=None):
+        """Roll once (an int), or `size` times (an int array)"""
+        rng = rng or np.random.default_rng()
+        totals = np.full(size or 1, self.constant, dtype=np.int64)
+        for term in self.terms:
+            totals += term.roll(size or 1, rng)
+        return int(totals[0]) if size is None else totals
+
+    @property
+    def minimum(self):
+        """Lowest possible total"""
+        return self.constant + sum(
+            term.sign * (term.keep or term.count) * (1 if term.sign > 0 else term.sides) for term in self.terms
+        )
+
+    @property
+    def maximum(self):
+        """Highest possible total"""
+        return self.constant + sum(
+            term.sign * (term.keep or term.count) * (term.sides if term.sign > 0 else 1) for term in self.terms
+        )
+
+    def __repr__(self):
+        return f"DiceExpression({self.text!r})"
+
+
+@lru_cache(maxsize=1024)
+def compile_dice(text):
+    """Parse a dice expression; raises ValueError if it isn't one"""
+    source = (text or "").strip()
+    if not source:
+        raise ValueError("Empty dice expression")
+    trailing = _TRAILING_MODE.search(source)
+    if trailing:
+        source = source[:trailing.start()]
+    terms = []
+    constant = 0
+    position = 0
+    while position < len(source):
+        match = _TERM.match(source, position)
+        if not match or match.end() == position or (terms or constant or position) and not match["sign"]:
+            raise ValueError(f"Can't read dice expression {text!r}")
+        position = match.end()
+        sign = -1 if match["sign"] == "-" else 1
+        if match["number"] is not None:
+            constant += sign * int(match["number"])
+            continue
+        count = int(match["count"] or 1)
+        sides = 100 if match["sides"] == "%" else int(match["sides"])
+        if not 1 <= count <= MAX_DICE or not 1 <= sides <= MAX_SIDES:
+            raise ValueError(f"Dice out of range in {text!r}")
+        keep = int(match["kept"]) if match["kept"] else None
+        highest = (match["keep"] or "kh").lower() != "kl"
+        mode = (match["mode"] or "").lower()
+        if mode:
+            # Advantage / disadvantage: roll each die twice, keep the better / worse
+            keep, highest, count = count, mode.startswith("adv"), count * 2
+        terms.append(DiceTerm(count, sides, keep, highest, sign))
+    if trailing:
+        if not terms or terms[0].keep is not None or terms[0].count != 1:
+            raise ValueError(f"Advantage needs a single die to apply to in {text!r}")
+        terms[0] = DiceTerm(2, terms[0].sides, 1, trailing[1].lower().startswith("adv"), terms[0].sign)
+    return DiceExpression(text.strip(), terms, constant)
+
+
+def roll_many(expressions, rng=None):
+    """Roll each expression once and return the results as an int array.
+
+    Terms shared between expressions (e.g. everyone's 1d20) are rolled together
+    in a single draw rather than one expression at a time.
+    """
+    rng = rng or np.random.default_rng()
+    compiled = [compile_dice(e) if isinstance(e, str) else e for e in expressions]
+    totals = np.array([expression.constant for expression in compiled], dtype=np.int64)
+    groups = {}
+    for index, expression in enumerate(compiled):
+        for term in expression.terms:
+            groups.setdefault(term.group, ([], [], term))
+            groups[term.group][0].append(index)
+            groups[term.group][1].append(term.sign)
+    for indices, signs, term in groups.values():
+        # Roll unsigned, then apply each expression's own sign for this term
+        rolls = DiceTerm(term.count, term.sides, term.keep, term.highest).roll(len(indices), rng)
+        np.add.at(totals, indices, rolls * np.array(signs, dtype=np.int64))
+    return totals
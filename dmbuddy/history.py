@@ -0,0 +1,81 @@
+"""Undo and redo for battle actions.
+
+Each battle action is recorded as a BattleChange (see dmbuddy.battle): the
+combatants it touched, before and after, and how the turn order moved.
+Everybody it didn't touch is shared with the live battle rather than copied,
+so a turn in which two of 500 goblins took damage costs a couple of kilobytes
+of history, and undoing it rewrites just those rows however long the fight has
+run. The loot the defeated dropped is kept with the step and taken back out of
+the ledger on undo.
+
+The history is bounded by memory: once its steps add up to more than budget
+bytes the oldest are forgotten. A new action drops the steps that could have
+been redone.
+"""
+from collections import deque
+
+# Bytes of undo history kept per battle
+HISTORY_BUDGET = 2 * 1024 * 1024
+
+
+class HistoryStep:
+    """One undoable action: what it was called, what it changed and the loot it dropped"""
+
+    __slots__ = ("label", "change", "loot", "nbytes")
+
+    def __init__(self, label, change, loot):
+        self.label = label
+        self.change = change
+        self.loot = loot
+        self.nbytes = change.nbytes + 200 * len(loot)
+
+
+class BattleHistory:
+    """Undo and redo stacks for one battle"""
+
+    def __init__(self, budget=HISTORY_BUDGET):
+        self.budget = budget
+        self.nbytes = 0
+        self._undo = deque()
+        self._redo = []
+
+    def record(self, label, change, loot=()):
+        """Add what an action changed (a BattleState.changes_since() result; None if nothing did)"""
+        if change is None:
+            return
+        for step in self._redo:
+            self.nbytes -= step.nbytes
+        self._redo.clear()
+        step = HistoryStep(label, change, list(loot))
+        self._undo.append(step)
+        self.nbytes += step.nbytes
+        while self.nbytes > self.budget and len(self._undo) > 1:
+            self.nbytes -= self._undo.popleft().nbytes
+
+    def undo(self, battle_state, ledger):
+        """Undo the latest action; returns its HistoryStep, or None if there's nothing to undo"""
+        if not self._undo:
+            return None
+        step = self._undo.pop()
+        battle_state.revert(step.change)
+        ledger.remove_many(step.loot)
+        self._redo.append(step)
+        return step
+
+    def redo(self, battle_state, ledger):
+        """Redo the latest undone action; returns its HistoryStep, or None if there's nothing to redo"""
+        if not self._redo:
+            return None
+        step = self._redo.pop()
+        battle_state.reapply(step.change)
+        ledger.add_many(step.loot)
+        self._undo.append(step)
+        return step
+
+    def next_undo(self):
+        """Label of the action Undo would take back, or None"""
+        return self._undo[-1].label if self._undo else None
+
+    def next_redo(self):
+        """Label of the action Redo would repeat, or None"""
+        return self._redo[-1].label if self._redo else None
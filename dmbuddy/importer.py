@@ -0,0 +1,433 @@
+"""Streaming bulk import of large JSON dumps (bestiaries, party exports).
+
+A dump can be a JSON array of records, an object holding that array under
+some key (e.g. ``{"count": 334, "results": [...]}``, read with items_key), or
+one record per line (JSON Lines). iter_records() reads it in chunks and
+decodes one record at a time, so memory stays flat however large the file is.
+
+Each record is mapped onto the sheet fields (see MAPPINGS: "sheet" for
+DMBuddy's own exports, "srd" for SRD-style monster lists such as the 5e API
+and Open5e dumps, "auto" to tell them apart per record), checked as a
+CharacterSheet and collected into batches. Batches are saved with
+Campaign.save_many() on a pool of worker threads, so file writes (and their
+fsyncs) overlap with parsing. Records that can't be read are skipped and
+reported; they never stop the import.
+
+After every batch that has been written, with all the batches before it, a
+checkpoint records how far into the file the import got. Running the same
+import again after an interruption carries on from there; the checkpoint is
+tied to the file's size and modification time, so a changed dump starts over.
+If a name appears twice in a dump, the copy written last is kept.
+"""
+import codecs
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from fractions import Fraction
+from pathlib import Path
+
+from dmbuddy.sheet import ABILITIES, CharacterSheet
+from dmbuddy.storage import CHARACTER_TYPES, atomic_write, check_sheet_name
+
+BATCH_SIZE = 500
+WORKERS = 4
+CHUNK_SIZE = 1 << 20
+# How many skipped records are described in the report (all of them are counted)
+ERRORS_KEPT = 20
+
+# Includes the byte order mark some tools start their files with
+_WHITESPACE = " \t\r\n\ufeff"
+_DECODER = json.JSONDecoder()
+_NUMBER = re.compile(r"-?\d+")
+
+
+def _byte_length(text):
+    return len(text) if text.isascii() else len(text.encode('utf-8'))
+
+
+class _Reader:
+    """Decoded text of a file read in chunks, tracking the byte offset of each position"""
+
+    def __init__(self, f, offset, chunk_size):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.decoder = codecs.getincrementaldecoder('utf-8')()
+        self.buffer = ""
+        self.pos = 0
+        self.offset = offset  # byte offset of buffer[pos]
+        self.eof = False
+        f.seek(offset)
+
+    def fill(self, size=None):
+        """Read another chunk; False at the end of the file"""
+        if self.eof:
+            return False
+        data = self.f.read(size or self.chunk_size)
+        self.buffer = self.buffer[self.pos:] + self.decoder.decode(data, final=not data)
+        self.pos = 0
+        if not data:
+            self.eof = True
+        return True
+
+    def advance(self, end):
+        self.offset += _byte_length(self.buffer[self.pos:end])
+        self.pos = end
+
+    def peek(self):
+        """Next character that isn't whitespace (consuming the whitespace), or "" at the end"""
+        while True:
+            buffer, pos = self.buffer, self.pos
+            while pos < len(buffer) and buffer[pos] in _WHITESPACE:
+                pos += 1
+            self.advance(pos)
+            if pos < len(buffer):
+                return buffer[pos]
+            if not self.fill():
+                return ""
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError(f"Expected {char!r} at byte {self.offset} of the dump")
+        self.advance(self.pos + 1)
+
+    def value(self):
+        """Decode the next JSON value"""
+        self.peek()
+        size = self.chunk_size
+        while True:
+            try:
+                value, end = _DECODER.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError as e:
+                if self.eof:
+                    raise ValueError(f"Invalid JSON at byte {self.offset} of the dump: {e.msg}") from None
+                value, end = None, None
+            # A number (or a value cut off mid-way) may carry on in the next chunk
+            if end is not None and (end < len(self.buffer) or self.eof):
+                self.advance(end)
+                return value
+            size *= 2  # A record bigger than a chunk: read more at a time
+            self.fill(size)
+
+
+def iter_records(f, items_key=None, offset=0, layout=None, chunk_size=CHUNK_SIZE):
+    """Yield (record, layout, end_offset) for every record of a dump opened in binary mode.
+
+    layout is "array" or "lines"; resuming at a saved end_offset needs the
+    layout the records were yielded with.
+    """
+    reader = _Reader(f, offset, chunk_size)
+    if layout is None:
+        first = reader.peek()
+        if first == '{' and items_key:
+            # Skip the wrapping object's other keys until the one holding the records
+            reader.expect('{')
+            while True:
+                if reader.peek() == '}':
+                    raise ValueError(f"The dump has no {items_key!r} list")
+                key = reader.value()
+                reader.expect(':')
+                if key == items_key:
+                    break
+                reader.value()
+                if reader.peek() == ',':
+                    reader.expect(',')
+            first = reader.peek()
+        if first == '[':
+            reader.expect('[')
+            layout = "array"
+        else:
+            layout = "lines"
+
+    if layout == "array":
+        while True:
+            char = reader.peek()
+            if char == ',':
+                reader.expect(',')
+                char = reader.peek()
+            if char == ']' or char == "":
+                return
+            record = reader.value()
+            yield record, layout, reader.offset
+    else:
+        while reader.peek():
+            record = reader.value()
+            yield record, layout, reader.offset
+
+
+# Mapping records onto sheets
+
+def _path(record, path):
+    """Value at a dotted path ("speed.walk"), or None"""
+    value = record
+    for part in path.split('.'):
+        if isinstance(value, dict):
+            value = value.get(part)
+        elif isinstance(value, list) and part.isdigit() and int(part) < len(value):
+            value = value[int(part)]
+        else:
+            return None
+    return value
+
+
+def _loose_int(value):
+    """A whole number from the shapes dumps use: 13, "13 (natural armor)", "30 ft.",
+    {"walk": "30 ft."} or [{"type": "natural", "value": 13}]"""
+    if isinstance(value, list):
+        value = value[0] if value else None
+    if isinstance(value, dict):
+        value = value.get("value", value.get("walk", next(iter(value.values()), None)))
+    if isinstance(value, str):
+        match = _NUMBER.search(value)
+        value = int(match[0]) if match else None
+    return value
+
+
+def _challenge_rating(value):
+    try:
+        return float(Fraction(str(value)))
+    except (ValueError, ZeroDivisionError):
+        return None
+
+
+def _entries(entries):
+    """"Name. Description" lines for a list of named abilities or actions"""
+    lines = []
+    for entry in entries or []:
+        if isinstance(entry, dict):
+            name, desc = entry.get("name", ""), entry.get("desc", "")
+            lines.append(f"{name}. {desc}" if name and desc else str(name or desc))
+        elif entry:
+            lines.append(str(entry))
+    return lines
+
+
+def map_sheet(record):
+    """A record that is already a DMBuddy sheet (e.g. from python -m dmbuddy export)"""
+    return dict(record)
+
+
+def map_srd(record):
+    """An SRD-style monster (5e API and Open5e field names) as a sheet dict"""
+    sheet = {"name": record.get("name")}
+    kind = record.get("type")
+    subtype = record.get("subtype")
+    sheet["race"] = f"{kind} ({subtype})" if kind and subtype else kind
+    sheet["alignment"] = record.get("alignment")
+    sheet["armor_class"] = _loose_int(record.get("armor_class"))
+    sheet["hit_points_max"] = sheet["hit_points_current"] = _loose_int(record.get("hit_points"))
+    sheet["hit_dice_total"] = sheet["hit_dice_remaining"] = record.get("hit_points_roll") or record.get("hit_dice")
+    sheet["speed"] = _loose_int(record.get("speed"))
+
+    abilities = record.get("abilities") if isinstance(record.get("abilities"), dict) else record
+    sheet["abilities"] = {ability: _loose_int(abilities.get(ability)) for ability in ABILITIES}
+    dexterity = _loose_int(abilities.get("dexterity"))
+    if isinstance(dexterity, int):
+        sheet["initiative_bonus"] = (dexterity - 10) // 2
+
+    # Open5e has "dexterity_save": 4; the 5e API lists "Saving Throw: DEX" proficiencies
+    saves = {ability: record.get(f"{ability}_save") is not None for ability in ABILITIES}
+    for proficiency in record.get("proficiencies") or []:
+        name = str(_path(proficiency, "proficiency.name") or "")
+        if name.startswith("Saving Throw:"):
+            short = name.split(":", 1)[1].strip().lower()
+            for ability in ABILITIES:
+                if ability.startswith(short):
+                    saves[ability] = True
+    sheet["saving_throws"] = saves
+
+    challenge = _challenge_rating(record.get("challenge_rating", record.get("cr")))
+    if challenge is not None:
+        sheet["level"] = max(int(challenge), 1)
+        sheet["challenge_rating"] = challenge
+    if record.get("proficiency_bonus") is not None:
+        sheet["proficiency_bonus"] = _loose_int(record.get("proficiency_bonus"))
+    if record.get("size"):
+        sheet["size"] = record["size"]
+
+    features = _entries(record.get("special_abilities"))
+    for heading, key in (("Actions", "actions"), ("Reactions", "reactions"), ("Legendary Actions", "legendary_actions")):
+        lines = _entries(record.get(key))
+        if lines:
+            features += ["", f"{heading}:"] + lines
+    sheet["features"] = "\n".join(features).strip()
+
+    spells = record.get("spell_list") or record.get("spells") or []
+    if isinstance(spells, list):
+        # Open5e lists spells as URLs ending in the spell's slug
+        spells = ", ".join(str(spell).rstrip('/').rsplit('/', 1)[-1].replace('-', ' ').title() for spell in spells)
+    sheet["spells"] = spells
+    sheet["equipment"] = record.get("equipment")
+    sheet["gold"] = _loose_int(record.get("gold"))
+    return {key: value for key, value in sheet.items() if value is not None}
+
+
+def map_auto(record):
+    """DMBuddy sheets as they are, anything else as an SRD monster"""
+    if "hit_points_max" in record or isinstance(record.get("abilities"), dict):
+        return map_sheet(record)
+    return map_srd(record)
+
+
+MAPPINGS = {
+    "auto": map_auto,
+    "sheet": map_sheet,
+    "srd": map_srd,
+}
+
+
+def custom_mapping(base, fields):
+    """A mapping that applies base, then takes each sheet field in fields from a dotted source path"""
+    def mapping(record):
+        sheet = base(record)
+        for key, path in fields.items():
+            value = _path(record, path)
+            if value is not None:
+                sheet[key] = value
+        return sheet
+    return mapping
+
+
+# Importing
+
+def checkpoint_path(campaign, source):
+    """Where progress importing one dump is kept"""
+    digest = hashlib.sha1(str(Path(source).resolve()).encode('utf-8')).hexdigest()[:16]
+    return campaign.storage.sidecar_path("imports") / f"{digest}.json"
+
+
+class BulkImport:
+    """One import of a dump into a campaign; run() does the work.
+
+    character_type is the type for every sheet; None takes each record's own
+    "type" when it is a DMBuddy type, else "enemy". progress, if given, is
+    called with the running report after every batch.
+    """
+
+    def __init__(self, campaign, source, character_type=None, mapping="auto", items_key=None,
+                 batch_size=BATCH_SIZE, workers=WORKERS, restart=False, progress=None):
+        self.campaign = campaign
+        self.source = Path(source)
+        self.character_type = character_type
+        self.mapping = MAPPINGS[mapping] if isinstance(mapping, str) else mapping
+        self.items_key = items_key
+        self.batch_size = max(int(batch_size), 1)
+        self.workers = max(int(workers), 1)
+        self.restart = restart
+        self.progress = progress
+        self.checkpoint = checkpoint_path(campaign, source)
+        self._lock = threading.Lock()
+
+    def _fresh_report(self, stat):
+        return {
+            "source": str(self.source.resolve()),
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "layout": None,
+            "offset": 0,
+            "records": 0,
+            "imported": 0,
+            "skipped": 0,
+            "errors": [],
+            "done": False,
+        }
+
+    def _load_checkpoint(self, stat):
+        if self.restart:
+            return None
+        try:
+            with open(self.checkpoint, 'r') as f:
+                saved = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        if saved.get("size") != stat.st_size or saved.get("mtime_ns") != stat.st_mtime_ns:
+            return None  # The dump changed since; start over
+        return saved
+
+    def _save_checkpoint(self, report):
+        self.checkpoint.parent.mkdir(parents=True, exist_ok=True)
+        atomic_write(self.checkpoint, json.dumps(report, separators=(',', ':')))
+
+    def _sheet(self, record):
+        """(character_type, name, sheet dict) for a record; raises ValueError if it can't be imported"""
+        if not isinstance(record, dict):
+            raise ValueError("not a JSON object")
+        data = self.mapping(record)
+        if not data.get("name"):
+            raise ValueError("no name")
+        character_type = self.character_type or data.get("type")
+        if character_type not in CHARACTER_TYPES:
+            character_type = "enemy"
+        data["type"] = character_type
+        character = CharacterSheet.from_dict(data, character_type)
+        check_sheet_name(character.name)  # The name becomes a file name
+        return character_type, character.name, character.to_dict()
+
+    def run(self):
+        """Import the dump (or the rest of it) and return the report"""
+        stat = os.stat(self.source)
+        report = self._load_checkpoint(stat)
+        resumed = report is not None
+        if report is None:
+            report = self._fresh_report(stat)
+        report["resumed"] = resumed
+        if report["done"]:
+            return report
+
+        started = time.perf_counter()
+        report["elapsed"] = 0.0
+        pending = deque()  # (future, end layout, end offset, records, skipped, errors) in file order
+
+        def finish_oldest():
+            future, layout, offset, records, skipped, errors = pending[0]
+            imported = future.result()  # A failed batch stays queued, so the checkpoint never passes it
+            pending.popleft()
+            report.update(layout=layout, offset=offset)
+            report["records"] += records
+            report["imported"] += imported
+            report["skipped"] += skipped
+            report["errors"] = (report["errors"] + errors)[:ERRORS_KEPT]
+            report["elapsed"] = time.perf_counter() - started
+            self._save_checkpoint(report)
+            if self.progress:
+                self.progress(report)
+
+        batch, skipped, errors = [], 0, []
+        layout, offset = report["layout"], report["offset"]
+        number = report["records"]
+        with open(self.source, 'rb') as f, ThreadPoolExecutor(self.workers, thread_name_prefix="import") as pool:
+            try:
+                for record, layout, offset in iter_records(f, self.items_key, report["offset"], report["layout"]):
+                    number += 1
+                    try:
+                        batch.append(self._sheet(record))
+                    except (ValueError, TypeError) as e:  # TypeError from a mapping given the wrong kind of value
+                        skipped += 1
+                        name = record.get("name") if isinstance(record, dict) else None
+                        errors.append({"record": number, "name": name, "error": str(e)})
+                    if len(batch) + skipped >= self.batch_size:
+                        pending.append((pool.submit(self.campaign.save_many, batch), layout, offset, len(batch) + skipped, skipped, errors))
+                        batch, skipped, errors = [], 0, []
+                        # Keep a couple of batches per worker queued, and no more, so memory stays flat
+                        while len(pending) > self.workers * 2:
+                            finish_oldest()
+                if batch or skipped:
+                    pending.append((pool.submit(self.campaign.save_many, batch), layout, offset, len(batch) + skipped, skipped, errors))
+                while pending:
+                    finish_oldest()
+            except BaseException:
+                # Record whatever was fully written before giving up (e.g. Ctrl+C)
+                while pending:
+                    try:
+                        finish_oldest()
+                    except Exception:
+                        break
+                raise
+        report["done"] = True
+        report["elapsed"] = time.perf_counter() - started
+        self._save_checkpoint(report)
+        return report
@@ -0,0 +1,243 @@
+"""Append-only battle journal with snapshots, replay and rewind.
+
+Every battle action is appended to ``<battles>/<battle id>/journal.jsonl`` as
+it happens, one JSON line per event, with the outcome rather than the intent:
+the HP each added copy got, everyone's rolled initiative, the damage each
+combatant took (by join sequence, which snapshots keep, so ties can't swap who
+is hit) and the loot that dropped. Replaying the lines therefore rebuilds exactly the
+same battle, with no dice involved. An undo or redo (see dmbuddy.history) is
+written with the whole battle and loot as they stood afterwards.
+
+Every time a new round starts (and every SNAPSHOT_EVERY events within a long
+round) the whole battle and loot ledger are written to a snapshot file whose
+name carries the event count and round. Recovering a battle loads the latest
+snapshot and replays only the events after it; rewinding to round N loads the
+latest snapshot taken no later than round N and replays up to the start of
+that round.
+
+Lines are flushed as they are written, so a crash loses at most the event
+being written; a torn last line is ignored on replay and cut off when the
+journal is resumed.
+"""
+import json
+import os
+import re
+import secrets
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+
+from dmbuddy.battle import BattleState
+from dmbuddy.loot import LootLedger
+from dmbuddy.storage import atomic_write
+
+# Events written between snapshots when a round goes on for a long time
+SNAPSHOT_EVERY = 50
+
+JOURNAL_FILENAME = "journal.jsonl"
+_SNAPSHOT = re.compile(r"^snapshot-(\d+)-round-(\d+)\.json$")
+
+
+def new_battle_id():
+    """A sortable, unique name for a battle: its start time plus a random suffix"""
+    return time.strftime("%Y%m%d-%H%M%S") + "-" + secrets.token_hex(3)
+
+
+def list_battles(directory):
+    """Battle ids with a journal in the directory, newest first"""
+    directory = Path(directory)
+    if not directory.is_dir():
+        return []
+    return sorted((path.parent.name for path in directory.glob(f"*/{JOURNAL_FILENAME}")), reverse=True)
+
+
+def apply_event(battle_state, ledger, event):
+    """Replay one journal event onto a battle and its loot ledger.
+
+    Returns (battle_state, ledger): the same objects, or new ones after an undo or redo.
+    """
+    kind = event["event"]
+    if kind == "add":
+        if event["spawn"]:
+            battle_state.spawn(event["type"], event["sheet"], event["hps"], event["default_initiative"], event["armor_class"])
+        else:
+            battle_state.append(
+                event["type"], event["sheet"], event["default_initiative"], event["armor_class"], hp=event["hps"][0]
+            )
+    elif kind == "initiative":
+        battle_state.roll_initiative(event["rolled"])
+    elif kind == "turn":
+        damage = np.zeros(len(battle_state), dtype=np.int64)
+        if "hits" in event:
+            rows = {seq: row for row, seq in enumerate(battle_state.display_seqs())}
+            for seq, amount in event["hits"]:
+                damage[rows[seq]] = amount
+        else:
+            for row, amount in event["damage"]:  # Journals written before hits were recorded by row
+                damage[row] = amount
+        battle_state.apply_damage(damage)
+        ledger.add_many(event["loot"])
+        battle_state.advance()
+    elif kind in ("undo", "redo"):
+        return BattleState.from_dict(event["battle"]), LootLedger.from_dict(event["loot"])
+    else:
+        raise ValueError(f"Unknown battle journal event {kind!r}")
+    return battle_state, ledger
+
+
+class BattleJournal:
+    """The journal and snapshots of one battle.
+
+    Nothing touches the disk until the first event is recorded, so a journal
+    can be handed to every browser session up front. The journal keeps its own
+    copy of the loot ledger, built from the turn events, for its snapshots.
+    """
+
+    def __init__(self, directory, battle_id=None, snapshot_every=SNAPSHOT_EVERY):
+        self.battle_id = battle_id or new_battle_id()
+        self.directory = Path(directory) / self.battle_id
+        self.path = self.directory / JOURNAL_FILENAME
+        self.snapshot_every = snapshot_every
+        self.ledger = LootLedger()
+        self.seq = 0             # events recorded so far
+        self.snapshot_seq = 0    # seq of the latest snapshot
+        self.snapshot_round = 0  # round of the latest snapshot
+        self._file = None
+        self._lock = threading.Lock()
+
+    # Writing
+
+    def _open(self):
+        if self._file is None:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            self._file = open(self.path, 'a', encoding='utf-8')
+
+    def record(self, event, battle_state, **fields):
+        """Append one event that has just been applied to battle_state"""
+        line = {"seq": self.seq + 1, "time": round(time.time(), 3), "round": battle_state.round, "event": event}
+        line.update(fields)
+        with self._lock:
+            self._open()
+            self._file.write(json.dumps(line, separators=(',', ':')) + "\n")
+            self._file.flush()
+            self.seq += 1
+            if event == "turn":
+                self.ledger.add_many(fields.get("loot") or [])
+            elif event in ("undo", "redo"):
+                self.ledger = LootLedger.from_dict(fields["loot"])
+            if battle_state.round > self.snapshot_round or self.seq - self.snapshot_seq >= self.snapshot_every:
+                self._snapshot(battle_state)
+
+    def snapshot(self, battle_state):
+        """Write the battle as it stands, so recovery can start from here"""
+        with self._lock:
+            self._open()
+            self._snapshot(battle_state)
+
+    def _snapshot(self, battle_state):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        data = {
+            "battle_id": self.battle_id,
+            "seq": self.seq,
+            "offset": self._file.tell(),
+            "round": battle_state.round,
+            "time": round(time.time(), 3),
+            "battle": battle_state.to_dict(),
+            "loot": self.ledger.to_dict(),
+        }
+        name = f"snapshot-{self.seq:08d}-round-{battle_state.round:04d}.json"
+        atomic_write(self.directory / name, json.dumps(data, separators=(',', ':')))
+        self.snapshot_seq = self.seq
+        self.snapshot_round = battle_state.round
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    # Reading back
+
+    def snapshots(self):
+        """(seq, round, path) of every snapshot, oldest first"""
+        found = []
+        if self.directory.is_dir():
+            for path in self.directory.iterdir():
+                match = _SNAPSHOT.match(path.name)
+                if match:
+                    found.append((int(match[1]), int(match[2]), path))
+        return sorted(found)
+
+    def rounds(self):
+        """Highest round the journal reached, going by its snapshots"""
+        snapshots = self.snapshots()
+        return snapshots[-1][1] if snapshots else 0
+
+    def restore(self, round_number=None):
+        """(battle_state, ledger, seq, offset) as of the latest event, or as round_number started.
+
+        Only the events after the nearest earlier snapshot are replayed. offset is
+        where the last replayed line ends in the journal file.
+        """
+        candidates = self.snapshots()
+        if round_number is not None:
+            # The first snapshot of a round is taken as it starts; later ones are mid-round
+            starts = [snapshot for snapshot in candidates if snapshot[1] == round_number][:1]
+            candidates = [snapshot for snapshot in candidates if snapshot[1] < round_number] + starts
+        if candidates:
+            with open(candidates[-1][2], 'r', encoding='utf-8') as f:
+                saved = json.load(f)
+            battle_state = BattleState.from_dict(saved["battle"])
+            ledger = LootLedger.from_dict(saved["loot"])
+            seq, offset = saved["seq"], saved["offset"]
+        else:
+            battle_state, ledger, seq, offset = BattleState(), LootLedger(), 0, 0
+
+        if round_number is not None and battle_state.round >= round_number:
+            return battle_state, ledger, seq, offset
+        try:
+            f = open(self.path, 'rb')
+        except FileNotFoundError:
+            return battle_state, ledger, seq, offset
+        with f:
+            f.seek(offset)
+            for raw in f:
+                if not raw.endswith(b"\n"):
+                    break  # Torn last line from a crash mid-write
+                event = json.loads(raw)
+                if event["seq"] <= seq:
+                    offset += len(raw)
+                    continue
+                battle_state, ledger = apply_event(battle_state, ledger, event)
+                seq, offset = event["seq"], offset + len(raw)
+                if round_number is not None and battle_state.round >= round_number:
+                    break
+        return battle_state, ledger, seq, offset
+
+    @classmethod
+    def resume(cls, directory, battle_id, snapshot_every=SNAPSHOT_EVERY):
+        """Reopen a battle to carry on recording it; returns (journal, battle_state, ledger)"""
+        journal = cls(directory, battle_id, snapshot_every)
+        if not journal.path.exists():
+            raise FileNotFoundError(f"No battle journal named {battle_id!r}")
+        battle_state, ledger, seq, offset = journal.restore()
+        # Drop a torn last line so new events start on a line of their own
+        if journal.path.stat().st_size > offset:
+            with open(journal.path, 'r+b') as f:
+                f.truncate(offset)
+        journal.ledger = LootLedger.from_dict(ledger.to_dict())
+        journal.seq = seq
+        snapshots = journal.snapshots()
+        if snapshots:
+            journal.snapshot_seq, journal.snapshot_round = snapshots[-1][0], snapshots[-1][1]
+        return journal, battle_state, ledger
+
+    def fork(self, battle_state, ledger):
+        """A new journal that starts from this battle state (e.g. after rewinding)"""
+        journal = type(self)(self.directory.parent, snapshot_every=self.snapshot_every)
+        journal.ledger = LootLedger.from_dict(ledger.to_dict())
+        journal.snapshot(battle_state)
+        return journal
@@ -0,0 +1,140 @@
+"""Loot parsing and the per-battle loot ledger.
+
+A sheet's free-text equipment is parsed once, when the sheet is saved, into
+(item, quantity) pairs: "2x Dagger", "Dagger x2", "Dagger (2)" and "2 Daggers"
+all read as two of an item. A number followed by a unit is part of the item,
+not a count: "50 ft hempen rope" is one rope. Repeated lines are merged,
+including singular and plural spellings ("2 Daggers" and "Dagger" are three
+of the first spelling seen). During a battle the LootLedger merges everything
+the defeated drop into one count per item (by the same rule) and keeps the
+gold each of them carried.
+"""
+import re
+
+# Words that make a leading number a measure rather than a count ("50 ft hempen rope")
+_UNITS = r"(?:ft|feet|foot|in|inch(?:es)?|yds?|yards?|miles?|lbs?|pounds?|oz|ounces?|gal|gallons?|pints?|days?|cp|sp|ep|gp|pp)"
+# "3 Arrows", "3x Arrows", "3 x Arrows"
+_LEADING_COUNT = re.compile(rf"^(\d+)\s*[x×]?\s+(?!{_UNITS}\b)(.+)$", re.IGNORECASE)
+# "Arrows x3", "Arrows ×3", "Arrows (3)"
+_TRAILING_COUNT = re.compile(r"^(.+?)\s*(?:[x×]\s*(\d+)|\((\d+)\))$", re.IGNORECASE)
+
+# Plural endings: "Rubies" -> "ruby", "Daggers" -> "dagger" (but not "Glass" or "Status")
+_PLURAL = re.compile(r"(?<=\w\w)ies$|(?<=\w\w[^su])s$")
+# A final e is dropped from keys too, so "Axes" and "Axe" (or "Torches" and "Torch") meet
+_FINAL_E = re.compile(r"(?<=\w\w)e$")
+
+
+def item_key(item):
+    """Lower-case singular stem of an item name, so "Daggers" and "dagger" count as one item.
+
+    The noun before " of " is the one made singular ("Potions of Healing"),
+    otherwise the last word.
+    """
+    key = " ".join(item.lower().split())
+    head, of, rest = key.partition(" of ")
+    words = head.split(" ")
+    words[-1] = _FINAL_E.sub("", _PLURAL.sub(lambda match: "y" if match[0] == "ies" else "", words[-1]))
+    return " ".join(words) + of + rest
+
+
+def parse_item(text):
+    """One equipment entry as (item, quantity)"""
+    text = text.strip()
+    match = _LEADING_COUNT.match(text)
+    if match:
+        return match[2].strip(), int(match[1])
+    match = _TRAILING_COUNT.match(text)
+    if match:
+        return match[1].strip(), int(match[2] or match[3])
+    return text, 1
+
+
+def parse_equipment(equipment):
+    """Free-text equipment (one item per line or comma) as merged [item, quantity] pairs"""
+    merged = {}
+    for entry in (equipment or "").replace(',', '\n').split('\n'):
+        if not entry.strip():
+            continue
+        item, quantity = parse_item(entry)
+        if not item or quantity <= 0:
+            continue
+        key = item_key(item)
+        if key in merged:
+            merged[key][1] += quantity
+        else:
+            merged[key] = [item, quantity]
+    return list(merged.values())
+
+
+class LootLedger:
+    """Everything collected in one battle: a count per item and gold per source"""
+
+    def __init__(self):
+        self.items = {}           # item_key(item) -> [item, quantity], in the order first found
+        self.gold_by_source = {}  # combatant name -> gold they carried
+
+    def __bool__(self):
+        return bool(self.items or self.gold_by_source)
+
+    @property
+    def gold(self):
+        return sum(self.gold_by_source.values())
+
+    def add(self, source, gold, items):
+        """Add one defeated combatant's loot"""
+        if gold:
+            self.gold_by_source[source] = self.gold_by_source.get(source, 0) + gold
+        for item, quantity in items:
+            key = item_key(item)
+            entry = self.items.get(key)
+            if entry is None:
+                entry = self.items[key] = [item, 0]
+            entry[1] += quantity
+
+    def add_many(self, loot):
+        """Add (source, gold, items) tuples; returns True if anything changed"""
+        changed = False
+        for source, gold, items in loot:
+            self.add(source, gold, items)
+            changed = changed or bool(gold) or bool(items)
+        return changed
+
+    def remove_many(self, loot):
+        """Take back (source, gold, items) tuples that add_many() added, e.g. when a turn is undone"""
+        for source, gold, items in loot:
+            if gold:
+                left = self.gold_by_source.get(source, 0) - gold
+                if left:
+                    self.gold_by_source[source] = left
+                else:
+                    self.gold_by_source.pop(source, None)
+            for item, quantity in items:
+                key = item_key(item)
+                entry = self.items.get(key)
+                if entry is None:
+                    continue
+                entry[1] -= quantity
+                if entry[1] <= 0:
+                    del self.items[key]
+
+    def item_lines(self):
+        return [f"{item} ×{quantity}" if quantity > 1 else item for item, quantity in self.items.values()]
+
+    def gold_lines(self):
+        return [f"{source}: {gold} gp" for source, gold in self.gold_by_source.items()]
+
+    def to_dict(self):
+        return {
+            "gold": self.gold,
+            "gold_by_source": dict(self.gold_by_source),
+            "items": [list(entry) for entry in self.items.values()],
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        ledger = cls()
+        ledger.gold_by_source = dict(data.get("gold_by_source") or {})
+        for entry in data.get("items") or []:
+            item, quantity = (entry, 1) if isinstance(entry, str) else entry
+            ledger.add(None, 0, [(item, quantity)])
+        return ledger
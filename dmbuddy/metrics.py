@@ -0,0 +1,248 @@
+"""Optional per-handler instrumentation.
+
+Off by default. When enabled (dnd-manager.py --metrics), every event handler
+is wrapped to record its call count, errors and latency histogram, plus what it
+did while running: sheet files read and written (rows, for SQLite), bytes read
+and written, directory scans, the approximate size of its response and the
+size of the battle it worked on. The storage backends report their I/O with
+note(), which is attributed to the handler whose context it runs in (file work
+handed to dmbuddy.workers carries the context along), or to "background" for
+the write-behind thread. Async handlers are timed until they finish.
+
+render() formats everything in the Prometheus text format; an optional trace
+file gets one JSON line per handler call.
+
+When instrumentation is off, instrument() returns handlers unchanged and note()
+returns straight away, so the hooks cost one global lookup.
+"""
+import contextvars
+import inspect
+import json
+import threading
+import time
+from functools import wraps
+
+# Upper bounds of the latency histogram buckets, in seconds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# I/O counters the storage backends report, with their Prometheus help text
+COUNTERS = {
+    "files_read": "Sheet files (or SQLite rows) read",
+    "files_written": "Sheet files (or SQLite rows) written",
+    "bytes_read": "Bytes of sheet data read",
+    "bytes_written": "Bytes of sheet data written",
+    "directory_scans": "Data folders listed",
+    "response_bytes": "Approximate JSON size of handler responses",
+}
+
+# The active Metrics, or None while instrumentation is off
+METRICS = None
+
+# Counters of the handler call running in this context
+_record = contextvars.ContextVar("dmbuddy_metrics_record", default=None)
+
+
+def note(counter, amount=1):
+    """Add to an I/O counter for the running handler (no-op when metrics are off)"""
+    if METRICS is not None:
+        METRICS.note(counter, amount)
+
+
+def note_battle(battle_state):
+    """Report the battle the running handler worked on, for the battle size gauges"""
+    if METRICS is not None:
+        METRICS.note_battle(battle_state)
+
+
+def instrument(fn, name=None):
+    """Wrap an event handler for metrics, or return it unchanged when metrics are off"""
+    if METRICS is None:
+        return fn
+    return METRICS.instrument(fn, name)
+
+
+def enable(trace_path=None):
+    """Turn instrumentation on (call before wiring up handlers)"""
+    global METRICS
+    if METRICS is None:
+        METRICS = Metrics(trace_path)
+    return METRICS
+
+
+def _json_size(value):
+    # Server-side state (battles, ledgers) isn't sent to the browser; count it as null
+    try:
+        return len(json.dumps(value, default=lambda _: None))
+    except (TypeError, ValueError):
+        return 0
+
+
+class HandlerStats:
+    """Everything recorded for one handler"""
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.buckets = [0] * len(LATENCY_BUCKETS)
+        self.latency_sum = 0.0
+        self.counters = dict.fromkeys(COUNTERS, 0)
+
+    def add(self, seconds, counters, error):
+        self.calls += 1
+        self.errors += bool(error)
+        self.latency_sum += seconds
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if seconds <= bound:
+                self.buckets[i] += 1
+                break
+        for counter, amount in counters.items():
+            self.counters[counter] = self.counters.get(counter, 0) + amount
+
+
+class Metrics:
+    """Handler statistics for one running app"""
+
+    def __init__(self, trace_path=None):
+        self.handlers = {}          # handler name -> HandlerStats
+        self.gauges = {}            # name -> (help, callable returning a number)
+        self.battle_combatants = 0  # size of the last battle a handler touched
+        self.battle_bytes = 0
+        self._lock = threading.Lock()
+        self._trace = open(trace_path, 'a', buffering=1) if trace_path else None
+
+    def note(self, counter, amount=1):
+        record = _record.get()
+        if record is not None:
+            record[counter] = record.get(counter, 0) + amount
+        else:
+            self._add("background", 0.0, {counter: amount}, None, count_call=False)
+
+    def note_battle(self, battle_state):
+        self.battle_combatants = len(battle_state)
+        self.battle_bytes = battle_state.memory_usage()
+        record = _record.get()
+        if record is not None:
+            record["battle"] = True  # Not a counter; _finish takes it back out
+
+    def add_gauge(self, name, help_text, read):
+        """Export read() as a gauge, e.g. cache hits"""
+        self.gauges[name] = (help_text, read)
+
+    def instrument(self, fn, name=None):
+        name = name or fn.__name__
+
+        if inspect.iscoroutinefunction(fn):
+            @wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                record = {}
+                token = _record.set(record)
+                result = None
+                error = None
+                started = time.perf_counter()
+                try:
+                    result = await fn(*args, **kwargs)
+                    return result
+                except Exception as e:
+                    error = type(e).__name__
+                    raise
+                finally:
+                    seconds = time.perf_counter() - started
+                    _record.reset(token)
+                    self._finish(name, seconds, record, args, result, error)
+            return async_wrapper
+
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            record = {}
+            token = _record.set(record)
+            result = None
+            error = None
+            started = time.perf_counter()
+            try:
+                result = fn(*args, **kwargs)
+                return result
+            except Exception as e:
+                error = type(e).__name__
+                raise
+            finally:
+                seconds = time.perf_counter() - started
+                _record.reset(token)
+                self._finish(name, seconds, record, args, result, error)
+        return wrapper
+
+    def _finish(self, name, seconds, record, args, result, error):
+        from dmbuddy.battle import BattleState
+
+        record["response_bytes"] = _json_size(result)
+        outputs = result if isinstance(result, (list, tuple)) else [result]
+        battle = next((value for value in (*outputs, *args) if isinstance(value, BattleState)), None)
+        if battle is not None:
+            self.battle_combatants = len(battle)
+            self.battle_bytes = battle.memory_usage()
+        # Server-side battles (dmbuddy.sessions) report themselves through note_battle()
+        touched_battle = record.pop("battle", False) or battle is not None
+        self._add(name, seconds, record, error)
+        if self._trace:
+            line = {"time": round(time.time(), 6), "handler": name, "seconds": round(seconds, 6), "error": error}
+            line.update(record)
+            if touched_battle:
+                line["battle_combatants"] = self.battle_combatants
+                line["battle_bytes"] = self.battle_bytes
+            with self._lock:
+                self._trace.write(json.dumps(line) + "\n")
+
+    def _add(self, name, seconds, counters, error, count_call=True):
+        with self._lock:
+            stats = self.handlers.get(name)
+            if stats is None:
+                stats = self.handlers[name] = HandlerStats()
+            if count_call:
+                stats.add(seconds, counters, error)
+            else:
+                for counter, amount in counters.items():
+                    stats.counters[counter] = stats.counters.get(counter, 0) + amount
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format"""
+        with self._lock:
+            handlers = sorted(self.handlers.items())
+            lines = [
+                "# HELP dmbuddy_handler_calls_total Event handler calls",
+                "# TYPE dmbuddy_handler_calls_total counter",
+            ]
+            lines += [f'dmbuddy_handler_calls_total{{handler="{name}"}} {s.calls}' for name, s in handlers if s.calls]
+            lines += [
+                "# HELP dmbuddy_handler_errors_total Event handler calls that raised",
+                "# TYPE dmbuddy_handler_errors_total counter",
+            ]
+            lines += [f'dmbuddy_handler_errors_total{{handler="{name}"}} {s.errors}' for name, s in handlers if s.calls]
+            lines += [
+                "# HELP dmbuddy_handler_latency_seconds Event handler latency",
+                "# TYPE dmbuddy_handler_latency_seconds histogram",
+            ]
+            for name, s in handlers:
+                if not s.calls:
+                    continue
+                cumulative = 0
+                for bound, count in zip(LATENCY_BUCKETS, s.buckets):
+                    cumulative += count
+                    lines.append(f'dmbuddy_handler_latency_seconds_bucket{{handler="{name}",le="{bound}"}} {cumulative}')
+                lines.append(f'dmbuddy_handler_latency_seconds_bucket{{handler="{name}",le="+Inf"}} {s.calls}')
+                lines.append(f'dmbuddy_handler_latency_seconds_sum{{handler="{name}"}} {s.latency_sum:.6f}')
+                lines.append(f'dmbuddy_handler_latency_seconds_count{{handler="{name}"}} {s.calls}')
+            for counter, help_text in COUNTERS.items():
+                lines += [f"# HELP dmbuddy_{counter}_total {help_text}", f"# TYPE dmbuddy_{counter}_total counter"]
+                lines += [f'dmbuddy_{counter}_total{{handler="{name}"}} {s.counters.get(counter, 0)}' for name, s in handlers]
+            gauges = [
+                ("dmbuddy_battle_combatants", "Combatants in the last battle a handler worked on", self.battle_combatants),
+                ("dmbuddy_battle_state_bytes", "Approximate memory used by that battle", self.battle_bytes),
+            ]
+        gauges += [(name, help_text, read()) for name, (help_text, read) in self.gauges.items()]
+        for name, help_text, value in gauges:
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} gauge", f"{name} {value}"]
+        return "\n".join(lines) + "\n"
+
+    def close(self):
+        if self._trace:
+            self._trace.close()
+            self._trace = None
@@ -0,0 +1,109 @@
+"""In-memory index of saved character names, shared by the whole process"""
+import bisect
+import threading
+
+from dmbuddy.storage import CHARACTER_TYPES
+
+# Names in one page of a picker
+PAGE_SIZE = 50
+
+
+class RosterIndex:
+    """Sorted name lists per character type, kept in sync with the storage backend.
+
+    The backend is listed once on load(). After that the handlers report their
+    own saves and deletes through add() and remove(), and every lookup only asks
+    the backend for a cheap version stamp (a folder mtime or the SQLite data
+    version) so changes made outside the app are still picked up on the next click.
+    """
+
+    def __init__(self, storage, character_types=CHARACTER_TYPES):
+        self.storage = storage
+        self.character_types = list(character_types)
+        self._names = {}
+        self._versions = {}
+        self._agents = None  # cached "name (type)" list for the battle tab
+        self._lock = threading.RLock()
+
+    def load(self):
+        """List every character type once"""
+        with self._lock:
+            for character_type in self.character_types:
+                self._scan(character_type)
+
+    def _scan(self, character_type):
+        version = self.storage.version(character_type)
+        self._names[character_type] = self.storage.list_names(character_type)
+        self._versions[character_type] = version
+        self._agents = None
+
+    def _check(self, character_type):
+        """Relist a character type if something outside the app changed it"""
+        if character_type not in self._names or self.storage.version(character_type) != self._versions.get(character_type):
+            self._scan(character_type)
+
+    def names(self, character_type):
+        """Sorted names for one character type"""
+        with self._lock:
+            self._check(character_type)
+            return list(self._names[character_type])
+
+    def all_agents(self):
+        """Sorted "name (type)" labels across every character type"""
+        with self._lock:
+            return list(self._agent_labels())
+
+    def _agent_labels(self):
+        for character_type in self.character_types:
+            self._check(character_type)
+        if self._agents is None:
+            self._agents = sorted(
+                f"{name} ({character_type})"
+                for character_type, names in self._names.items()
+                for name in names
+            )
+        return self._agents
+
+    def page(self, character_type=None, prefix="", offset=0, limit=PAGE_SIZE):
+        """Up to limit names starting with prefix, from offset on, and how many match in all.
+
+        Without a character type the "name (type)" labels of every agent are paged.
+        Both ends of the match are found by binary search, so a page costs the
+        same however large the roster is.
+        """
+        with self._lock:
+            if character_type:
+                self._check(character_type)
+                names = self._names[character_type]
+            else:
+                names = self._agent_labels()
+            prefix = (prefix or "").strip().lower()
+            start = bisect.bisect_left(names, prefix)
+            end = bisect.bisect_left(names, prefix + "\U0010ffff", start) if prefix else len(names)
+            first = start + max(offset, 0)
+            return names[first:min(first + limit, end)], end - start
+
+    def add(self, character_type, name):
+        """Record a sheet the app just wrote"""
+        with self._lock:
+            if character_type not in self._names:
+                self._scan(character_type)
+            names = self._names[character_type]
+            i = bisect.bisect_left(names, name)
+            if i == len(names) or names[i] != name:
+                names.insert(i, name)
+                self._agents = None
+            # Our own write bumped the version; don't treat it as an outside change
+            self._versions[character_type] = self.storage.version(character_type)
+
+    def remove(self, character_type, name):
+        """Record a sheet the app just deleted"""
+        with self._lock:
+            if character_type not in self._names:
+                self._scan(character_type)
+            names = self._names[character_type]
+            i = bisect.bisect_left(names, name)
+            if i < len(names) and names[i] == name:
+                del names[i]
+                self._agents = None
+            self._versions[character_type] = self.storage.version(character_type)
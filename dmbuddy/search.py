@@ -0,0 +1,259 @@
+"""Full-text and faceted search over saved sheets.
+
+SearchIndex keeps an inverted index from the words in each sheet's equipment,
+features and spells to the sheets that contain them, plus facet buckets for
+type, class, race, alignment and level. A query intersects those sets, so
+finding every enemy with "Fireball" or every NPC above level 5 never opens a
+sheet.
+
+The index is saved next to the data (see the backends' sidecar_path) together
+with each sheet's (mtime, size) signature. On load only sheets whose
+signature changed since then are read again. While the app runs, the Campaign
+reports saves and deletes so the index is updated one sheet at a time, and a
+query first checks the backend's cheap version stamp (like the RosterIndex) to
+catch sheets added or removed outside the app; sheets edited in place by
+another program are picked up on the next load.
+"""
+import bisect
+import json
+import re
+import threading
+
+from dmbuddy.storage import CHARACTER_TYPES, atomic_write, sheet_key
+
+# Free-text fields that are indexed word by word
+TEXT_FIELDS = ("equipment", "features", "spells")
+# Fields that can be filtered on by exact (case-insensitive) value
+FACETS = ("class", "race", "alignment")
+# Bumped whenever the saved layout changes; an older file is rebuilt from the sheets
+INDEX_FORMAT = 1
+INDEX_FILENAME = "search-index.json"
+
+_WORD = re.compile(r"[a-z0-9]+(?:'[a-z]+)?")
+
+
+def tokenize(text):
+    """Lower-cased words of a text field, without duplicates"""
+    return sorted(set(_WORD.findall(str(text or "").lower())))
+
+
+def _level(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class SearchIndex:
+    """Inverted index and facet buckets for every sheet in one storage backend"""
+
+    def __init__(self, storage, path=None):
+        self.storage = storage
+        self.path = path if path is not None else storage.sidecar_path(INDEX_FILENAME)
+        self.loaded = False
+        self.dirty = False
+        self._docs = {}  # (type, key) -> [type, name, signature, facets, level, {field: words}]
+        self._postings = {field: {} for field in TEXT_FIELDS}  # field -> word -> {(type, key)}
+        self._facets = {facet: {} for facet in ("type", *FACETS)}  # facet -> value -> {(type, key)}
+        self._levels = {}  # level -> {(type, key)}
+        self._vocabulary = {}  # field -> sorted words, for prefix queries; rebuilt when stale
+        self._versions = {}
+        self._lock = threading.RLock()
+
+    # Building and updating
+
+    def load(self):
+        """Read the saved index, then bring it up to date with the backend"""
+        with self._lock:
+            if self.loaded:
+                return
+            try:
+                with open(self.path, 'r') as f:
+                    saved = json.load(f)
+            except (FileNotFoundError, json.JSONDecodeError):
+                saved = None
+            if isinstance(saved, dict) and saved.get("format") == INDEX_FORMAT:
+                for character_type, name, signature, facets, level, words in saved["docs"]:
+                    self._insert(character_type, name, tuple(signature) if signature else None, facets, level, words)
+            self.loaded = True
+            for character_type in CHARACTER_TYPES:
+                self._refresh(character_type)
+            if self.dirty:
+                self.save()
+
+    def _refresh(self, character_type):
+        """Re-read the sheets of one type whose signature changed, and drop deleted ones"""
+        version = self.storage.version(character_type)
+        signatures = self.storage.signatures(character_type)
+        keys = {sheet_key(name): name for name in signatures}
+        for doc_key in [doc_key for doc_key in self._docs if doc_key[0] == character_type and doc_key[1] not in keys]:
+            self._remove(doc_key)
+        for key, name in keys.items():
+            doc = self._docs.get((character_type, key))
+            if doc is not None and doc[2] == signatures[name]:
+                continue
+            try:
+                data = self.storage.load(character_type, name)
+            except (FileNotFoundError, ValueError):
+                continue  # Gone since the scan, or unreadable
+            if not isinstance(data, dict):
+                continue  # Valid JSON but not a sheet (e.g. an empty list); unreadable too
+            self._index(character_type, name, data, signatures[name])
+        self._versions[character_type] = version
+
+    def _check(self, character_type):
+        """Refresh a type if something outside the app changed it since we last looked"""
+        if self.storage.version(character_type) != self._versions.get(character_type):
+            self._refresh(character_type)
+
+    def _index(self, character_type, name, data, signature):
+        facets = {facet: str(data.get(facet) or "").strip() for facet in FACETS}
+        words = {field: tokenize(data.get(field)) for field in TEXT_FIELDS}
+        self._remove((character_type, sheet_key(name)))
+        self._insert(character_type, name, signature, facets, _level(data.get("level")), words)
+
+    def _insert(self, character_type, name, signature, facets, level, words):
+        doc_key = (character_type, sheet_key(name))
+        self._docs[doc_key] = [character_type, name, signature, facets, level, words]
+        self._facets["type"].setdefault(character_type, set()).add(doc_key)
+        for facet, value in facets.items():
+            if value:
+                self._facets[facet].setdefault(value.lower(), set()).add(doc_key)
+        if level is not None:
+            self._levels.setdefault(level, set()).add(doc_key)
+        for field, field_words in words.items():
+            postings = self._postings[field]
+            for word in field_words:
+                if word not in postings:
+                    postings[word] = set()
+                    self._vocabulary.pop(field, None)
+                postings[word].add(doc_key)
+        self.dirty = True
+
+    def _remove(self, doc_key):
+        doc = self._docs.pop(doc_key, None)
+        if doc is None:
+            return
+        character_type, _, _, facets, level, words = doc
+        buckets = [(self._facets["type"], character_type)]
+        buckets += [(self._facets[facet], value.lower()) for facet, value in facets.items() if value]
+        if level is not None:
+            buckets.append((self._levels, level))
+        for field, field_words in words.items():
+            buckets += [(self._postings[field], word) for word in field_words]
+        for index, value in buckets:
+            members = index.get(value)
+            if members is not None:
+                members.discard(doc_key)
+                if not members:
+                    del index[value]
+        self.dirty = True
+
+    def add(self, character_type, name, data, signature=None):
+        """Index a sheet the app just saved (its signature is filled in once it is written)"""
+        with self._lock:
+            if not self.loaded:
+                return  # load() will pick it up from the backend
+            self._index(character_type, name, data, signature)
+
+    def written(self, character_type, name, signature):
+        """Record the signature of a sheet the app just wrote"""
+        with self._lock:
+            doc = self._docs.get((character_type, sheet_key(name)))
+            if doc is not None:
+                doc[2] = signature
+                self.dirty = True
+            # Our own write bumped the version; don't treat it as an outside change
+            self._versions[character_type] = self.storage.version(character_type)
+
+    def remove(self, character_type, name):
+        """Drop a sheet the app just deleted"""
+        with self._lock:
+            self._remove((character_type, sheet_key(name)))
+            self._versions[character_type] = self.storage.version(character_type)
+
+    def save(self):
+        """Write the index next to the data"""
+        with self._lock:
+            docs = list(self._docs.values())
+            text = json.dumps({"format": INDEX_FORMAT, "docs": docs}, separators=(',', ':'))
+            self.dirty = False
+        atomic_write(self.path, text)
+
+    def close(self):
+        if self.loaded and self.dirty:
+            self.save()
+
+    # Queries
+
+    def _matching(self, field, word):
+        """Sheets with a word in one field; a trailing * matches every word with that prefix"""
+        postings = self._postings[field]
+        if not word.endswith('*'):
+            return postings.get(word, set())
+        prefix = word[:-1]
+        vocabulary = self._vocabulary.get(field)
+        if vocabulary is None:
+            vocabulary = self._vocabulary[field] = sorted(postings)
+        matches = set()
+        for i in range(bisect.bisect_left(vocabulary, prefix), len(vocabulary)):
+            if not vocabulary[i].startswith(prefix):
+                break
+            matches |= postings.get(vocabulary[i], set())  # words can lose their last sheet after the list is built
+        return matches
+
+    def search(self, text="", character_type=None, filters=None, level_min=None, level_max=None, fields=TEXT_FIELDS):
+        """(type, name) of every sheet matching all the given words and filters, sorted.
+
+        Words are matched in any of the given fields ("fire*" matches by prefix);
+        filters maps class, race or alignment to a value to match exactly.
+        """
+        with self._lock:
+            self.load()
+            for t in ([character_type] if character_type else CHARACTER_TYPES):
+                self._check(t)
+            constraints = []
+            if character_type:
+                constraints.append(self._facets["type"].get(character_type, set()))
+            for facet, value in (filters or {}).items():
+                if value:
+                    constraints.append(self._facets[facet].get(str(value).strip().lower(), set()))
+            if level_min is not None or level_max is not None:
+                low = level_min if level_min is not None else float("-inf")
+                high = level_max if level_max is not None else float("inf")
+                constraints.append(set().union(*(keys for level, keys in self._levels.items() if low <= level <= high)))
+            for word in str(text or "").lower().split():
+                word = word.strip(".,;:!?\"()")
+                if word.rstrip('*'):
+                    constraints.append(set().union(*(self._matching(field, word) for field in fields)))
+            if not constraints:
+                matches = self._docs.keys()
+            else:
+                constraints.sort(key=len)
+                matches = constraints[0].intersection(*constraints[1:])
+            return sorted((self._docs[doc_key][0], self._docs[doc_key][1]) for doc_key in matches)
+
+    def describe(self, hits):
+        """Summary rows (type, name, class, race, level, alignment) for search hits"""
+        with self._lock:
+            rows = []
+            for character_type, name in hits:
+                doc = self._docs.get((character_type, sheet_key(name)))
+                if doc is not None:
+                    facets = doc[3]
+                    rows.append([character_type, name, facets["class"], facets["race"], doc[4], facets["alignment"]])
+            return rows
+
+    def facet_counts(self, hits):
+        """How many of the hits have each type, class, race, alignment and level"""
+        with self._lock:
+            counts = {facet: {} for facet in ("type", *FACETS, "level")}
+            for character_type, name in hits:
+                doc = self._docs.get((character_type, sheet_key(name)))
+                if doc is None:
+                    continue
+                values = {"type": character_type, "level": doc[4], **doc[3]}
+                for facet, value in values.items():
+                    if value not in (None, ""):
+                        counts[facet][value] = counts[facet].get(value, 0) + 1
+            return counts
@@ -0,0 +1,248 @@
+"""Battles kept on the server and shared by every browser looking at them.
+
+A battle lives in one BattleSession: its BattleState, loot ledger, undo
+history (dmbuddy.history) and journal, plus a lock so actions coming from
+several browsers (the DM's screen, a player view on the table's TV) apply one
+at a time. The session ID is the battle's journal id, so it doubles as a
+shareable link (?battle=<id>) and as the name of the battle's folder on disk.
+
+A browser tab keeps only a small BattleView: which session it shows and what
+its battle table currently displays (a dmbuddy.delta.TableView). Requests carry
+just the change they make, and responses just the rows that changed. Every
+change to a session gets a new version stamp, so a tab can tell in O(1) whether
+somebody else changed the battle since it last drew it.
+
+The SessionStore holds sessions in memory while they're in use. Sessions idle
+for longer than idle_timeout, and the least recently used ones once all of them
+together pass memory_budget, are evicted: the journal gets a snapshot (see
+dmbuddy.journal) and is closed, and the session is dropped. The next request
+for an evicted battle resumes it from that snapshot, without its undo history.
+A battle that never recorded anything leaves nothing behind.
+"""
+import itertools
+import re
+import sys
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
+
+from dmbuddy import metrics
+from dmbuddy.battle import BattleState
+from dmbuddy.delta import TableView
+from dmbuddy.history import BattleHistory
+from dmbuddy.journal import BattleJournal
+from dmbuddy.loot import LootLedger
+
+# Seconds without a battle action before a session is written out and dropped
+IDLE_TIMEOUT = 30 * 60
+
+# Bytes all sessions together may hold before the least recently used are evicted
+MEMORY_BUDGET = 256 * 1024 * 1024
+
+# What dmbuddy.journal.new_battle_id() hands out: start time plus a random suffix
+_BATTLE_ID = re.compile(r"^\d{8}-\d{6}-[0-9a-f]{6}$")
+
+# Version stamps shared by all sessions, so a session resumed from disk never repeats one
+_stamps = itertools.count(1)
+
+
+def valid_battle_id(battle_id):
+    """True if battle_id looks like one new_battle_id() made (and is safe to use as a folder name)"""
+    return isinstance(battle_id, str) and _BATTLE_ID.match(battle_id) is not None
+
+
+class BattleSession:
+    """One battle in memory, shared by every browser attached to it"""
+
+    def __init__(self, journal, battle_state=None, ledger=None):
+        self.journal = journal
+        self.battle_state = battle_state if battle_state is not None else BattleState()
+        self.ledger = ledger if ledger is not None else LootLedger()
+        self.history = BattleHistory()
+        self.lock = threading.Lock()
+        self.version = next(_stamps)      # changes whenever the battle does
+        self.loot_version = self.version  # changes whenever the loot does
+        self.last_used = time.monotonic()
+        self.memory = self.memory_usage()
+        self.evicted = False
+
+    @property
+    def session_id(self):
+        return self.journal.battle_id
+
+    def changed(self, loot=False):
+        """Stamp a change, so attached browsers redraw the table (and the loot, with loot)"""
+        self.version = next(_stamps)
+        if loot:
+            self.loot_version = self.version
+
+    def memory_usage(self):
+        """Approximate bytes held: the battle's columns, the loot ledger and the undo history"""
+        ledger = self.ledger
+        total = self.battle_state.memory_usage() + self.history.nbytes
+        total += sys.getsizeof(ledger.items) + sys.getsizeof(ledger.gold_by_source)
+        total += sum(sys.getsizeof(item) + 120 for item, _ in ledger.items.values())
+        total += sum(sys.getsizeof(source) + 32 for source in ledger.gold_by_source)
+        return total
+
+
+class BattleView:
+    """One browser tab's window onto a session: which battle, and what its table shows"""
+
+    def __init__(self):
+        self.session_id = None
+        self.table = TableView()
+        self.version = 0       # session version the tab's table was last drawn from
+        self.loot_version = 0  # likewise for the loot displays
+
+    def attach(self, session_id):
+        """Show another battle; everything is sent afresh on the next render"""
+        self.session_id = session_id
+        self.table = TableView()
+        self.version = self.loot_version = 0
+
+
+class SessionStore:
+    """The battles in memory, by session ID, with idle and memory-budget eviction"""
+
+    def __init__(self, directory, idle_timeout=IDLE_TIMEOUT, memory_budget=MEMORY_BUDGET):
+        self.directory = Path(directory)
+        self.idle_timeout = idle_timeout
+        self.memory_budget = memory_budget
+        self.evictions = 0
+        self._sessions = OrderedDict()  # session id -> BattleSession
+        self._loading = {}              # session id -> Event set once a resume from disk has finished
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def memory_usage(self):
+        """Approximate bytes held by the sessions in memory, as of their last use"""
+        with self._lock:
+            return sum(session.memory for session in self._sessions.values())
+
+    def create(self):
+        """A new, empty battle (nothing is written until its first action)"""
+        return self.add(BattleSession(BattleJournal(self.directory)))
+
+    def add(self, session):
+        """Start holding a session made elsewhere (e.g. a battle forked from a rewind)"""
+        with self._lock:
+            self._sessions[session.session_id] = session
+        self.sweep(keep=session)
+        return session
+
+    def get(self, session_id, create=False):
+        """The session of a battle, resumed from its journal if it isn't in memory.
+
+        Raises FileNotFoundError for a battle that was never journaled, unless
+        create is set: then a new, empty battle is started under that id (a
+        battle evicted before anything happened in it comes back like that).
+
+        The journal is read and replayed without holding the store's lock, so
+        other battles carry on meanwhile; requests for the same battle wait for
+        that one resume instead of starting their own.
+        """
+        if not valid_battle_id(session_id):
+            raise FileNotFoundError(f"No battle named {session_id!r}")
+        while True:
+            with self._lock:
+                session = self._sessions.get(session_id)
+                if session is not None:
+                    return session
+                loading = self._loading.get(session_id)
+                if loading is None:
+                    loading = self._loading[session_id] = threading.Event()
+                    break
+            loading.wait()  # Somebody else is resuming it; then look again
+        try:
+            try:
+                journal, battle_state, ledger = BattleJournal.resume(self.directory, session_id)
+            except FileNotFoundError:
+                if not create:
+                    raise
+                journal, battle_state, ledger = BattleJournal(self.directory, session_id), None, None
+            session = BattleSession(journal, battle_state, ledger)
+            with self._lock:
+                self._sessions[session_id] = session
+        finally:
+            with self._lock:
+                del self._loading[session_id]
+            loading.set()
+        self.sweep(keep=session)
+        return session
+
+    def peek(self, session_id):
+        """The session if it's in memory, without loading it or counting as a use"""
+        return self._sessions.get(session_id)
+
+    @contextmanager
+    def use(self, view):
+        """Hold a tab's battle for one action: ``with store.use(view) as session: ...``
+
+        A tab without a battle gets a new one. The session is locked for the
+        duration, so actions from different browsers never interleave.
+        Afterwards its size is measured again and idle or over-budget sessions
+        are evicted.
+        """
+        while True:
+            if view.session_id is None:
+                view.attach(self.create().session_id)
+            session = self.get(view.session_id, create=True)
+            session.lock.acquire()
+            if not session.evicted:
+                break
+            session.lock.release()  # Evicted while we waited for it; load it again
+        try:
+            yield session
+        finally:
+            session.last_used = time.monotonic()
+            session.memory = session.memory_usage()
+            metrics.note_battle(session.battle_state)
+            session.lock.release()
+            self.sweep(keep=session)
+
+    def evict(self, session, wait=False):
+        """Snapshot a session's battle and drop it from memory; False if it's busy (unless wait)"""
+        if not session.lock.acquire(blocking=wait):
+            return False
+        try:
+            if session.evicted:
+                return True
+            journal = session.journal
+            if journal.seq > journal.snapshot_seq:
+                journal.snapshot(session.battle_state)
+            journal.close()
+            session.evicted = True
+            with self._lock:
+                if self._sessions.get(session.session_id) is session:
+                    del self._sessions[session.session_id]
+            self.evictions += 1
+        finally:
+            session.lock.release()
+        return True
+
+    def sweep(self, keep=None):
+        """Evict sessions idle for too long, then the least recently used while over the memory budget"""
+        with self._lock:
+            sessions = sorted(self._sessions.values(), key=lambda session: session.last_used)
+        cutoff = time.monotonic() - self.idle_timeout
+        total = sum(session.memory for session in sessions)
+        for session in sessions:
+            if session is keep:
+                continue
+            if session.last_used < cutoff or total > self.memory_budget:
+                if self.evict(session):
+                    total -= session.memory
+            elif total <= self.memory_budget:
+                break  # Sorted by last use: nobody after this one is idle either
+
+    def close(self):
+        """Write out every session (e.g. at shutdown)"""
+        with self._lock:
+            sessions = list(self._sessions.values())
+        for session in sessions:
+            self.evict(session, wait=True)
@@ -0,0 +1,381 @@
+"""The character sheet model, its schema versions and its serializers.
+
+A CharacterSheet keeps every field of the sheet in a slot with a fixed type
+(ints, strings, the six ability scores and saving throws as tuples) instead
+of nested dicts, so a cached sheet takes about a quarter of the memory. The
+fields are described once, in FIELDS; everything else here is driven by it.
+
+Loading goes through from_dict(), which migrates an older file to the current
+SCHEMA_VERSION, checks and converts every field (a level saved as 5.0 becomes
+5, a missing gold becomes 0) and fills in the slots in a single pass. A value
+that can't be read raises ValueError naming the field. Keys the schema doesn't
+know are kept as they are and written back out.
+
+Sheets are written as compact JSON with a "schema" field. The SQLite backend
+can also store them in a binary layout (encode()/decode()): the numbers packed
+with struct in one block, followed by the strings, which is well under half
+the size of the JSON and decodes faster. loads() tells the two apart, so a
+database can hold both while sheets are converted as they are saved again.
+"""
+import json
+import math
+import struct
+import sys
+
+from dmbuddy.loot import parse_equipment
+
+# Bumped whenever FIELDS changes; MIGRATIONS brings older sheets up to date
+SCHEMA_VERSION = 2
+
+ABILITIES = ("strength", "dexterity", "constitution", "intelligence", "wisdom", "charisma")
+
+# (key in the saved sheet, kind, default) in the order sheets are written
+FIELDS = (
+    # Basic Info
+    ("name", "str", ""),
+    ("class", "str", ""),
+    ("level", "int", 1),
+    ("race", "str", ""),
+    ("background", "str", ""),
+    ("alignment", "str", ""),
+    ("type", "str", "player"),
+
+    # Combat Stats
+    ("armor_class", "int", 10),
+    ("initiative_bonus", "int", 0),
+    ("speed", "int", 30),
+    ("hit_points_max", "int", 10),
+    ("hit_points_current", "int", 10),
+    ("temporary_hp", "int", 0),
+    ("hit_dice_total", "str", "1d8"),
+    ("hit_dice_remaining", "str", "1d8"),
+
+    # Abilities and saving throw proficiencies, in ABILITIES order
+    ("abilities", "scores", (10,) * len(ABILITIES)),
+    ("saving_throws", "flags", (False,) * len(ABILITIES)),
+
+    # Combat Options
+    ("weapons", "list", ()),
+    ("spellcasting_ability", "str", ""),
+    ("spell_save_dc", "int", 10),
+    ("spell_attack_bonus", "int", 0),
+
+    # Other
+    ("gold", "int", 0),
+    ("equipment", "str", ""),
+    ("features", "str", ""),
+    ("spells", "str", ""),
+    ("proficiency_bonus", "int", 2),
+
+    # Equipment parsed into merged [item, quantity] pairs when the sheet is saved
+    ("equipment_items", "items", None),
+)
+
+# Attribute names for keys that aren't valid (or clear) Python names
+_SLOTS = {"class": "character_class", "type": "character_type"}
+# Short values repeated across a bestiary, shared between sheets
+_INTERNED = {"class", "race", "background", "alignment", "type", "hit_dice_total", "hit_dice_remaining", "spellcasting_ability"}
+
+_FIELD_SLOTS = tuple((key, _SLOTS.get(key, key), kind, default) for key, kind, default in FIELDS)
+
+
+def _migrate_v1(data):
+    """Sheets saved before the schema was versioned: gold was added later, and
+    the UI saved its numbers as floats (both handled by the field checks)"""
+    data.setdefault("gold", 0)
+    return data
+
+
+# Version -> function upgrading a sheet dict from that version to the next
+MIGRATIONS = {
+    1: _migrate_v1,
+}
+
+
+def _check_int(key, value, default):
+    if value is None or value == "":
+        return default
+    if type(value) is int:
+        return value
+    if isinstance(value, float) and math.isfinite(value):
+        return int(value)
+    if isinstance(value, int) or hasattr(value, "__index__"):
+        return int(value)  # bools and numpy integers
+    if isinstance(value, str):
+        try:
+            return int(value)
+        except ValueError:
+            try:
+                number = float(value)
+            except ValueError:
+                number = math.nan
+            if math.isfinite(number):
+                return int(number)
+    raise ValueError(f"Invalid {key}: {value!r} is not a whole number")
+
+
+def _check_str(key, value, default):
+    if type(value) is str:
+        return sys.intern(value) if key in _INTERNED and len(value) < 32 else value
+    if value is None:
+        return default
+    if isinstance(value, (int, float)):
+        return str(value)
+    raise ValueError(f"Invalid {key}: {value!r} is not text")
+
+
+def _check_bool(key, value):
+    if value is None:
+        return False
+    if isinstance(value, (bool, int)):
+        return bool(value)
+    raise ValueError(f"Invalid {key}: {value!r} is not true or false")
+
+
+def _check_scores(key, value, default):
+    if value is None:
+        return default
+    if isinstance(value, dict):
+        return tuple(_check_int(f"{key}.{ability}", value.get(ability), 10) for ability in ABILITIES)
+    if isinstance(value, (list, tuple)) and len(value) == len(ABILITIES):
+        return tuple(_check_int(f"{key}.{ability}", score, 10) for ability, score in zip(ABILITIES, value))
+    raise ValueError(f"Invalid {key}: {value!r}")
+
+
+def _check_flags(key, value, default):
+    if value is None:
+        return default
+    if isinstance(value, dict):
+        return tuple(_check_bool(f"{key}.{ability}", value.get(ability)) for ability in ABILITIES)
+    if isinstance(value, (list, tuple)) and len(value) == len(ABILITIES):
+        return tuple(_check_bool(f"{key}.{ability}", flag) for ability, flag in zip(ABILITIES, value))
+    raise ValueError(f"Invalid {key}: {value!r}")
+
+
+def _check_list(key, value, default):
+    if value is None:
+        return list(default)
+    if isinstance(value, (list, tuple)):
+        return list(value)
+    raise ValueError(f"Invalid {key}: {value!r} is not a list")
+
+
+def _check_items(key, value, default):
+    if value is None:
+        return None
+    if not isinstance(value, (list, tuple)):
+        raise ValueError(f"Invalid {key}: {value!r} is not a list")
+    items = []
+    for entry in value:
+        if not isinstance(entry, (list, tuple)) or len(entry) != 2 or not isinstance(entry[0], (str, int, float)):
+            raise ValueError(f"Invalid {key}: {entry!r} is not an [item, quantity] pair")
+        items.append([str(entry[0]), _check_int(key, entry[1], 1)])
+    return items
+
+
+_CHECKS = {
+    "int": _check_int,
+    "str": _check_str,
+    "scores": _check_scores,
+    "flags": _check_flags,
+    "list": _check_list,
+    "items": _check_items,
+}
+
+
+class CharacterSheet:
+    """One character sheet, with a typed slot per field in FIELDS.
+
+    Fields are read and set as attributes (sheet.level, sheet.abilities[0]);
+    "class" and "type" are sheet.character_class and sheet.character_type.
+    update() sets fields from a dict of saved keys, checking them as it goes.
+    """
+
+    __slots__ = tuple(slot for _, slot, _, _ in _FIELD_SLOTS) + ("extra",)
+
+    def __init__(self, character_type="player"):
+        for _, slot, kind, default in _FIELD_SLOTS:
+            setattr(self, slot, list(default) if kind == "list" else default)
+        self.character_type = character_type
+        self.extra = None  # Keys the schema doesn't know, kept for writing back
+
+    def update(self, data):
+        """Check and set the fields given as saved keys; unknown keys are kept in extra"""
+        if not isinstance(data, dict):
+            raise ValueError(f"A character sheet must be a JSON object, not {type(data).__name__}")
+        for key, value in data.items():
+            field = _BY_KEY.get(key)
+            if field is None:
+                if key != "schema":
+                    if self.extra is None:
+                        self.extra = {}
+                    self.extra[key] = value
+                continue
+            slot, kind, default = field
+            setattr(self, slot, _CHECKS[kind](key, value, default))
+
+    def to_dict(self):
+        """The sheet as saved: a plain dict with every field and the schema version"""
+        data = {"schema": SCHEMA_VERSION}
+        for key, slot, kind, _ in _FIELD_SLOTS:
+            value = getattr(self, slot)
+            if kind == "scores" or kind == "flags":
+                value = dict(zip(ABILITIES, value))
+            elif kind == "list":
+                value = list(value)
+            data[key] = value
+        if self.extra:
+            data.update(self.extra)
+        return data
+
+    @classmethod
+    def from_dict(cls, data, character_type=None):
+        """Migrate, check and load a saved sheet in one pass; raises ValueError for unreadable fields"""
+        if not isinstance(data, dict):
+            raise ValueError(f"A character sheet must be a JSON object, not {type(data).__name__}")
+        version = data.get("schema", 1)
+        if version != SCHEMA_VERSION:
+            data = migrate(data, version)
+        sheet = cls.__new__(cls)
+        sheet.extra = None
+        get = data.get
+        for key, slot, kind, default in _FIELD_SLOTS:
+            value = get(key)
+            if kind == "int":
+                # Inline the common case; everything else goes through the checks
+                if type(value) is not int:
+                    value = _check_int(key, value, default)
+            elif kind == "str" and type(value) is str and key not in _INTERNED:
+                pass
+            else:
+                value = _CHECKS[kind](key, value, default)
+            setattr(sheet, slot, value)
+        if not _KNOWN_KEYS.issuperset(data):
+            sheet.extra = {key: value for key, value in data.items() if key not in _KNOWN_KEYS}
+        if character_type and not data.get("type"):
+            sheet.character_type = character_type
+        return sheet
+
+    def ability(self, name):
+        """One ability score by name"""
+        return self.abilities[ABILITIES.index(name)]
+
+    def parse_equipment(self):
+        """Parse the free-text equipment into merged [item, quantity] pairs (done on every save)"""
+        self.equipment_items = parse_equipment(self.equipment)
+        return self.equipment_items
+
+    def loot_items(self):
+        """Equipment as merged [item, quantity] pairs, parsed when the sheet was saved"""
+        if self.equipment_items is None:
+            return self.parse_equipment()  # Sheets saved before items were parsed on save
+        return self.equipment_items
+
+
+_BY_KEY = {key: (slot, kind, default) for key, slot, kind, default in _FIELD_SLOTS}
+_KNOWN_KEYS = frozenset(_BY_KEY) | {"schema"}
+
+
+def migrate(data, version):
+    """Bring a sheet dict saved with an older schema up to SCHEMA_VERSION"""
+    if not isinstance(version, int) or version > SCHEMA_VERSION:
+        raise ValueError(f"Unsupported sheet schema version {version!r}")
+    data = dict(data)
+    while version < SCHEMA_VERSION:
+        data = MIGRATIONS[version](data)
+        version += 1
+    data["schema"] = version
+    return data
+
+
+# Binary layout
+
+MAGIC = b"DMBS"
+_HEADER = struct.Struct("<4sB")
+_INT_KEYS = tuple(key for key, kind, _ in FIELDS if kind == "int")
+_STR_KEYS = tuple(key for key, kind, _ in FIELDS if kind == "str")
+# Every int field and ability score, then the saving throws as one bit each
+_NUMBERS = struct.Struct("<" + "q" * (len(_INT_KEYS) + len(ABILITIES)) + "B")
+# Byte length of each string, then of the JSON for weapons, equipment_items and extra
+_LENGTHS = struct.Struct("<" + "I" * (len(_STR_KEYS) + 3))
+
+
+def encode(sheet):
+    """The sheet in the binary layout"""
+    flags = 0
+    for i, flag in enumerate(sheet.saving_throws):
+        if flag:
+            flags |= 1 << i
+    try:
+        numbers = _NUMBERS.pack(*(getattr(sheet, _BY_KEY[key][0]) for key in _INT_KEYS), *sheet.abilities, flags)
+    except struct.error as e:
+        raise ValueError(f"Sheet {sheet.name!r} has a number too large to store: {e}") from None
+    chunks = [getattr(sheet, _BY_KEY[key][0]).encode("utf-8") for key in _STR_KEYS]
+    for value in (sheet.weapons, sheet.equipment_items, sheet.extra):
+        chunks.append(b"" if value is None else json.dumps(value, separators=(',', ':')).encode("utf-8"))
+    return b"".join([_HEADER.pack(MAGIC, SCHEMA_VERSION), numbers, _LENGTHS.pack(*map(len, chunks)), *chunks])
+
+
+def decode(raw):
+    """A sheet from the binary layout; raises ValueError if it isn't one"""
+    try:
+        magic, version = _HEADER.unpack_from(raw)
+    except struct.error:
+        magic, version = None, None
+    if magic != MAGIC:
+        raise ValueError("Not a binary character sheet")
+    if version != SCHEMA_VERSION:
+        # Older layouts would be kept here alongside their migration
+        raise ValueError(f"Unsupported binary sheet schema version {version}")
+    try:
+        offset = _HEADER.size
+        numbers = _NUMBERS.unpack_from(raw, offset)
+        offset += _NUMBERS.size
+        lengths = _LENGTHS.unpack_from(raw, offset)
+        offset += _LENGTHS.size
+        view = memoryview(raw)
+        texts = []
+        for length in lengths:
+            texts.append(str(view[offset:offset + length], "utf-8"))
+            offset += length
+    except (struct.error, UnicodeDecodeError) as e:
+        raise ValueError(f"Corrupt binary character sheet: {e}") from None
+    if offset != len(raw):
+        raise ValueError("Corrupt binary character sheet: unexpected trailing bytes")
+
+    sheet = CharacterSheet.__new__(CharacterSheet)
+    for key, value in zip(_INT_KEYS, numbers):
+        setattr(sheet, _BY_KEY[key][0], value)
+    sheet.abilities = numbers[len(_INT_KEYS):-1]
+    flags = numbers[-1]
+    sheet.saving_throws = tuple(bool(flags & (1 << i)) for i in range(len(ABILITIES)))
+    for key, text in zip(_STR_KEYS, texts):
+        setattr(sheet, _BY_KEY[key][0], sys.intern(text) if key in _INTERNED and len(text) < 32 else text)
+    weapons, items, extra = (json.loads(text) if text else None for text in texts[len(_STR_KEYS):])
+    sheet.weapons = weapons or []
+    sheet.equipment_items = items
+    sheet.extra = extra
+    return sheet
+
+
+def dumps(data, binary=False):
+    """A sheet dict (or CharacterSheet) serialized for storage: compact JSON text, or bytes"""
+    if binary:
+        return encode(data if isinstance(data, CharacterSheet) else CharacterSheet.from_dict(data))
+    if isinstance(data, CharacterSheet):
+        data = data.to_dict()
+    return json.dumps(data, separators=(',', ':'))
+
+
+def loads(raw, character_type=None):
+    """A CharacterSheet from stored JSON text or binary bytes"""
+    if isinstance(raw, (bytes, bytearray, memoryview)) and bytes(raw[:len(MAGIC)]) == MAGIC:
+        return decode(raw)
+    return CharacterSheet.from_dict(json.loads(raw), character_type)
+
+
+def loads_dict(raw):
+    """A plain sheet dict from stored JSON text or binary bytes"""
+    if isinstance(raw, (bytes, bytearray, memoryview)) and bytes(raw[:len(MAGIC)]) == MAGIC:
+        return decode(raw).to_dict()
+    return json.loads(raw)
@@ -0,0 +1,195 @@
+"""Monte Carlo encounter simulator.
+
+Plays the current battle out many times to estimate how it's likely to go.
+Each batch of trials is simulated together with NumPy: every array holds one
+value per trial (or per trial and combatant), so one pass of the turn loop
+advances thousands of fights at once. Batches are spread over a process pool.
+
+The combat model is deliberately simple. Everyone rolls initiative (d20 plus
+their bonus) at the start of each fight; on their turn a combatant attacks a
+random living opponent, hitting on d20 + attack bonus >= AC (a natural 20
+always hits and doubles the damage dice, a natural 1 always misses). A fight
+ends when one side is down or after max_rounds rounds.
+"""
+import atexit
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from dmbuddy.battle import to_int
+from dmbuddy.dice import compile_dice
+
+PARTY = 0
+FOES = 1
+
+# Most fights one simulation may play out; every trial keeps a few numbers until the summary
+MAX_TRIALS = 200_000
+
+# Sheets don't record weapon damage, so attacks use this die plus the better of STR/DEX
+DEFAULT_DAMAGE = "1d8"
+
+_POOL = None
+
+
+def ability_modifier(score):
+    return (to_int(score) - 10) // 2
+
+
+def combatant_from_sheet(attributes, character_type, hp=None, armor_class=None, initiative_bonus=None):
+    """Simulator stats for one combatant, taken from its sheet's attributes.
+
+    hp, armor_class and initiative_bonus override the sheet, e.g. with the
+    values currently in the battle table.
+    """
+    abilities = attributes.get("abilities", {}) or {}
+    best = max(ability_modifier(abilities.get("strength", 10)), ability_modifier(abilities.get("dexterity", 10)))
+    weapon_attack = to_int(attributes.get("proficiency_bonus", 2)) + best
+    damage = compile_dice(DEFAULT_DAMAGE).terms[0]
+    return {
+        "side": FOES if character_type == "enemy" else PARTY,
+        "hp": to_int(attributes.get("hit_points_current", 10) if hp is None else hp),
+        "armor_class": to_int(attributes.get("armor_class", 10) if armor_class is None else armor_class),
+        "initiative_bonus": to_int(attributes.get("initiative_bonus", 0) if initiative_bonus is None else initiative_bonus),
+        "attack_bonus": max(weapon_attack, to_int(attributes.get("spell_attack_bonus", 0))),
+        "damage_dice": damage.count,
+        "damage_sides": damage.sides,
+        "damage_bonus": best,
+    }
+
+
+def _columns(combatants):
+    """Combatant dicts to a dict of arrays (cheap to pickle for the workers)"""
+    keys = ("side", "hp", "armor_class", "initiative_bonus", "attack_bonus", "damage_dice", "damage_sides", "damage_bonus")
+    return {key: np.array([c[key] for c in combatants], dtype=np.int64) for key in keys}
+
+
+def simulate_batch(encounter, trials, seed, max_rounds=50):
+    """Simulate `trials` fights at once.
+
+    Returns (party_won, finished, rounds, party_hp_lost) arrays with one entry
+    per trial; finished is False for fights still going after max_rounds.
+    """
+    rng = np.random.default_rng(seed)
+    side = encounter["side"]
+    count = len(side)
+    party = side == PARTY
+    hp = np.tile(encounter["hp"], (trials, 1))
+    start_party_hp = np.maximum(hp[:, party], 0).sum(axis=1)
+
+    # Initiative per trial; the random fraction breaks ties
+    initiative = rng.integers(1, 21, size=(trials, count)) + encounter["initiative_bonus"] + rng.random((trials, count))
+    order = np.argsort(-initiative, axis=1)
+
+    opponents = side[None, :] != side[:, None]  # opponents[a, b]: b is on the other side from a
+    # Room for doubled dice on a critical hit
+    max_dice = 2 * int(encounter["damage_dice"].max()) if count else 0
+    die_index = np.arange(max_dice)
+
+    # Living combatants per side, kept up to date as they drop
+    standing = np.stack([(hp[:, party] > 0).sum(axis=1), (hp[:, ~party] > 0).sum(axis=1)], axis=1)
+    done = (standing == 0).any(axis=1)
+    rounds = np.full(trials, max_rounds, dtype=np.int64)
+    rounds[done] = 0
+
+    for round_number in range(1, max_rounds + 1):
+        for turn in range(count):
+            live = np.flatnonzero(~done)
+            if not len(live):
+                break
+            actor = order[live, turn]
+            acting = hp[live, actor] > 0
+            live, actor = live[acting], actor[acting]
+            if not len(live):
+                continue
+
+            # Pick a random living opponent for each acting combatant
+            targets_ok = opponents[actor] & (hp[live] > 0)
+            scores = np.where(targets_ok, rng.random(targets_ok.shape), -1.0)
+            target = scores.argmax(axis=1)
+            has_target = targets_ok[np.arange(len(live)), target]
+            live, actor, target = live[has_target], actor[has_target], target[has_target]
+            if not len(live):
+                continue
+
+            d20 = rng.integers(1, 21, size=len(live))
+            crit = d20 == 20
+            hit = crit | ((d20 != 1) & (d20 + encounter["attack_bonus"][actor] >= encounter["armor_class"][target]))
+
+            dice = encounter["damage_dice"][actor] * np.where(crit, 2, 1)
+            sides = encounter["damage_sides"][actor]
+            rolled = rng.integers(1, sides[:, None] + 1, size=(len(live), max_dice))
+            rolled = np.where(die_index[None, :] < dice[:, None], rolled, 0)
+            damage = np.maximum(rolled.sum(axis=1) + encounter["damage_bonus"][actor], 1) * hit
+            # Each trial has exactly one actor this turn, so (trial, target) pairs are unique
+            before = hp[live, target]
+            after = before - damage
+            hp[live, target] = after
+            dropped = (before > 0) & (after <= 0)
+            standing[live[dropped], side[target[dropped]]] -= 1
+
+            finished = live[dropped][(standing[live[dropped]] == 0).any(axis=1)]
+            rounds[finished] = round_number
+            done[finished] = True
+        if done.all():
+            break
+
+    party_hp_lost = start_party_hp - np.maximum(hp[:, party], 0).sum(axis=1)
+    party_won = (standing[:, PARTY] > 0) & (standing[:, FOES] == 0)
+    return party_won, done, rounds, party_hp_lost
+
+
+def _pool(workers):
+    global _POOL
+    if _POOL is None:
+        _POOL = ProcessPoolExecutor(max_workers=workers)
+        atexit.register(_POOL.shutdown, cancel_futures=True)
+    return _POOL
+
+
+def simulate_encounter(combatants, trials=10000, seed=None, max_rounds=50, batch_size=5000, workers=None):
+    """Play an encounter out `trials` times and summarise the results.
+
+    The same seed always gives the same result, whatever the number of workers,
+    because trials are split into fixed-size batches with their own child seeds.
+    """
+    trials = max(int(trials), 1)
+    encounter = _columns(combatants)
+    if not len(encounter["side"]) or not (encounter["side"] == PARTY).any() or not (encounter["side"] == FOES).any():
+        raise ValueError("The battle needs at least one player or NPC and one enemy to simulate")
+
+    sizes = [batch_size] * (trials // batch_size)
+    if trials % batch_size:
+        sizes.append(trials % batch_size)
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+
+    if len(sizes) == 1 or workers == 1:
+        results = [simulate_batch(encounter, size, s, max_rounds) for size, s in zip(sizes, seeds)]
+    else:
+        pool = _pool(workers or os.cpu_count())
+        results = list(pool.map(simulate_batch, [encounter] * len(sizes), sizes, seeds, [max_rounds] * len(sizes)))
+
+    party_won, finished, rounds, hp_lost = (np.concatenate(column) for column in zip(*results))
+    percentiles = np.percentile(hp_lost, [10, 25, 50, 75, 90])
+    return {
+        "trials": trials,
+        "party_win_probability": float(party_won.mean()),
+        "expected_rounds": float(rounds[finished].mean()) if finished.any() else float(max_rounds),
+        "unfinished": float(1 - finished.mean()),
+        "party_hp_lost_mean": float(hp_lost.mean()),
+        "party_hp_lost_percentiles": {p: float(v) for p, v in zip((10, 25, 50, 75, 90), percentiles)},
+    }
+
+
+def format_summary(result):
+    """Markdown summary of a simulate_encounter() result for the Battle tab"""
+    percentiles = result["party_hp_lost_percentiles"]
+    lines = [
+        f"**Party wins:** {result['party_win_probability']:.1%} of {result['trials']:,} simulated fights",
+        f"**Expected length:** {result['expected_rounds']:.1f} rounds",
+        f"**Party HP lost:** mean {result['party_hp_lost_mean']:.1f}, median {percentiles[50]:.0f} "
+        f"(10th-90th percentile {percentiles[10]:.0f}-{percentiles[90]:.0f})",
+    ]
+    if result["unfinished"]:
+        lines.append(f"**Still going after the round limit:** {result['unfinished']:.1%}")
+    return "\n\n".join(lines)
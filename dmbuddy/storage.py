@@ -0,0 +1,562 @@
+"""Storage backends for character sheets.
+
+Two backends share one small interface so the rest of the app doesn't care where
+sheets live:
+
+* JsonStorage keeps the original layout, one ``<name>-<type>.json`` file per
+  sheet under ``data/characters``, ``data/npcs`` and ``data/enemies``.
+* SQLiteStorage keeps every sheet in a single database file, with indexed
+  columns for the fields we list and filter on and the full sheet as JSON.
+
+Missing sheets raise FileNotFoundError from both backends, so callers keep
+handling "not found" the same way. load() returns the sheet as a plain dict;
+load_sheet() decodes it straight into a CharacterSheet (see dmbuddy.sheet). Both write atomically: a crash mid-save
+leaves the previous version of the sheet, never a truncated one. save_all()
+extends that to a group of sheets (a batch edit): either all of them are
+saved or, after a crash, the next start finishes the job. Given the signatures
+the caller read, save_all() also checks them while it holds the sheets, so a
+save from elsewhere can't land between the check and the write.
+"""
+import json
+import os
+import sqlite3
+import stat
+import tempfile
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+from pathlib import Path
+
+from dmbuddy.metrics import note
+from dmbuddy.sheet import CharacterSheet, dumps, loads, loads_dict
+
+CHARACTER_TYPES = ["player", "npc", "enemy"]
+
+# Folder name for each character type in the JSON layout
+TYPE_FOLDERS = {
+    "player": "characters",
+    "npc": "npcs",
+    "enemy": "enemies",
+}
+
+# Sheets of an all-or-nothing save that JsonStorage hasn't finished writing yet
+PENDING_BATCH = "pending-batch.json"
+
+
+class SheetsChanged(ValueError):
+    """Sheets of a save_all() that were saved by somebody else since the caller read them"""
+
+    def __init__(self, names):
+        super().__init__(f"Saved since they were read: {', '.join(names)}")
+        self.names = names
+
+
+def sheet_key(name):
+    """Normalised key a sheet is stored under (the filename stem without the type)"""
+    return name.lower().replace(' ', '_')
+
+
+def check_sheet_name(name):
+    """Return name if a sheet can be stored under it, else raise ValueError.
+
+    Names become file names in the JSON layout, so path separators, ".." and
+    a leading "." (hidden and temporary files) are refused, for every backend
+    alike so a campaign can move between them.
+    """
+    if not isinstance(name, str) or not name.strip():
+        raise ValueError("A sheet needs a name")
+    if "/" in name or "\\" in name or "\0" in name:
+        raise ValueError(f"Invalid sheet name {name!r}: it can't contain / or \\")
+    if ".." in name or name.startswith("."):
+        raise ValueError(f"Invalid sheet name {name!r}: it can't start with . or contain ..")
+    return name
+
+
+def listed_name(character_type, key):
+    """Name shown in the dropdowns for a stored key"""
+    return key.replace('_', ' ').replace(f'-{character_type}', '')
+
+
+def name_from_path(path, character_type):
+    """Turn a sheet filename into the name shown in the dropdowns"""
+    return path.stem.replace('_', ' ').replace(f'-{character_type}', '')
+
+
+def atomic_write(path, text):
+    """Write text to a temp file next to path, then rename it into place"""
+    path = Path(path)
+    # The .tmp suffix keeps half-written files out of the *-<type>.json listings
+    fd, temp_path = tempfile.mkstemp(dir=path.parent, prefix=f".{path.stem}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        # mkstemp creates the file owner-only; keep the permissions a plain open() would give
+        try:
+            mode = stat.S_IMODE(os.stat(path).st_mode)
+        except FileNotFoundError:
+            mode = 0o644
+        os.chmod(temp_path, mode)
+        os.replace(temp_path, path)
+    except BaseException:
+        try:
+            os.unlink(temp_path)
+        except FileNotFoundError:
+            pass
+        raise
+
+
+class JsonStorage:
+    """One JSON file per sheet, in a folder per character type"""
+
+    def __init__(self, data_dir):
+        self.data_dir = Path(data_dir)
+        self.data_dir.mkdir(exist_ok=True)
+        self.directories = {}
+        for character_type in CHARACTER_TYPES:
+            directory = self.data_dir / TYPE_FOLDERS[character_type]
+            directory.mkdir(exist_ok=True)
+            self.directories[character_type] = directory
+        # One lock per sheet file, so two sessions saving the same sheet take turns;
+        # re-entrant, as save_all() holds its sheets' locks while it writes them
+        self._file_locks = {}
+        self._locks_lock = threading.Lock()
+        self._finish_batch()
+
+    def _file_lock(self, path):
+        with self._locks_lock:
+            return self._file_locks.setdefault(str(path), threading.RLock())
+
+    def get_directory(self, character_type):
+        """Get the directory based on character type"""
+        return self.directories.get(character_type, self.directories["player"])
+
+    def path_for(self, character_type, name):
+        """Path of the JSON file for a sheet"""
+        return self.get_directory(character_type) / f"{sheet_key(name)}-{character_type}.json"
+
+    def listed_name(self, character_type, name):
+        return name_from_path(self.path_for(character_type, name), character_type)
+
+    def locator(self, character_type, name):
+        """Stable cache key for a sheet"""
+        return str(self.path_for(character_type, name))
+
+    def signature(self, character_type, name):
+        """(mtime_ns, size) of the sheet, or None if it doesn't exist"""
+        try:
+            st = os.stat(self.path_for(character_type, name))
+        except FileNotFoundError:
+            return None
+        return (st.st_mtime_ns, st.st_size)
+
+    def signatures(self, character_type):
+        """{listed name: (mtime_ns, size)} for every sheet of one type, from a single folder scan"""
+        suffix = f'-{character_type}.json'
+        signatures = {}
+        note("directory_scans")
+        with os.scandir(self.get_directory(character_type)) as entries:
+            for entry in entries:
+                if entry.name.endswith(suffix) and not entry.name.startswith('.'):
+                    try:
+                        st = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    signatures[name_from_path(Path(entry.name), character_type)] = (st.st_mtime_ns, st.st_size)
+        return signatures
+
+    def sidecar_path(self, filename):
+        """Where to keep a file derived from the sheets, such as the search index"""
+        return self.data_dir / filename
+
+    def list_names(self, character_type):
+        directory = self.get_directory(character_type)
+        note("directory_scans")
+        return sorted({name_from_path(f, character_type) for f in directory.glob(f'*-{character_type}.json')})
+
+    def version(self, character_type):
+        """Changes whenever a sheet of this type is added or removed"""
+        try:
+            return os.stat(self.get_directory(character_type)).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def _read(self, character_type, name):
+        with open(self.path_for(character_type, name), 'r') as f:
+            text = f.read()
+        note("files_read")
+        note("bytes_read", len(text))
+        return text
+
+    def load(self, character_type, name):
+        return json.loads(self._read(character_type, name))
+
+    def load_sheet(self, character_type, name):
+        return loads(self._read(character_type, name), character_type)
+
+    def save(self, character_type, name, data):
+        """Write the sheet to a temp file next to it, then rename it into place"""
+        path = self.path_for(character_type, name)
+        text = dumps(data)
+        with self._file_lock(path):
+            atomic_write(path, text)
+        note("files_written")
+        note("bytes_written", len(text))
+
+    def save_many(self, records):
+        """Save (character_type, name, data) records"""
+        count = 0
+        for character_type, name, data in records:
+            self.save(character_type, name, data)
+            count += 1
+        return count
+
+    def save_all(self, records, expected=None):
+        """Save (character_type, name, data) records all or nothing.
+
+        Every new sheet is first written to one pending-batch file, with the
+        signature its sheet had beforehand. Only once that is safely on disk
+        are the sheets written into place, and the file is removed after the
+        last one. If a write fails partway, the sheets already written are put
+        back as they were before the error is raised. A crash in between leaves
+        the file, and the next JsonStorage opened on this folder writes the
+        rest, except sheets saved again since the batch began.
+
+        expected, if given, holds each record's signature as the caller last
+        read it; if any sheet has another one, SheetsChanged is raised and
+        nothing is written. Every sheet's lock is held from that check to the
+        end, so a save() of one of them waits until the batch is written.
+        """
+        records = list(records)
+        with ExitStack() as locks:
+            for path in sorted({str(self.path_for(character_type, name)) for character_type, name, _ in records}):
+                locks.enter_context(self._file_lock(path))
+            return self._save_all(records, expected)
+
+    def _save_all(self, records, expected):
+        entries, previous, stale = [], [], []
+        for index, (character_type, name, data) in enumerate(records):
+            signature = self.signature(character_type, name)
+            try:
+                previous.append(self._read(character_type, name) if signature is not None else None)
+            except FileNotFoundError:
+                signature = None
+                previous.append(None)
+            if expected is not None and signature != expected[index]:
+                stale.append(name)
+            entries.append([character_type, name, dumps(data), list(signature) if signature is not None else None])
+        if stale:
+            raise SheetsChanged(stale)
+        pending = self.sidecar_path(PENDING_BATCH)
+        atomic_write(pending, json.dumps(entries, separators=(',', ':')))
+        written = 0
+        try:
+            for character_type, name, text, _ in entries:
+                self._write(character_type, name, text)
+                written += 1
+        except Exception:
+            try:
+                for (character_type, name, _, _), text in zip(entries[:written], previous):
+                    if text is None:
+                        self.delete(character_type, name)
+                    else:
+                        self._write(character_type, name, text)
+            except OSError as e:
+                print(f"Couldn't undo a partly saved batch ({e}); the rest of it is saved on the next start")
+            else:
+                pending.unlink()
+            raise
+        pending.unlink()
+        return len(entries)
+
+    def _write(self, character_type, name, text):
+        path = self.path_for(character_type, name)
+        with self._file_lock(path):
+            atomic_write(path, text)
+        note("files_written")
+        note("bytes_written", len(text))
+
+    def _finish_batch(self):
+        """Write the rest of a save_all() interrupted by a crash"""
+        pending = self.sidecar_path(PENDING_BATCH)
+        try:
+            with open(pending, 'r') as f:
+                entries = json.load(f)
+        except FileNotFoundError:
+            return
+        except json.JSONDecodeError:
+            entries = []  # Never fully written, so none of its sheets were either
+        for character_type, name, text, before in entries:
+            signature = self.signature(character_type, name)
+            if (list(signature) if signature is not None else None) != before:
+                # Written by the batch before the crash, or saved by somebody since: leave it
+                try:
+                    current = self._read(character_type, name)
+                except FileNotFoundError:
+                    current = None
+                if current != text:
+                    print(f"Not finishing the interrupted batch save of {character_type} {name!r}: it was saved again since")
+                continue
+            self._write(character_type, name, text)
+        pending.unlink()
+
+    def delete(self, character_type, name):
+        path = self.path_for(character_type, name)
+        with self._file_lock(path):
+            path.unlink()
+
+    def iter_sheets(self, character_type=None, on_error=None):
+        """Yield (character_type, data) for every stored sheet.
+
+        Files that aren't valid JSON are skipped, after on_error(path, error) if given.
+        """
+        types = [character_type] if character_type else CHARACTER_TYPES
+        for t in types:
+            note("directory_scans")
+            for path in sorted(self.get_directory(t).glob(f'*-{t}.json')):
+                try:
+                    with open(path, 'r') as f:
+                        text = f.read()
+                    note("files_read")
+                    note("bytes_read", len(text))
+                    yield t, json.loads(text)
+                except FileNotFoundError:
+                    continue
+                except json.JSONDecodeError as e:
+                    if on_error:
+                        on_error(path, e)
+
+    def close(self):
+        pass
+
+
+class SQLiteStorage:
+    """Every sheet in one SQLite file, with indexed name/type/class/level/AC columns.
+
+    With binary, sheets are written in the packed layout of dmbuddy.sheet
+    instead of JSON; either kind is read back, so the switch needs no copy.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS sheets (
+            type        TEXT NOT NULL,
+            key         TEXT NOT NULL,
+            name        TEXT NOT NULL,
+            class       TEXT,
+            level       INTEGER,
+            armor_class INTEGER,
+            data        TEXT NOT NULL,
+            updated_ns  INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (type, key)
+        );
+        CREATE INDEX IF NOT EXISTS sheets_type_name ON sheets (type, name);
+        CREATE INDEX IF NOT EXISTS sheets_class ON sheets (class);
+        CREATE INDEX IF NOT EXISTS sheets_level ON sheets (level);
+        CREATE INDEX IF NOT EXISTS sheets_armor_class ON sheets (armor_class);
+    """
+
+    def __init__(self, db_path, binary=False):
+        self.db_path = Path(db_path)
+        self.binary = binary
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        # Gradio runs handlers on worker threads, so share one connection behind a lock
+        self._conn = sqlite3.connect(str(self.db_path), check_same_thread=False, isolation_level=None)
+        self._lock = threading.RLock()
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.executescript(self.SCHEMA)
+            columns = {row[1] for row in self._conn.execute("PRAGMA table_info(sheets)")}
+            if "updated_ns" not in columns:
+                self._conn.execute("ALTER TABLE sheets ADD COLUMN updated_ns INTEGER NOT NULL DEFAULT 0")
+
+    @contextmanager
+    def transaction(self):
+        """Run a block of statements as one atomic write"""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._conn
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def listed_name(self, character_type, name):
+        return listed_name(character_type, sheet_key(name))
+
+    def locator(self, character_type, name):
+        """Stable cache key for a sheet"""
+        return f"{self.db_path}#{character_type}/{sheet_key(name)}"
+
+    def signature(self, character_type, name):
+        """(updated_ns, size) of the sheet, or None if it doesn't exist"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT updated_ns, length(data) FROM sheets WHERE type = ? AND key = ?",
+                (character_type, sheet_key(name)),
+            ).fetchone()
+        return tuple(row) if row else None
+
+    def list_names(self, character_type):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT name FROM sheets WHERE type = ? ORDER BY name", (character_type,)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def signatures(self, character_type):
+        """{listed name: (updated_ns, size)} for every sheet of one type"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT name, updated_ns, length(data) FROM sheets WHERE type = ?", (character_type,)
+            ).fetchall()
+        return {name: (updated_ns, size) for name, updated_ns, size in rows}
+
+    def sidecar_path(self, filename):
+        """Where to keep a file derived from the sheets, such as the search index"""
+        return self.db_path.with_name(f"{self.db_path.stem}-{filename}")
+
+    def version(self, character_type):
+        """Changes whenever another connection (e.g. an import) commits"""
+        with self._lock:
+            return self._conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def _read(self, character_type, name):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT data FROM sheets WHERE type = ? AND key = ?", (character_type, sheet_key(name))
+            ).fetchone()
+        if row is None:
+            raise FileNotFoundError(f"No {character_type} named {name!r}")
+        note("files_read")
+        note("bytes_read", len(row[0]))
+        return row[0]
+
+    def load(self, character_type, name):
+        return loads_dict(self._read(character_type, name))
+
+    def load_sheet(self, character_type, name):
+        return loads(self._read(character_type, name), character_type)
+
+    def _row(self, character_type, name, data):
+        key = sheet_key(name)
+        return (
+            character_type,
+            key,
+            listed_name(character_type, key),
+            data.get("class"),
+            _as_int(data.get("level")),
+            _as_int(data.get("armor_class")),
+            dumps(data, self.binary),
+            time.time_ns(),
+        )
+
+    _UPSERT = """
+        INSERT INTO sheets (type, key, name, class, level, armor_class, data, updated_ns)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (type, key) DO UPDATE SET
+            name = excluded.name, class = excluded.class, level = excluded.level,
+            armor_class = excluded.armor_class, data = excluded.data, updated_ns = excluded.updated_ns
+    """
+
+    def save(self, character_type, name, data):
+        row = self._row(character_type, name, data)
+        with self.transaction() as conn:
+            conn.execute(self._UPSERT, row)
+        note("files_written")
+        note("bytes_written", len(row[6]))
+
+    def save_many(self, records):
+        """Save (character_type, name, data) records in a single transaction"""
+        rows = [self._row(character_type, name, data) for character_type, name, data in records]
+        with self.transaction() as conn:
+            before = conn.total_changes
+            conn.executemany(self._UPSERT, rows)
+            count = conn.total_changes - before
+        note("files_written", count)
+        note("bytes_written", sum(len(row[6]) for row in rows))
+        return count
+
+    def save_all(self, records, expected=None):
+        """Save records all or nothing (one transaction already does that).
+
+        With expected, as JsonStorage.save_all(): SheetsChanged, writing
+        nothing, if a sheet's signature isn't the one the caller read.
+        """
+        with self._lock:  # Held from the check through the transaction
+            if expected is not None:
+                stale = [name for (character_type, name, _), signature in zip(records, expected)
+                         if self.signature(character_type, name) != signature]
+                if stale:
+                    raise SheetsChanged(stale)
+            return self.save_many(records)
+
+    def delete(self, character_type, name):
+        with self.transaction() as conn:
+            cursor = conn.execute(
+                "DELETE FROM sheets WHERE type = ? AND key = ?", (character_type, sheet_key(name))
+            )
+            if cursor.rowcount == 0:
+                raise FileNotFoundError(f"No {character_type} named {name!r}")
+
+    def iter_sheets(self, character_type=None):
+        """Yield (character_type, data) for every stored sheet"""
+        query = "SELECT type, data FROM sheets"
+        params = ()
+        if character_type:
+            query += " WHERE type = ?"
+            params = (character_type,)
+        with self._lock:
+            rows = self._conn.execute(query + " ORDER BY type, name", params).fetchall()
+        for t, data in rows:
+            note("files_read")
+            note("bytes_read", len(data))
+            yield t, loads_dict(data)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def _as_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def open_storage(kind, data_dir, db_path=None, binary=False):
+    """Create the storage backend selected on the command line"""
+    if kind == "sqlite":
+        return SQLiteStorage(db_path or Path(data_dir) / "dmbuddy.db", binary)
+    return JsonStorage(data_dir)
+
+
+def import_json_tree(data_dir, storage):
+    """Copy every sheet from a JSON data folder into another backend in one transaction.
+
+    Each sheet is checked (and upgraded) as CharacterSheet.from_dict() loads
+    it; sheets that can't be read are skipped and listed, like the bulk
+    importer does. Returns {"imported", "skipped", "errors"}.
+    """
+    source = JsonStorage(data_dir)
+    errors = []
+
+    def unreadable(path, error):
+        errors.append({"file": str(path), "name": None, "error": str(error)})
+
+    def records():
+        for character_type, data in source.iter_sheets(on_error=unreadable):
+            name = data.get("name") if isinstance(data, dict) else None
+            try:
+                sheet = CharacterSheet.from_dict(data, character_type)
+                check_sheet_name(sheet.name)
+            except (ValueError, TypeError) as e:
+                errors.append({"type": character_type, "name": name, "error": str(e)})
+                continue
+            yield character_type, sheet.name, sheet.to_dict()
+
+    count = storage.save_many(records())
+    return {"imported": count, "skipped": len(errors), "errors": errors}
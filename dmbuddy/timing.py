@@ -0,0 +1,29 @@
+"""Startup timing report, so slow cold starts are easy to spot"""
+import time
+
+
+class StartupTimer:
+    """Records how long each startup phase took.
+
+    Create it as early as possible (before the heavy imports) and call mark()
+    at the end of each phase; report() gives a one-line summary.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self._last = self.started
+        self.phases = []  # (label, seconds)
+
+    def mark(self, label):
+        """End the current phase, naming it label"""
+        now = time.perf_counter()
+        self.phases.append((label, now - self._last))
+        self._last = now
+
+    @property
+    def total(self):
+        return self._last - self.started
+
+    def report(self):
+        details = ", ".join(f"{label} {seconds:.2f}s" for label, seconds in self.phases)
+        return f"Startup took {self.total:.2f}s ({details})"
@@ -0,0 +1,74 @@
+"""Bounded worker pool that keeps blocking file work off Gradio's event loop.
+
+The web handlers are plain functions that read and write sheets, scan folders
+and append to battle journals. FileWorkers.offload() turns one into an async
+handler that runs it on a small pool of threads, so a slow folder scan for one
+player only occupies one worker while everybody else's requests carry on.
+
+Reads run side by side. Handlers that change something are given a key (a
+sheet, or a browser tab's view of a battle): calls with the same key run one at a
+time, in the order they arrived, and calls with different keys run in
+parallel. Keys are only kept while a call holding them is running or waiting.
+"""
+import asyncio
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial, wraps
+
+# Threads doing file work for the web handlers
+IO_WORKERS = 8
+
+
+class FileWorkers:
+    """A lazily started thread pool plus per-key ordering for the web handlers"""
+
+    def __init__(self, max_workers=IO_WORKERS):
+        self.max_workers = max_workers  # Can be changed until the first call
+        self._pool = None
+        self._locks = {}  # key -> [asyncio.Lock, calls holding or waiting for it]
+
+    @property
+    def pool(self):
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(max(int(self.max_workers), 1), thread_name_prefix="dmbuddy-io")
+        return self._pool
+
+    async def run(self, fn, *args, **kwargs):
+        """Run fn on the pool and wait for it without blocking the event loop"""
+        loop = asyncio.get_running_loop()
+        # Carry context variables (e.g. the metrics record) over to the worker
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(self.pool, partial(context.run, fn, *args, **kwargs))
+
+    async def run_ordered(self, key, fn, *args, **kwargs):
+        """Like run(), but one call at a time per key, first come first served"""
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                return await self.run(fn, *args, **kwargs)
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._locks[key]
+
+    def offload(self, fn, key=None):
+        """An async event handler that runs fn on the pool.
+
+        key, called with the handler's arguments, names what the call changes;
+        calls with the same key are run in order.
+        """
+        @wraps(fn)
+        async def handler(*args, **kwargs):
+            if key is not None:
+                return await self.run_ordered(key(*args, **kwargs), fn, *args, **kwargs)
+            return await self.run(fn, *args, **kwargs)
+
+        return handler
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+            self._pool = None
@@ -0,0 +1,153 @@
+"""Write-behind queue for character sheet saves.
+
+Saving a sheet only records it as pending and returns; a background thread
+writes pending sheets to the storage backend shortly after. A burst of saves
+to the same sheet (e.g. clicking Save a few times while editing) is coalesced
+into a single write of the latest version. Until it is written, a pending
+sheet is served from memory, so readers never see an older copy.
+
+A write that fails is retried a few times with growing pauses (a full disk
+may clear up), then given up on: the sheet moves to a failed list, and the
+next flush() or check() raises SaveError naming it, so the failure reaches the
+user instead of retrying in the background forever.
+
+Call flush() to wait for everything pending, and close() on shutdown.
+"""
+import threading
+import time
+
+from dmbuddy.storage import sheet_key
+
+# Attempts at writing one save before it is given up on
+MAX_ATTEMPTS = 5
+# Pause before the first retry of a failed write, doubled for each one after
+RETRY_DELAY = 1.0
+
+
+class SaveError(OSError):
+    """Queued saves that couldn't be written"""
+
+
+class WriteBehind:
+    """Coalescing background writer in front of a storage backend"""
+
+    def __init__(self, storage, delay=0.5, on_saved=None):
+        self.storage = storage
+        self.delay = delay          # seconds to wait for more saves before writing
+        self.on_saved = on_saved    # called as on_saved(character_type, name, data) after each write
+        self._pending = {}          # (type, key) -> (character_type, name, data, queued_at, attempts)
+        self._inflight = {}         # entries taken off _pending that are being written now
+        self._failed = {}           # (type, key) -> (character_type, name, error) of saves given up on
+        self._cond = threading.Condition()
+        self._closed = False
+        self.writes = 0
+        self.coalesced = 0
+        self.errors = 0
+        self._thread = threading.Thread(target=self._run, name="dmbuddy-writer", daemon=True)
+        self._thread.start()
+
+    def save(self, character_type, name, data):
+        """Queue a sheet to be written; replaces any unwritten version of it"""
+        key = (character_type, sheet_key(name))
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("The sheet writer has been closed")
+            previous = self._pending.get(key)
+            if previous is not None:
+                self.coalesced += 1
+            # Keep the first queue time so a steady stream of saves can't postpone the write forever
+            queued_at = previous[3] if previous is not None else time.monotonic()
+            self._pending[key] = (character_type, name, data, queued_at, 0)
+            self._failed.pop(key, None)  # This save replaces one that failed
+            self._cond.notify_all()
+
+    def pending(self, character_type, name):
+        """The queued data for a sheet, or None if nothing is waiting to be written"""
+        key = (character_type, sheet_key(name))
+        with self._cond:
+            entry = self._pending.get(key) or self._inflight.get(key)
+        return entry[2] if entry is not None else None
+
+    def discard(self, character_type, name):
+        """Drop a queued write (the sheet is being deleted); True if there was one.
+
+        Waits for a write of this sheet that is already under way, so it can't
+        land after the caller deletes the sheet.
+        """
+        key = (character_type, sheet_key(name))
+        with self._cond:
+            while key in self._inflight:
+                self._cond.wait()
+            return self._pending.pop(key, None) is not None
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._closed:
+                    self._cond.wait()
+                if not self._pending:
+                    return  # closed and drained
+                # Let a burst settle, unless we're shutting down
+                oldest = min(entry[3] for entry in self._pending.values())
+                wait = oldest + self.delay - time.monotonic()
+                if wait > 0 and not self._closed:
+                    self._cond.wait(wait)
+                    continue
+                self._inflight, self._pending = self._pending, {}
+            for key, (character_type, name, data, _, attempts) in list(self._inflight.items()):
+                try:
+                    self.storage.save(character_type, name, data)
+                    self.writes += 1
+                    if self.on_saved:
+                        self.on_saved(character_type, name, data)
+                except Exception as e:
+                    self.errors += 1
+                    attempts += 1
+                    print(f"Error saving {character_type} {name!r} (attempt {attempts}): {e}")
+                    with self._cond:
+                        # Try again after a pause unless a newer save replaced it; give up
+                        # after MAX_ATTEMPTS, or straight away if we're shutting down
+                        if key not in self._pending:
+                            if self._closed or attempts >= MAX_ATTEMPTS:
+                                self._failed[key] = (character_type, name, str(e))
+                            else:
+                                # The writer waits until queued_at + delay
+                                retry_at = time.monotonic() + RETRY_DELAY * 2 ** (attempts - 1) - self.delay
+                                self._pending[key] = (character_type, name, data, retry_at, attempts)
+                with self._cond:
+                    del self._inflight[key]
+                    self._cond.notify_all()
+
+    def flush(self, timeout=None):
+        """Write everything queued so far now; returns False if timeout ran out first.
+
+        Failed writes are retried straight away rather than after their pause.
+        Raises SaveError if any save had to be given up on (see check()).
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while self._pending or self._inflight:
+                # Pretend the pending sheets (and retries) are old enough so the writer doesn't wait
+                self._pending = {key: entry[:3] + (0,) + entry[4:] for key, entry in self._pending.items()}
+                self._cond.notify_all()
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        self.check()
+        return True
+
+    def check(self):
+        """Raise SaveError for saves given up on since the last check (each is reported once)"""
+        with self._cond:
+            failed, self._failed = list(self._failed.values()), {}
+        if failed:
+            described = "; ".join(f"{character_type} {name!r}: {error}" for character_type, name, error in failed)
+            raise SaveError(f"Couldn't save {described}")
+
+    def close(self, timeout=None):
+        """Flush-on-shutdown hook: write everything pending, then stop the writer thread"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join(timeout)
@@ -1,102 +1,77 @@
+from dmbuddy.timing import StartupTimer
+
+# Started before the heavy imports so they show up in the startup report
+STARTUP = StartupTimer()
+
 import gradio as gr
-import json
+import numpy as np
 from pathlib import Path
 import argparse
+import atexit
+
+from dmbuddy.batch import plan_batch, select_sheets
+from dmbuddy.battle import (
+    DAMAGE_TAKEN_COLUMN,
+    ROLLED_INITIATIVE_COLUMN,
+    TABLE_DATATYPES,
+    TABLE_HEADERS,
+)
+from dmbuddy.core import CharacterSheet, Campaign, add_to_battle, next_turn, roll_initiative
+from dmbuddy.journal import BattleJournal, list_battles
+from dmbuddy.roster import PAGE_SIZE
+from dmbuddy import metrics
+from dmbuddy.sessions import IDLE_TIMEOUT, MEMORY_BUDGET, BattleSession, BattleView, SessionStore
+from dmbuddy.simulator import MAX_TRIALS, combatant_from_sheet, format_summary, simulate_encounter
+from dmbuddy.storage import JsonStorage, import_json_tree, open_storage, sheet_key
+from dmbuddy.workers import IO_WORKERS, FileWorkers
+
+STARTUP.mark("imports")
 
-# Create a data directory if it doesn't exist
+# All campaign data lives under this folder
 DATA_DIR = Path("data")
-DATA_DIR.mkdir(exist_ok=True)
-
-# Directories for different character types
-CHARACTERS_DIR = DATA_DIR / "characters"
-CHARACTERS_DIR.mkdir(exist_ok=True)
-NPCS_DIR = DATA_DIR / "npcs"
-NPCS_DIR.mkdir(exist_ok=True)
-ENEMIES_DIR = DATA_DIR / "enemies"
-ENEMIES_DIR.mkdir(exist_ok=True)
-
-class CharacterSheet:
-    def __init__(self, character_type="player"):
-        self.character_type = character_type
-        self.attributes = {
-            # Basic Info
-            "name": "",
-            "class": "",
-            "level": 1,
-            "race": "",
-            "background": "",
-            "alignment": "",
-            "type": character_type,
-            
-            # Combat Stats
-            "armor_class": 10,
-            "initiative_bonus": 0,
-            "speed": 30,
-            "hit_points_max": 10,
-            "hit_points_current": 10,
-            "temporary_hp": 0,
-            "hit_dice_total": "1d8",
-            "hit_dice_remaining": "1d8",
-            
-            # Abilities
-            "abilities": {
-                "strength": 10,
-                "dexterity": 10,
-                "constitution": 10,
-                "intelligence": 10,
-                "wisdom": 10,
-                "charisma": 10
-            },
-            
-            # Saving Throws (proficiency)
-            "saving_throws": {
-                "strength": False,
-                "dexterity": False,
-                "constitution": False,
-                "intelligence": False,
-                "wisdom": False,
-                "charisma": False
-            },
-            
-            # Combat Options
-            "weapons": [],
-            "spellcasting_ability": "",
-            "spell_save_dc": 10,
-            "spell_attack_bonus": 0,
-            
-            # Other
-            "gold": 0,  # NEW: Added gold attribute
-            "equipment": "",
-            "features": "",
-            "spells": "",
-            "proficiency_bonus": 2
-        }
-    
-    def to_dict(self):
-        return self.attributes
-    
-    @classmethod
-    def from_dict(cls, data):
-        sheet = cls(character_type=data.get("type", "player"))
-        sheet.attributes = data
-        return sheet
-
-def get_directory(character_type):
-    """Get the directory based on character type"""
-    if character_type == "player":
-        return CHARACTERS_DIR
-    elif character_type == "npc":
-        return NPCS_DIR
-    elif character_type == "enemy":
-        return ENEMIES_DIR
+
+# Sheets, name index, parse cache and write-behind queue, opened by set_storage() from main().
+# Nothing is opened at import time: the simulator's worker processes re-import this
+# module on Windows and macOS, and must not start writers or touch the data folder.
+CAMPAIGN = None
+
+# Battles in memory, shared by every browser attached to them (see dmbuddy.sessions)
+BATTLES = None
+
+def flush_saves():
+    """Shutdown hook: snapshot the battles in memory and write every queued save before the process exits"""
+    if BATTLES is not None:
+        BATTLES.close()
+    if CAMPAIGN is not None:
+        CAMPAIGN.close()
+
+# Handlers run on this bounded pool so file work never blocks the event loop (see dmbuddy.workers)
+FILES = FileWorkers()
+
+def sheet_lock(character_type, name, *args):
+    """Saves and deletes of the same sheet run one at a time"""
+    return ("sheet", character_type, sheet_key(name or ""))
+
+def set_storage(storage, save_delay=0.5):
+    """Open the campaign on a storage backend (writing anything queued and the battles in memory for the old one first)"""
+    global CAMPAIGN, BATTLES
+    idle_timeout, memory_budget = IDLE_TIMEOUT, MEMORY_BUDGET
+    if CAMPAIGN is None:
+        atexit.register(flush_saves)
     else:
-        return CHARACTERS_DIR  # Default to characters
+        idle_timeout, memory_budget = BATTLES.idle_timeout, BATTLES.memory_budget
+        BATTLES.close()
+        CAMPAIGN.close()
+    CAMPAIGN = Campaign(storage, write_behind=True, save_delay=save_delay)
+    BATTLES = SessionStore(storage.sidecar_path("battles"), idle_timeout, memory_budget)
+
+def load_sheet(character_type, name):
+    """Load a CharacterSheet; raises FileNotFoundError if it doesn't exist"""
+    return CAMPAIGN.load_sheet(character_type, name)
 
 def get_character_list(character_type):
     """Get list of saved characters of a specific type"""
-    directory = get_directory(character_type)
-    characters = [f.stem.replace('_', ' ').replace(f'-{character_type}', '') for f in directory.glob(f'*-{character_type}.json')]
-    return sorted(characters)
+    return CAMPAIGN.names(character_type)
 
 def save_character(character_type, name, character_class, level, race, background, alignment,
                    armor_class, initiative_bonus, speed, hp_max, hp_current, temp_hp,
@@ -107,10 +82,10 @@ def save_character(character_type, name, character_class, level, race, backgroun
                    equipment, features, spells, proficiency_bonus,
                    gold):  # MODIFIED: Added gold parameter
     if not name:
-        return ["Error: Character name is required", gr.update(choices=get_character_list(character_type), value=None)]
+        return ["Error: Character name is required", gr.skip(), gr.skip(), gr.skip()]
     
     character = CharacterSheet(character_type=character_type)
-    character.attributes.update({
+    fields = {
         "name": name,
         "class": character_class,
         "level": level,
@@ -150,288 +125,514 @@ def save_character(character_type, name, character_class, level, race, backgroun
         "spell_save_dc": spell_save_dc,
         "spell_attack_bonus": spell_attack_bonus,
         
-        "gold": int(gold),  # MODIFIED: Added gold to attributes
+        "gold": gold,  # MODIFIED: Added gold to attributes
         "equipment": equipment,
         "features": features,
         "spells": spells,
         "proficiency_bonus": proficiency_bonus
-    })
-    
-    directory = get_directory(character_type)
-    file_path = directory / f"{name.lower().replace(' ', '_')}-{character_type}.json"
-    with open(file_path, 'w') as f:
-        json.dump(character.to_dict(), f, indent=2)
+    }
+    try:
+        character.update(fields)
+        CAMPAIGN.save_sheet(character_type, name, character)
+    except (ValueError, OSError) as e:
+        return [f"Error: {e}", gr.skip(), gr.skip(), gr.skip()]
     
-    # After saving, update the Dropdown with the new list and set the value to the newly saved character
-    return [f"Character {name} saved successfully!", gr.update(choices=get_character_list(character_type), value=name)]
+    # After saving, filter the picker down to the newly saved character and select it
+    listed = CAMPAIGN.storage.listed_name(character_type, name)
+    return [f"Character {name} saved successfully!", picker_update(character_type, listed, value=listed), listed, 0]
 
 def load_character(character_type, name):
     if not name:
         return [None] * 34  # MODIFIED: Updated number of fields to 34
     
     try:
-        directory = get_directory(character_type)
-        file_path = directory / f"{name.lower().replace(' ', '_')}-{character_type}.json"
-        with open(file_path, 'r') as f:
-            data = json.load(f)
-        character = CharacterSheet.from_dict(data)
+        character = load_sheet(character_type, name)
         return [
             # Basic Info
-            character.attributes["name"],
-            character.attributes["class"],
-            character.attributes["level"],
-            character.attributes["race"],
-            character.attributes["background"],
-            character.attributes["alignment"],
+            character.name,
+            character.character_class,
+            character.level,
+            character.race,
+            character.background,
+            character.alignment,
             
             # Combat Stats
-            character.attributes["armor_class"],
-            character.attributes["initiative_bonus"],
-            character.attributes["speed"],
-            character.attributes["hit_points_max"],
-            character.attributes["hit_points_current"],
-            character.attributes["temporary_hp"],
-            character.attributes["hit_dice_total"],
-            character.attributes["hit_dice_remaining"],
+            character.armor_class,
+            character.initiative_bonus,
+            character.speed,
+            character.hit_points_max,
+            character.hit_points_current,
+            character.temporary_hp,
+            character.hit_dice_total,
+            character.hit_dice_remaining,
             
-            # Abilities
-            character.attributes["abilities"]["strength"],
-            character.attributes["abilities"]["dexterity"],
-            character.attributes["abilities"]["constitution"],
-            character.attributes["abilities"]["intelligence"],
-            character.attributes["abilities"]["wisdom"],
-            character.attributes["abilities"]["charisma"],
+            # Abilities (strength to charisma)
+            *character.abilities,
             
             # Saving Throws
-            character.attributes["saving_throws"]["strength"],
-            character.attributes["saving_throws"]["dexterity"],
-            character.attributes["saving_throws"]["constitution"],
-            character.attributes["saving_throws"]["intelligence"],
-            character.attributes["saving_throws"]["wisdom"],
-            character.attributes["saving_throws"]["charisma"],
+            *character.saving_throws,
             
             # Spellcasting
-            character.attributes["spellcasting_ability"],
-            character.attributes["spell_save_dc"],
-            character.attributes["spell_attack_bonus"],
+            character.spellcasting_ability,
+            character.spell_save_dc,
+            character.spell_attack_bonus,
             
             # Other
-            character.attributes["gold"],  # MODIFIED: Added gold to the load output
-            character.attributes["equipment"],
-            character.attributes["features"],
-            character.attributes["spells"],
-            character.attributes["proficiency_bonus"]
+            character.gold,  # MODIFIED: Added gold to the load output
+            character.equipment,
+            character.features,
+            character.spells,
+            character.proficiency_bonus
         ]
     except FileNotFoundError:
         return [None] * 34  # MODIFIED: Updated number of fields
 
-def delete_character(character_type, character_name):
+def delete_character(character_type, character_name, name_filter=""):
     if not character_name:
-        return ["No character selected", gr.update(choices=get_character_list(character_type), value=None)]
+        return ["No character selected", picker_update(character_type, name_filter), 0]
     try:
-        directory = get_directory(character_type)
-        file_path = directory / f"{character_name.lower().replace(' ', '_')}-{character_type}.json"
-        file_path.unlink()
-        return ["Character deleted successfully!", gr.update(choices=get_character_list(character_type), value=None)]
+        CAMPAIGN.delete_sheet(character_type, character_name)
+        return ["Character deleted successfully!", picker_update(character_type, name_filter), 0]
     except FileNotFoundError:
-        return ["Character not found!", gr.update(choices=get_character_list(character_type), value=None)]
+        return ["Character not found!", picker_update(character_type, name_filter), 0]
 
-def refresh_character_list(character_type):
+def refresh_character_list(character_type, name_filter=""):
     """Refresh the character list for the dropdown"""
-    return gr.update(choices=get_character_list(character_type), value=None)
+    return picker_update(character_type, name_filter), 0
+
+def picker_page(character_type, name_filter="", page=0):
+    """One page of names starting with the filter (every "name (type)" agent without a type), and a note of how many match"""
+    names, total = CAMPAIGN.name_page(character_type, name_filter, page * PAGE_SIZE, PAGE_SIZE)
+    if total == 0:
+        info = "No matches"
+    elif total <= PAGE_SIZE:
+        info = f"{total} match{'es' if total != 1 else ''}"
+    else:
+        first = page * PAGE_SIZE + 1
+        info = f"{first}-{first + len(names) - 1} of {total}; type more of the name to narrow it down"
+    return names, info
+
+def picker_update(character_type, name_filter="", page=0, value=None):
+    names, info = picker_page(character_type, name_filter, page)
+    return gr.update(choices=names, value=value, info=info)
+
+def filter_picker(character_type, name_filter):
+    """Typeahead: the first page of names starting with what has been typed so far"""
+    return picker_update(character_type, name_filter), 0
+
+def turn_picker_page(character_type, name_filter, page, step):
+    """Show the previous or next page of a picker's matches"""
+    _, total = CAMPAIGN.name_page(character_type, name_filter, 0, 0)
+    page = min(max(int(page or 0) + step, 0), max(total - 1, 0) // PAGE_SIZE)
+    return picker_update(character_type, name_filter, page), page
+
+def build_name_picker(character_type, label):
+    """A filter box, a dropdown holding one page of the names that match it, and page buttons.
+
+    Only a page of names is ever sent to the browser, so large rosters don't
+    slow down page loads or saves. Returns (filter box, dropdown, page state).
+    """
+    names, info = picker_page(character_type)
+    with gr.Column(min_width=240):
+        name_filter = gr.Textbox(label="Filter by Name", placeholder="Start typing a name")
+        dropdown = gr.Dropdown(label=label, choices=names, info=info, interactive=True)
+        with gr.Row():
+            previous_btn = gr.Button("◀ Previous", size="sm")
+            next_btn = gr.Button("Next ▶", size="sm")
+    page = gr.State(0)
+    picker_type = gr.State(character_type)
+
+    # Only the latest keystroke's request runs once the previous one is done
+    name_filter.input(
+        fn=metrics.instrument(FILES.offload(filter_picker)),
+        inputs=[picker_type, name_filter],
+        outputs=[dropdown, page],
+        trigger_mode="always_last",
+        show_progress="hidden"
+    )
+    previous_btn.click(
+        fn=metrics.instrument(FILES.offload(turn_picker_page)),
+        inputs=[picker_type, name_filter, page, gr.State(-1)],
+        outputs=[dropdown, page]
+    )
+    next_btn.click(
+        fn=metrics.instrument(FILES.offload(turn_picker_page)),
+        inputs=[picker_type, name_filter, page, gr.State(1)],
+        outputs=[dropdown, page]
+    )
+    return name_filter, dropdown, page
 
 def get_all_agents_list():
     """Get a list of all agent names with types"""
-    agents = []
-    for character_type in ["player", "npc", "enemy"]:
-        directory = get_directory(character_type)
-        for f in directory.glob(f'*-{character_type}.json'):
-            name = f.stem.replace('_', ' ').replace(f'-{character_type}', '')
-            agents.append(f"{name} ({character_type})")
-    return sorted(agents)
-
-def battle_state_to_table(battle_state):
-    """Convert battle state to table data for DataFrame"""
-    table_data = []
-    for agent in battle_state:
-        row = [
-            agent["Type"],
-            agent["Name"],
-            agent["Default Initiative"],
-            agent["Rolled Initiative"],
-            agent["Total Initiative"],
-            agent["Armor Class"],
-            agent["HP"],
-            agent["Damage Taken"]
-        ]
-        table_data.append(row)
-    return table_data
+    return CAMPAIGN.all_agents()
 
-def add_agent_to_battle(agent_selection, battle_state):
-    if not battle_state:
-        battle_state = []
-    
-    if not agent_selection:
-        return battle_state, battle_state_to_table(battle_state)
-    
-    # Parse the agent name and type
-    if '(' in agent_selection and agent_selection.endswith(')'):
+def battle_lock(view, *args):
+    """Battle actions from one browser tab run one at a time, in the order they were made"""
+    return ("battle", id(view))
+
+def battle_table_update(session, view):
+    """New rows for the battle Dataframe, or a skip if the browser already shows them"""
+    table = view.table.render(session.battle_state)
+    view.version = session.version
+    return gr.skip() if table is None else table
+
+def loot_update(session, view):
+    """The gold, items and gold-by-source displays, or skips if the browser already shows them"""
+    if view.loot_version == session.loot_version:
+        return gr.skip(), gr.skip(), gr.skip()
+    view.loot_version = session.loot_version
+    ledger = session.ledger
+    return ledger.gold, "\n".join(ledger.item_lines()), "\n".join(ledger.gold_lines())
+
+def record_table_edit(view, evt: gr.EditData):
+    """Keep a cell edit from the battle table until the next battle action uses it"""
+    row, column = evt.index
+    view.table.record_edit(row, column, evt.value)
+
+def parse_agent_selection(agent_selection):
+    """Split a "name (type)" dropdown entry into (name, type), or None if it isn't one"""
+    if agent_selection and '(' in agent_selection and agent_selection.endswith(')'):
         name, type_with_paren = agent_selection.rsplit(' (', 1)
-        character_type = type_with_paren[:-1]  # Remove the closing ')'
-    else:
-        return battle_state, battle_state_to_table(battle_state)  # Invalid selection
-    
-    # Load the character sheet
-    try:
-        directory = get_directory(character_type)
-        file_path = directory / f"{name.lower().replace(' ', '_')}-{character_type}.json"
-        with open(file_path, 'r') as f:
-            data = json.load(f)
-        character = CharacterSheet.from_dict(data)
-    except FileNotFoundError:
-        return battle_state, battle_state_to_table(battle_state)  # Character not found
-    
-    # Check if agent is already in battle (only for non-enemies)
-    if character_type != "enemy":
-        for agent in battle_state:
-            if agent['Type'] == character_type and agent['Name'] == name:
-                return battle_state, battle_state_to_table(battle_state)  # Agent already in battle
-    
-    # Extract necessary information
-    agent = {
-        "Type": character_type,
-        "Name": name,
-        "Default Initiative": character.attributes.get("initiative_bonus", 0),
-        "Rolled Initiative": 0,
-        "Total Initiative": 0,  # Will be calculated
-        "Armor Class": character.attributes.get("armor_class", 10),
-        "HP": character.attributes.get("hit_points_current", 10),
-        "Damage Taken": 0
-    }
-    
-    # Create a new battle_state
-    new_battle_state = battle_state + [agent]
-    
-    # Return updated battle state and table data
-    return new_battle_state, battle_state_to_table(new_battle_state)
-
-def start_battle(battle_state, battle_table_data):
-    """Start the battle by calculating Total Initiative and sorting agents"""
-    # Check if battle_state is empty
-    if not battle_state:
-        return battle_state, battle_table_data  # No agents to process
-    
-    # Ensure battle_table_data does not exceed battle_state length
-    battle_table_data = battle_table_data[:len(battle_state)]
-    
-    # Create a new battle_state
-    new_battle_state = []
-    
-    # Update battle_state with data from battle_table_data
-    for i, agent in enumerate(battle_state):
-        row = battle_table_data[i]
-        # Create a copy of the agent to avoid modifying the original
-        agent = agent.copy()
-        # Convert Rolled Initiative to integer, handle empty or invalid input
-        try:
-            agent["Rolled Initiative"] = int(row[3])
-        except (ValueError, TypeError, IndexError):
-            agent["Rolled Initiative"] = 0  # Default to 0 if invalid input
-    
-        agent["Total Initiative"] = agent["Default Initiative"] + agent["Rolled Initiative"]
-        agent["Damage Taken"] = 0  # Reset Damage Taken
-        new_battle_state.append(agent)
-    
-    # Sort agents by Total Initiative
-    new_battle_state.sort(key=lambda x: x["Total Initiative"], reverse=True)
-    
-    # Update battle_table_data
-    table_data = battle_state_to_table(new_battle_state)
-    
-    return new_battle_state, table_data
+        return name, type_with_paren[:-1]  # Remove the closing ')'
+    return None
 
-def advance_turn(battle_state, battle_table_data, collected_gold, collected_items):
-    """Advance the turn, apply damage, remove defeated agents, and accumulate gold/items"""
-    if not battle_state:
-        return battle_state, battle_table_data, collected_gold, collected_items, collected_gold, collected_items
-    
-    # Create a new battle_state and list of defeated agents
-    new_battle_state = []
-    defeated_agents = []
-    
-    for i, agent in enumerate(battle_state):
-        row = battle_table_data[i]
-        agent = agent.copy()
-        # Convert Damage Taken to integer, handle empty or invalid input
+def add_agent_to_battle(view, agent_selection):
+    return spawn_agents_in_battle(view, agent_selection, 1, False)
+
+def spawn_agents_in_battle(view, agent_selection, count, roll_hp):
+    """Add an agent, or several numbered copies of an enemy (e.g. 12 x Goblin) in one update.
+
+    With roll_hp each copy gets HP rolled from the sheet's hit dice; otherwise
+    they all start at the sheet's current HP.
+    """
+    # Parse the agent name and type
+    selection = parse_agent_selection(agent_selection)
+    with BATTLES.use(view) as session:
+        if selection is None:
+            return battle_table_update(session, view)  # Invalid selection
+        name, character_type = selection
+        
+        captured = session.battle_state.capture()
         try:
-            agent["Damage Taken"] = int(row[7])
-        except (ValueError, TypeError, IndexError):
-            agent["Damage Taken"] = 0  # Default to 0 if invalid input
+            added = add_to_battle(CAMPAIGN, session.battle_state, character_type, name, count=count, roll_hp=roll_hp, journal=session.journal)
+            if added:
+                label = f"Add {name}" if len(added) == 1 else f"Add {len(added)} × {name}"
+                session.history.record(label, session.battle_state.changes_since(captured))
+                session.changed()
+        except FileNotFoundError:
+            pass  # Character not found
         
-        # Subtract damage taken from HP
-        agent["HP"] -= agent["Damage Taken"]
-        if agent["HP"] < 0:
-            agent["HP"] = 0  # Don't allow negative HP
+        return battle_table_update(session, view)
+
+def start_battle(view, auto_roll=False, battle_table_data=None):
+    """Start the battle by calculating Total Initiative and sorting agents.
+
+    With auto_roll, everyone whose Rolled Initiative is still blank or 0 gets a
+    d20 roll; values typed into the table are kept.
+    """
+    with BATTLES.use(view) as session:
+        battle_state = session.battle_state
+        # Check if battle_state is empty
+        if not battle_state:
+            return battle_table_update(session, view)  # No agents to process
         
-        if agent["HP"] > 0:
-            new_battle_state.append(agent)
-        else:
-            defeated_agents.append(agent)
+        # Edits arrive cell by cell; a submitted table (API callers) is diffed into the same deltas
+        view.table.diff_table(battle_table_data)
+        rolled = view.table.edited_column(
+            battle_state.display_column("rolled_initiative"), ROLLED_INITIATIVE_COLUMN, battle_state.turn_order()
+        )
+        captured = battle_state.capture()
+        roll_initiative(battle_state, rolled, auto_roll=auto_roll, journal=session.journal)
+        session.history.record("Start Battle", battle_state.changes_since(captured))
+        session.changed()
+        
+        return battle_table_update(session, view)
+
+def advance_turn(view, battle_table_data=None):
+    """Advance the turn, apply damage, remove defeated agents, and add their gold/items to the loot ledger"""
+    with BATTLES.use(view) as session:
+        battle_state = session.battle_state
+        if not battle_state:
+            return (battle_table_update(session, view), *loot_update(session, view))
+        
+        # Only the Damage Taken cells the user edited are non-zero
+        view.table.diff_table(battle_table_data)
+        damage = view.table.edited_column(
+            np.zeros(len(battle_state), dtype=np.int64), DAMAGE_TAKEN_COLUMN, battle_state.turn_order()
+        )
+        captured = battle_state.capture()
+        _, loot = next_turn(CAMPAIGN, battle_state, damage, journal=session.journal)
+        session.history.record("Next Turn", battle_state.changes_since(captured), loot)
+        session.changed(loot=session.ledger.add_many(loot))
+        
+        # The loot displays are only sent when something dropped since this browser last drew them
+        return (battle_table_update(session, view), *loot_update(session, view))
+
+def history_status(session, done=None):
+    """What Undo and Redo would do next, after saying what was just undone or redone"""
+    parts = [done] if done else []
+    undo, redo = session.history.next_undo(), session.history.next_redo()
+    parts.append(f"Undo: {undo}" if undo else "Nothing to undo")
+    if redo:
+        parts.append(f"Redo: {redo}")
+    return " · ".join(parts)
+
+def step_battle_history(view, redo=False):
+    """Undo the latest battle action, or redo the latest undone one, for everyone attached to the battle"""
+    with BATTLES.use(view) as session:
+        battle_state, ledger = session.battle_state, session.ledger
+        step = session.history.redo(battle_state, ledger) if redo else session.history.undo(battle_state, ledger)
+        if step is None:
+            return (gr.skip(),) * 4 + (history_status(session, "Nothing to redo." if redo else "Nothing to undo."),)
+        # The journal gets the whole battle as it now stands, so replays and rewinds match
+        session.journal.record("redo" if redo else "undo", battle_state, battle=battle_state.to_dict(), loot=ledger.to_dict())
+        session.changed(loot=bool(step.loot))
+        done = f"{'Redid' if redo else 'Undid'} {step.label}."
+        return (battle_table_update(session, view), *loot_update(session, view), history_status(session, done))
+
+def undo_battle(view):
+    return step_battle_history(view)
+
+def redo_battle(view):
+    return step_battle_history(view, redo=True)
+
+def sync_battle(view):
+    """Timer tick: show this browser what other browsers attached to its battle changed"""
+    session = BATTLES.peek(view.session_id)
+    # Skipped while the user is typing into the table, so their edits aren't overwritten
+    if session is None or view.table.edits or (session.version, session.loot_version) == (view.version, view.loot_version):
+        return (gr.skip(),) * 4
+    with session.lock:
+        return (battle_table_update(session, view), *loot_update(session, view))
+
+def simulate_battle(view, trials, seed):
+    """Play the current battle out many times and summarise how it tends to go"""
+    with BATTLES.use(view) as session:
+        battle_state = session.battle_state
+        if not battle_state:
+            return "Add some agents to the battle first."
+        # Copy what the simulation needs, so the battle isn't held while it runs
+        lineup = [
+            (battle_state.types[slot], battle_state.sheets[slot], battle_state.hp[slot],
+             battle_state.armor_class[slot], battle_state.default_initiative[slot])
+            for slot in battle_state.turn_order()
+        ]
     
-    # Accumulate gold and items from defeated agents
-    for agent in defeated_agents:
-        name = agent["Name"]
-        character_type = agent["Type"]
-        directory = get_directory(character_type)
-        file_path = directory / f"{name.lower().replace(' ', '_')}-{character_type}.json"
+    combatants = []
+    for character_type, sheet, hp, armor_class, initiative_bonus in lineup:
         try:
-            with open(file_path, 'r') as f:
-                data = json.load(f)
-            character = CharacterSheet.from_dict(data)
-            # Accumulate gold
-            gold = character.attributes.get("gold", 0)
-            collected_gold += gold
-            # Accumulate items
-            equipment_str = character.attributes.get("equipment", "")
-            if equipment_str:
-                # Assuming equipment is separated by commas or newlines
-                items = [item.strip() for item in equipment_str.replace(',', '\n').split('\n') if item.strip()]
-                if collected_items:
-                    collected_items += "\n" + "\n".join(items)
-                else:
-                    collected_items = "\n".join(items)
+            attributes = load_sheet(character_type, sheet).to_dict()
         except FileNotFoundError:
-            pass  # Character not found, skip
+            attributes = {}  # Sheet was deleted; simulate with defaults and the table's numbers
+        combatants.append(combatant_from_sheet(
+            attributes,
+            character_type,
+            hp=hp,
+            armor_class=armor_class,
+            initiative_bonus=initiative_bonus,
+        ))
     
-    if not new_battle_state:
-        table_data = []
-    else:
-        # Rotate turn order: move first agent to end
-        new_battle_state = new_battle_state[1:] + [new_battle_state[0]]
-        # Clear damage taken
-        for agent in new_battle_state:
-            agent["Damage Taken"] = 0
-    
-        table_data = battle_state_to_table(new_battle_state)
-    
-    return new_battle_state, table_data, collected_gold, collected_items, collected_gold, collected_items  # RETURN BOTH STATE AND DISPLAY
+    seed = None if seed is None or seed == "" else int(seed)
+    try:
+        # The form's maximum isn't enforced on requests sent straight to the API
+        trials = min(max(int(trials or 1000), 1), MAX_TRIALS)
+        result = simulate_encounter(combatants, trials=trials, seed=seed)
+    except ValueError as e:
+        return str(e)
+    return format_summary(result)
+
+# How often each browser checks its battle for changes made from other browsers
+BATTLE_SYNC_SECONDS = 2
+
+# Most saved battles offered in the Saved Battles dropdown, newest first
+SAVED_BATTLES_SHOWN = 100
+
+def battles_dir():
+    """Where battle journals are kept, next to the sheets"""
+    return CAMPAIGN.storage.sidecar_path("battles")
 
-def reset_battle():
-    """Reset the battle state, accumulated gold, and collected items"""
-    return [], [], 0, "", 0, ""  # MODIFIED: Reset battle_state, battle_table, collected_gold, collected_items, gold_display, items_display
+def saved_battles_update(value=None):
+    """The Saved Battles choices, with value selected if it has been journaled yet"""
+    choices = list_battles(battles_dir())[:SAVED_BATTLES_SHOWN]
+    return gr.update(choices=choices, value=value if value in choices else None)
 
-# Theme mapping
+def attached_battle_outputs(view, session_id, status):
+    """Outputs that switch the whole battle tab over to another battle"""
+    view.attach(session_id)
+    with BATTLES.use(view) as session:
+        table = view.table.render(session.battle_state)
+        view.version = session.version
+        loot = loot_update(session, view)
+    return (table or [], *loot, session_id, saved_battles_update(session_id), status)
+
+def reset_battle(view):
+    """Move this browser on to a new, empty battle; anyone else attached to the old one keeps it"""
+    return attached_battle_outputs(view, BATTLES.create().session_id, "")
+
+def open_battle(view, battle_id):
+    """Attach this browser to a battle: one still running elsewhere, or one picked back up from its journal"""
+    battle_id = (battle_id or "").strip()
+    if not battle_id:
+        return (gr.skip(),) * 6 + ("Choose a saved battle or enter a battle ID first.",)
+    try:
+        session = BATTLES.get(battle_id)
+    except FileNotFoundError:
+        return (gr.skip(),) * 5 + (saved_battles_update(), f"Battle {battle_id} doesn't exist.")
+    return attached_battle_outputs(view, battle_id, f"Opened battle {battle_id} in round {session.battle_state.round}.")
+
+def rewind_battle(view, battle_id, round_number):
+    """Load a journaled battle as it stood when a round started; anything done next goes into a new battle"""
+    if not battle_id:
+        return (gr.skip(),) * 6 + ("Choose a saved battle first.",)
+    round_number = max(int(round_number or 1), 1)
+    source = BattleJournal(battles_dir(), battle_id)
+    battle_state, ledger, _, _ = source.restore(round_number)
+    journal = source.fork(battle_state, ledger)
+    BATTLES.add(BattleSession(journal, battle_state, ledger))
+    status = f"Rewound battle {battle_id} to the start of round {battle_state.round}; continuing as battle {journal.battle_id}."
+    return attached_battle_outputs(view, journal.battle_id, status)
+
+def load_battle_tab(view, request: gr.Request = None):
+    """On page load: attach to the battle named in the link (?battle=<id>), or start a new one"""
+    battle_id = request.query_params.get("battle") if request is not None else None
+    if battle_id:
+        try:
+            session = BATTLES.get(battle_id)
+            return attached_battle_outputs(view, battle_id, f"Joined battle {battle_id} in round {session.battle_state.round}.")
+        except FileNotFoundError:
+            return attached_battle_outputs(view, BATTLES.create().session_id, f"Battle {battle_id} doesn't exist; this is a new one.")
+    return attached_battle_outputs(view, BATTLES.create().session_id, "")
+
+# Most search results listed at once; the count above the table still covers them all
+SEARCH_LIMIT = 200
+
+def search_query(text, character_type, character_class, race, alignment, level_min, level_max):
+    """Search form values as CAMPAIGN.find() arguments ("Any" and blanks mean no filter)"""
+    character_type = None if character_type in (None, "", "Any") else character_type
+    filters = {"class": character_class, "race": race, "alignment": None if alignment == "Any" else alignment}
+    level_min = None if level_min in (None, "") else int(level_min)
+    level_max = None if level_max in (None, "") else int(level_max)
+    return text, character_type, filters, level_min, level_max
+
+def search_characters(text, character_type, character_class, race, alignment, level_min, level_max):
+    """Sheets matching words in their equipment, features or spells and the chosen facets"""
+    hits = CAMPAIGN.find(*search_query(text, character_type, character_class, race, alignment, level_min, level_max))
+    rows = CAMPAIGN.search.describe(hits[:SEARCH_LIMIT])
+
+    summary = [f"**{len(hits)} match{'es' if len(hits) != 1 else ''}**" + (f" (showing the first {SEARCH_LIMIT})" if len(hits) > SEARCH_LIMIT else "")]
+    for facet, counts in CAMPAIGN.search.facet_counts(hits).items():
+        if counts:
+            top = sorted(counts.items(), key=lambda item: (-item[1], str(item[0])))[:8]
+            summary.append(f"- {facet.capitalize()}: " + ", ".join(f"{value} ({count})" for value, count in top))
+    return rows, "\n".join(summary)
+
+# Ready-made batch edits; Split Battle Gold is filled in from the battle on screen
+BATCH_PRESETS = {
+    "Long Rest": "hit_points_current = hit_points_max\ntemporary_hp = 0",
+    "Level Up": "level += 1",
+    "Split Battle Gold": "gold split {gold}",
+}
+
+def batch_preset(view, preset):
+    """Rules for a preset, with the gold collected in this tab's battle for Split Battle Gold"""
+    session = BATTLES.peek(view.session_id) if view.session_id else None
+    gold = session.ledger.gold if session is not None else 0
+    return BATCH_PRESETS.get(preset, "").format(gold=gold)
+
+def preview_batch(text, character_type, character_class, race, alignment, level_min, level_max, rules):
+    """Work out what the rules would change in every matching sheet; nothing is saved yet"""
+    text, character_type, filters, level_min, level_max = search_query(
+        text, character_type, character_class, race, alignment, level_min, level_max
+    )
+    try:
+        plan = plan_batch(CAMPAIGN, select_sheets(CAMPAIGN, character_type, text, filters, level_min, level_max), rules or "")
+    except (ValueError, OSError) as e:
+        return None, [], f"Error: {e}"
+    rows = plan.preview()
+    summary = plan.summary()
+    if len(rows) < sum(len(fields) for _, _, fields in plan.changes):
+        summary += f" Showing the first {len(rows)} changes."
+    return plan, rows, summary
+
+def apply_batch(plan):
+    """Save the previewed batch in one go"""
+    if plan is None:
+        return None, "Preview the batch first."
+    try:
+        plan.commit(CAMPAIGN)
+    except (ValueError, OSError) as e:
+        return None, f"Error: {e}"
+    return None, plan.summary()
+
+# Built-in themes by name; only the selected one is ever constructed
 THEMES = {
-    "Default": gr.themes.Default(),
-    "Monochrome": gr.themes.Monochrome(),
-    "Soft": gr.themes.Soft(),
-    "Glass": gr.themes.Glass(),
-    "Citrus": gr.themes.Citrus(),
-    "Ocean": gr.themes.Ocean(),
-    "Origin": gr.themes.Origin(),
-    "Base": gr.themes.Base(),
+    "Default": "Default",
+    "Monochrome": "Monochrome",
+    "Soft": "Soft",
+    "Glass": "Glass",
+    "Citrus": "Citrus",
+    "Ocean": "Ocean",
+    "Origin": "Origin",
+    "Base": "Base",
 }
 
+# Hub themes are saved here after the first download, so later launches work offline
+THEME_CACHE_DIR = DATA_DIR / "themes"
+
+def theme_cache_path(repo_name):
+    """Local copy of a Hub theme, e.g. data/themes/NoCrypt__miku.json"""
+    return THEME_CACHE_DIR / f"{repo_name.replace('/', '__')}.json"
+
+def load_theme(name, refresh=False):
+    """Build a built-in theme, or load a Hub theme from the local cache (downloading it the first time)"""
+    if name in THEMES:
+        return getattr(gr.themes, THEMES[name])()
+
+    path = theme_cache_path(name)
+    if path.exists() and not refresh:
+        try:
+            theme = gr.themes.ThemeClass.load(str(path))
+            theme.name = name.split("@")[0]
+            return theme
+        except Exception as e:
+            print(f"Error reading cached theme {path}: {e}")
+
+    # Attempt to load the theme from the Hugging Face Hub
+    try:
+        theme = gr.themes.ThemeClass.from_hub(name)
+        print(f"Loaded theme '{name}' from Hugging Face Hub.")
+    except Exception as e:
+        print(f"Error loading theme '{name}': {e}")
+        if path.exists():
+            print("Using the cached copy.")
+            return gr.themes.ThemeClass.load(str(path))
+        print("Using default theme.")
+        return gr.themes.Default()
+
+    try:
+        THEME_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        theme.dump(str(path))
+    except OSError as e:
+        print(f"Couldn't cache theme '{name}': {e}")
+    return theme
+
+def enable_metrics(trace_path=None):
+    """Turn on per-handler metrics, plus the cache and write-behind counters"""
+    recorder = metrics.enable(trace_path)
+    recorder.add_gauge("dmbuddy_sheet_cache_hits", "Sheet loads served from the parse cache", lambda: CAMPAIGN.cache.hits)
+    recorder.add_gauge("dmbuddy_sheet_cache_misses", "Sheet loads that had to read storage", lambda: CAMPAIGN.cache.misses)
+    recorder.add_gauge("dmbuddy_saves_written", "Saves written by the write-behind queue", lambda: CAMPAIGN.writer.writes)
+    recorder.add_gauge("dmbuddy_saves_coalesced", "Saves merged into one already queued", lambda: CAMPAIGN.writer.coalesced)
+    recorder.add_gauge("dmbuddy_battle_sessions", "Battles held in memory", lambda: len(BATTLES))
+    recorder.add_gauge("dmbuddy_battle_sessions_bytes", "Approximate memory held by those battles", lambda: BATTLES.memory_usage())
+    recorder.add_gauge("dmbuddy_battle_evictions", "Battles written out to their snapshots and dropped from memory", lambda: BATTLES.evictions)
+    atexit.register(recorder.close)
+    return recorder
+
+def metrics_endpoint():
+    from fastapi.responses import PlainTextResponse
+    return PlainTextResponse(metrics.METRICS.render(), media_type="text/plain; version=0.0.4")
+
 def main():
     # Argument parser for theme selection
     parser = argparse.ArgumentParser(description="D&D Character Manager")
@@ -441,87 +642,289 @@ def main():
         default="Default",
         help="Select the theme for the app. Can be a built-in theme or a Hugging Face Hub theme (e.g., 'NoCrypt/miku')",
     )
+    parser.add_argument(
+        "--storage",
+        choices=["json", "sqlite"],
+        default="json",
+        help="Where to keep character sheets: one JSON file per sheet (default) or a single SQLite database",
+    )
+    parser.add_argument(
+        "--database",
+        type=str,
+        default=None,
+        help="Path of the SQLite database (default: data/dmbuddy.db)",
+    )
+    parser.add_argument(
+        "--binary-sheets",
+        action="store_true",
+        help="With --storage sqlite, save sheets in a compact binary layout instead of JSON (both are read)",
+    )
+    parser.add_argument(
+        "--import-json",
+        action="store_true",
+        help="Copy every sheet from the JSON folders in data/ into the SQLite database, then exit",
+    )
+    parser.add_argument(
+        "--save-delay",
+        type=float,
+        default=0.5,
+        help="Seconds to wait for further saves of a sheet before writing it (default: 0.5)",
+    )
+    parser.add_argument(
+        "--battle-idle",
+        type=float,
+        default=IDLE_TIMEOUT / 60,
+        help=f"Minutes without an action before a battle is written to disk and dropped from memory (default: {IDLE_TIMEOUT // 60})",
+    )
+    parser.add_argument(
+        "--battle-memory",
+        type=float,
+        default=MEMORY_BUDGET / 2**20,
+        help=f"MB the battles in memory may use before the least recently used are written out (default: {MEMORY_BUDGET // 2**20})",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=8,
+        help="Requests of each kind (e.g. loading a sheet) handled at once across all browsers (default: 8)",
+    )
+    parser.add_argument(
+        "--queue-size",
+        type=int,
+        default=None,
+        help="Requests allowed to wait in the queue before new ones are turned away (default: no limit)",
+    )
+    parser.add_argument(
+        "--io-workers",
+        type=int,
+        default=IO_WORKERS,
+        help=f"Threads doing the handlers' file work (default: {IO_WORKERS})",
+    )
+    parser.add_argument(
+        "--refresh-theme",
+        action="store_true",
+        help="Download a Hub theme again instead of using the copy cached in data/themes",
+    )
+    parser.add_argument(
+        "--metrics",
+        action="store_true",
+        help="Time every event handler and serve the numbers in Prometheus format at /metrics",
+    )
+    parser.add_argument(
+        "--trace-file",
+        type=str,
+        default=None,
+        help="Also append one JSON line per handler call to this file (implies --metrics)",
+    )
     args = parser.parse_args()
+    save_delay = max(args.save_delay, 0)
+    FILES.max_workers = max(args.io_workers, 1)
+    if args.binary_sheets and not (args.storage == "sqlite" or args.import_json):
+        parser.error("--binary-sheets needs --storage sqlite")
 
-    # Initialize the selected theme
-    if args.theme in THEMES:
-        selected_theme = THEMES[args.theme]
+    if args.storage == "sqlite" or args.import_json:
+        set_storage(open_storage("sqlite", DATA_DIR, args.database, args.binary_sheets), save_delay)
     else:
-        # Attempt to load the theme from the Hugging Face Hub
-        try:
-            selected_theme = gr.themes.ThemeClass.from_hub(args.theme)
-            print(f"Loaded theme '{args.theme}' from Hugging Face Hub.")
-        except Exception as e:
-            print(f"Error loading theme '{args.theme}': {e}")
-            print("Using default theme.")
-            selected_theme = gr.themes.Default()
+        set_storage(JsonStorage(DATA_DIR), save_delay)
+    if args.import_json:
+        report = import_json_tree(DATA_DIR, CAMPAIGN.storage)
+        print(f"Imported {report['imported']} sheets into {CAMPAIGN.storage.db_path}")
+        for error in report["errors"]:
+            what = error.get("file") or (repr(error["name"]) if error["name"] else f"a nameless {error['type']}")
+            print(f"Skipped {what}: {error['error']}")
+        return
+
+    # Scan the data folders once; handlers keep the index current from here on
+    CAMPAIGN.roster.load()
+    # Read the saved search index and re-read only sheets changed since it was written
+    CAMPAIGN.search.load()
+
+    # Handlers are wrapped as they're wired up below, so this has to come first
+    if args.metrics or args.trace_file:
+        enable_metrics(args.trace_file)
+
+    BATTLES.idle_timeout = max(args.battle_idle, 0) * 60
+    BATTLES.memory_budget = max(args.battle_memory, 0) * 2**20
+
+    STARTUP.mark("storage")
+
+    # Initialize the selected theme
+    selected_theme = load_theme(args.theme, refresh=args.refresh_theme)
+    STARTUP.mark("theme")
 
     # Gradio Interface
-    with gr.Blocks(theme=selected_theme) as demo:
+    with gr.Blocks() as demo:
         gr.Markdown("# D&D Character Manager")
 
         with gr.Tabs():
             with gr.Tab("Battle"):
                 gr.Markdown("### Battle Tracker")
 
-                # State for battle participants
-                battle_state = gr.State([])
-                # NEW: States for accumulated gold and collected items
-                collected_gold = gr.State(0)
-                collected_items = gr.State("")
-
-                # Refresh agent list
-                agent_list = get_all_agents_list()
+                # The battle itself (combatants, loot and journal) lives in BATTLES on the server, so
+                # several browsers can share it; each tab only keeps which battle it shows and what
+                # its table displays, so only edits and changes are exchanged
+                battle_view = gr.State(BattleView)
+                # Changes made from other browsers attached to the same battle show up on the next tick
+                battle_timer = gr.Timer(BATTLE_SYNC_SECONDS)
 
                 with gr.Row():
-                    agent_dropdown = gr.Dropdown(
-                        label="Select Agent to Add",
-                        choices=agent_list,
-                        interactive=True
-                    )
+                    _, agent_dropdown, _ = build_name_picker(None, "Select Agent to Add")
+                    spawn_count = gr.Number(label="Copies", value=1, minimum=1, precision=0)
+                    roll_hp = gr.Checkbox(label="Roll HP from Hit Dice", value=False)
                     add_agent_btn = gr.Button("Add Agent")
 
                 battle_table = gr.Dataframe(
-                    headers=["Type", "Name", "Default Initiative", "Rolled Initiative", "Total Initiative", "Armor Class", "HP", "Damage Taken"],
-                    datatype=["str", "str", "number", "number", "number", "number", "number", "number"],
+                    headers=TABLE_HEADERS,
+                    datatype=TABLE_DATATYPES,
                     interactive=True,
                     value=[],
                     type="array"  # Ensure the data is a list of lists
                 )
 
                 with gr.Row():
+                    auto_roll = gr.Checkbox(label="Auto-roll Initiative", value=True)
                     start_battle_btn = gr.Button("Start Battle", variant="primary")
                     next_turn_btn = gr.Button("Next Turn")
+                    undo_btn = gr.Button("Undo", variant="secondary")
+                    redo_btn = gr.Button("Redo", variant="secondary")
                     reset_battle_btn = gr.Button("Reset Battle", variant="secondary")
+                history_display = gr.Markdown()
 
                 # NEW: Display areas for accumulated gold and collected items
                 with gr.Row():
                     gold_display = gr.Number(label="Total Gold Collected", value=0, interactive=False)
                     items_display = gr.Textbox(label="Collected Items", value="", lines=3, interactive=False)
+                    gold_sources_display = gr.Textbox(label="Gold by Source", value="", lines=3, interactive=False)
+
+                # Monte Carlo estimate of how the current battle is likely to go
+                with gr.Accordion("Simulate Encounter", open=False):
+                    with gr.Row():
+                        sim_trials = gr.Number(label="Simulated Fights", value=10000, minimum=100, maximum=MAX_TRIALS, precision=0)
+                        sim_seed = gr.Number(label="Seed (optional, for repeatable results)", value=None, precision=0)
+                        simulate_btn = gr.Button("Simulate")
+                    sim_output = gr.Markdown()
+
+                # Battles are journaled as they're played; pick one back up or review it round by round
+                with gr.Accordion("Saved Battles", open=False):
+                    with gr.Row():
+                        saved_battles = gr.Dropdown(
+                            label="Battle",
+                            choices=list_battles(battles_dir())[:SAVED_BATTLES_SHOWN],
+                            interactive=True
+                        )
+                        refresh_battles_btn = gr.Button("Refresh List", variant="secondary")
+                        resume_btn = gr.Button("Resume")
+                    with gr.Row():
+                        rewind_round = gr.Number(label="Round", value=1, minimum=1, precision=0)
+                        rewind_btn = gr.Button("Rewind to Start of Round")
+                    # Another browser joins this battle with the ID, or with a link ending in ?battle=<ID>
+                    with gr.Row():
+                        battle_id = gr.Textbox(label="Battle ID (share it to open this battle on another screen)")
+                        join_btn = gr.Button("Join")
+                    journal_status = gr.Markdown()
 
                 # Event handlers
+                # Battle events are ordered per browser tab, so a cell edit is always recorded
+                # before a button click that follows it; actions from different browsers on the
+                # same battle take turns on its lock. All of them share one concurrency limit
+                battle_table.edit(
+                    fn=metrics.instrument(FILES.offload(record_table_edit, key=battle_lock)),
+                    inputs=[battle_view],
+                    outputs=None,
+                    concurrency_id="battle"
+                )
+
                 add_agent_btn.click(
-                    fn=add_agent_to_battle,
-                    inputs=[agent_dropdown, battle_state],
-                    outputs=[battle_state, battle_table]
+                    fn=metrics.instrument(FILES.offload(spawn_agents_in_battle, key=battle_lock)),
+                    inputs=[battle_view, agent_dropdown, spawn_count, roll_hp],
+                    outputs=[battle_table],
+                    concurrency_id="battle"
                 )
 
                 start_battle_btn.click(
-                    fn=start_battle,
-                    inputs=[battle_state, battle_table],
-                    outputs=[battle_state, battle_table]
+                    fn=metrics.instrument(FILES.offload(start_battle, key=battle_lock)),
+                    inputs=[battle_view, auto_roll],
+                    outputs=[battle_table],
+                    concurrency_id="battle"
                 )
 
                 next_turn_btn.click(
-                    fn=advance_turn,
-                    inputs=[battle_state, battle_table, collected_gold, collected_items],  # Inputs
-                    outputs=[battle_state, battle_table, collected_gold, collected_items, gold_display, items_display]    # Outputs mapped to both State and display components
+                    fn=metrics.instrument(FILES.offload(advance_turn, key=battle_lock)),
+                    inputs=[battle_view],
+                    outputs=[battle_table, gold_display, items_display, gold_sources_display],
+                    concurrency_id="battle"
+                )
+
+                # Undo and Redo change the battle for every browser attached to it
+                undo_btn.click(
+                    fn=metrics.instrument(FILES.offload(undo_battle, key=battle_lock)),
+                    inputs=[battle_view],
+                    outputs=[battle_table, gold_display, items_display, gold_sources_display, history_display],
+                    concurrency_id="battle"
+                )
+
+                redo_btn.click(
+                    fn=metrics.instrument(FILES.offload(redo_battle, key=battle_lock)),
+                    inputs=[battle_view],
+                    outputs=[battle_table, gold_display, items_display, gold_sources_display, history_display],
+                    concurrency_id="battle"
+                )
+
+                battle_timer.tick(
+                    fn=metrics.instrument(FILES.offload(sync_battle, key=battle_lock)),
+                    inputs=[battle_view],
+                    outputs=[battle_table, gold_display, items_display, gold_sources_display],
+                    concurrency_id="battle",
+                    show_progress="hidden"
+                )
+
+                simulate_btn.click(
+                    fn=metrics.instrument(FILES.offload(simulate_battle, key=battle_lock)),
+                    inputs=[battle_view, sim_trials, sim_seed],
+                    outputs=[sim_output]
+                )
+
+                # Everything that switches the tab over to another battle
+                attached_battle = [battle_table, gold_display, items_display, gold_sources_display, battle_id, saved_battles, journal_status]
+                demo.load(
+                    fn=metrics.instrument(FILES.offload(load_battle_tab, key=battle_lock)),
+                    inputs=[battle_view],
+                    outputs=attached_battle,
+                    concurrency_id="battle"
                 )
 
                 reset_battle_btn.click(
-                    fn=reset_battle,
+                    fn=metrics.instrument(FILES.offload(reset_battle, key=battle_lock)),
+                    inputs=[battle_view],
+                    outputs=attached_battle,
+                    concurrency_id="battle"
+                )
+
+                resume_btn.click(
+                    fn=metrics.instrument(FILES.offload(open_battle, key=battle_lock)),
+                    inputs=[battle_view, saved_battles],
+                    outputs=attached_battle,
+                    concurrency_id="battle"
+                )
+
+                join_btn.click(
+                    fn=metrics.instrument(FILES.offload(open_battle, key=battle_lock)),
+                    inputs=[battle_view, battle_id],
+                    outputs=attached_battle,
+                    concurrency_id="battle"
+                )
+
+                rewind_btn.click(
+                    fn=metrics.instrument(FILES.offload(rewind_battle, key=battle_lock)),
+                    inputs=[battle_view, saved_battles, rewind_round],
+                    outputs=attached_battle,
+                    concurrency_id="battle"
+                )
+
+                refresh_battles_btn.click(
+                    fn=metrics.instrument(FILES.offload(saved_battles_update)),
                     inputs=[],
-                    outputs=[battle_state, battle_table, collected_gold, collected_items, gold_display, items_display]    # Reset battle_state, battle_table, gold, and items
+                    outputs=[saved_battles]
                 )
 
             for character_type in ["player", "npc", "enemy"]:
@@ -595,11 +998,7 @@ def main():
 
                     with gr.Row():
                         save_btn = gr.Button("Save Character", variant="primary")
-                        load_dropdown = gr.Dropdown(
-                            label="Load Character",
-                            choices=get_character_list(character_type),
-                            interactive=True
-                        )
+                        load_filter, load_dropdown, load_page = build_name_picker(character_type, "Load Character")
                         load_btn = gr.Button("Load")
                         delete_btn = gr.Button("Delete Character", variant="danger")
                         refresh_btn = gr.Button("Refresh Character List", variant="secondary")
@@ -608,7 +1007,7 @@ def main():
 
                     # Event handlers
                     save_btn.click(
-                        fn=save_character,
+                        fn=metrics.instrument(FILES.offload(save_character, key=sheet_lock)),
                         inputs=[
                             gr.State(character_type),
                             name, character_class, level, race, background, alignment,
@@ -620,11 +1019,11 @@ def main():
                             equipment, features, spells, proficiency_bonus,
                             gold  # MODIFIED: Added gold to inputs
                         ],
-                        outputs=[output, load_dropdown]
+                        outputs=[output, load_dropdown, load_filter, load_page]
                     )
 
                     load_btn.click(
-                        fn=load_character,
+                        fn=metrics.instrument(FILES.offload(load_character)),
                         inputs=[gr.State(character_type), load_dropdown],
                         outputs=[
                             name, character_class, level, race, background, alignment,
@@ -639,17 +1038,113 @@ def main():
                     )
 
                     delete_btn.click(
-                        fn=delete_character,
-                        inputs=[gr.State(character_type), load_dropdown],
-                        outputs=[output, load_dropdown]
+                        fn=metrics.instrument(FILES.offload(delete_character, key=sheet_lock)),
+                        inputs=[gr.State(character_type), load_dropdown, load_filter],
+                        outputs=[output, load_dropdown, load_page]
                     )
 
                     refresh_btn.click(
-                        fn=refresh_character_list,
-                        inputs=[gr.State(character_type)],
-                        outputs=[load_dropdown]
+                        fn=metrics.instrument(FILES.offload(refresh_character_list)),
+                        inputs=[gr.State(character_type), load_filter],
+                        outputs=[load_dropdown, load_page]
                     )
 
+            with gr.Tab("Search"):
+                gr.Markdown("### Search Sheets")
+                with gr.Row():
+                    search_text = gr.Textbox(label="Equipment, Features or Spells", placeholder="e.g. fireball, or fire* for a prefix")
+                    search_type = gr.Dropdown(label="Type", choices=["Any", "player", "npc", "enemy"], value="Any")
+                    search_class = gr.Textbox(label="Class")
+                    search_race = gr.Textbox(label="Race")
+                with gr.Row():
+                    search_alignment = gr.Dropdown(
+                        label="Alignment",
+                        choices=["Any", "Lawful Good", "Neutral Good", "Chaotic Good",
+                                 "Lawful Neutral", "True Neutral", "Chaotic Neutral",
+                                 "Lawful Evil", "Neutral Evil", "Chaotic Evil"],
+                        value="Any"
+                    )
+                    search_level_min = gr.Number(label="Level From", value=None, precision=0)
+                    search_level_max = gr.Number(label="Level To", value=None, precision=0)
+                    search_btn = gr.Button("Search", variant="primary")
+                search_summary = gr.Markdown()
+                search_results = gr.Dataframe(
+                    headers=["Type", "Name", "Class", "Race", "Level", "Alignment"],
+                    value=[],
+                    interactive=False,
+                    type="array"
+                )
+
+                search_inputs = [search_text, search_type, search_class, search_race, search_alignment, search_level_min, search_level_max]
+                search_btn.click(
+                    fn=metrics.instrument(FILES.offload(search_characters)),
+                    inputs=search_inputs,
+                    outputs=[search_results, search_summary]
+                )
+                search_text.submit(
+                    fn=metrics.instrument(FILES.offload(search_characters)),
+                    inputs=search_inputs,
+                    outputs=[search_results, search_summary]
+                )
+
+            with gr.Tab("Batch Edit"):
+                gr.Markdown("### Batch Edit")
+                gr.Markdown(
+                    "Change every matching sheet at once, one rule per line: "
+                    "`hit_points_current = hit_points_max`, `level += 1`, `alignment = True Neutral` "
+                    "or `gold split 250` (divided evenly between them). Preview shows every change; "
+                    "Apply saves them all together."
+                )
+                with gr.Row():
+                    batch_text = gr.Textbox(label="Equipment, Features or Spells", placeholder="Leave empty for every sheet")
+                    batch_type = gr.Dropdown(label="Type", choices=["Any", "player", "npc", "enemy"], value="player")
+                    batch_class = gr.Textbox(label="Class")
+                    batch_race = gr.Textbox(label="Race")
+                with gr.Row():
+                    batch_alignment = gr.Dropdown(
+                        label="Alignment",
+                        choices=["Any", "Lawful Good", "Neutral Good", "Chaotic Good",
+                                 "Lawful Neutral", "True Neutral", "Chaotic Neutral",
+                                 "Lawful Evil", "Neutral Evil", "Chaotic Evil"],
+                        value="Any"
+                    )
+                    batch_level_min = gr.Number(label="Level From", value=None, precision=0)
+                    batch_level_max = gr.Number(label="Level To", value=None, precision=0)
+                with gr.Row():
+                    batch_preset_dropdown = gr.Dropdown(label="Preset", choices=list(BATCH_PRESETS), value=None)
+                    batch_rules = gr.Textbox(label="Rules", lines=3, placeholder="level += 1")
+                with gr.Row():
+                    batch_preview_btn = gr.Button("Preview", variant="primary")
+                    batch_apply_btn = gr.Button("Apply", variant="stop")
+                batch_status = gr.Markdown()
+                batch_changes = gr.Dataframe(
+                    headers=["Type", "Name", "Field", "Before", "After"],
+                    value=[],
+                    interactive=False,
+                    type="array"
+                )
+                # The previewed plan, so Apply saves exactly what was shown
+                batch_plan = gr.State(None)
+
+                batch_preset_dropdown.change(
+                    fn=batch_preset,
+                    inputs=[battle_view, batch_preset_dropdown],
+                    outputs=[batch_rules]
+                )
+
+                batch_preview_btn.click(
+                    fn=metrics.instrument(FILES.offload(preview_batch)),
+                    inputs=[batch_text, batch_type, batch_class, batch_race, batch_alignment, batch_level_min, batch_level_max, batch_rules],
+                    outputs=[batch_plan, batch_changes, batch_status]
+                )
+
+                # Batches run one at a time, so two of them never interleave their saves
+                batch_apply_btn.click(
+                    fn=metrics.instrument(FILES.offload(apply_batch, key=lambda *args: ("batch",))),
+                    inputs=[batch_plan],
+                    outputs=[batch_plan, batch_status]
+                )
+
         # Move the theme selection information to the bottom
         with gr.Row():
             gr.Markdown("### Theme Selection")
@@ -658,7 +1153,17 @@ def main():
             built_in_themes = ", ".join(THEMES.keys())
             gr.Markdown(f"Built-in themes: {built_in_themes}")
 
-        demo.launch()
+        STARTUP.mark("interface")
+        print(STARTUP.report())
+        demo.queue(default_concurrency_limit=max(args.concurrency, 1), max_size=args.queue_size)
+        if metrics.METRICS is None:
+            demo.launch(theme=selected_theme)
+        else:
+            # Serve /metrics from the same server as the UI
+            app, local_url, _ = demo.launch(theme=selected_theme, prevent_thread_lock=True)
+            app.add_api_route("/metrics", metrics_endpoint, methods=["GET"])
+            print(f"Metrics at {local_url.rstrip('/')}/metrics")
+            demo.block_thread()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,21 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from dmbuddy.core import Campaign  # noqa: E402
+from dmbuddy.sheet import CharacterSheet  # noqa: E402
+from dmbuddy.storage import JsonStorage  # noqa: E402
+
+
+def make_sheet(name, character_type="player", **fields):
+    return CharacterSheet.from_dict({"name": name, **fields}, character_type)
+
+
+@pytest.fixture
+def campaign(tmp_path):
+    campaign = Campaign(JsonStorage(tmp_path / "data"))
+    yield campaign
+    campaign.close()
@@ -0,0 +1,91 @@
+import gzip
+import hashlib
+import io
+import json
+import tarfile
+
+import pytest
+
+from dmbuddy.archive import export_archive, import_archive
+from dmbuddy.core import Campaign
+from dmbuddy.storage import JsonStorage
+
+from conftest import make_sheet
+
+
+def _fill(campaign, count=12):
+    for i in range(count):
+        campaign.save_sheet("enemy", f"Goblin {i}", make_sheet(f"Goblin {i}", "enemy", gold=i))
+    campaign.save_sheet("player", "Ann", make_sheet("Ann", level=3))
+
+
+@pytest.fixture
+def target(tmp_path):
+    campaign = Campaign(JsonStorage(tmp_path / "target"))
+    yield campaign
+    campaign.close()
+
+
+def test_round_trip_copies_every_sheet_and_reimport_changes_nothing(campaign, target, tmp_path):
+    _fill(campaign)
+    path = tmp_path / "campaign.tar.gz"
+    assert export_archive(campaign, path)["written"] == 13
+    with open(path, "rb") as f:
+        report = import_archive(target, f, batch_size=5)
+    assert (report["imported"], report["unchanged"]) == (13, 0)
+    assert target.load_sheet("enemy", "Goblin 7").gold == 7
+    assert target.load_sheet("player", "Ann").level == 3
+    with open(path, "rb") as f:
+        report = import_archive(target, f)
+    assert (report["imported"], report["unchanged"]) == (0, 13)
+
+
+def test_incremental_export_writes_only_changed_sheets(campaign, target, tmp_path):
+    _fill(campaign)
+    export_archive(campaign, tmp_path / "full.tar.gz")
+    campaign.save_sheet("enemy", "Goblin 3", make_sheet("Goblin 3", "enemy", gold=99))
+    campaign.delete_sheet("enemy", "Goblin 4")
+    report = export_archive(campaign, tmp_path / "incr.tar.gz", incremental=True)
+    assert (report["sheets"], report["written"], report["unchanged"]) == (12, 1, 11)
+
+    for name in ("full", "incr"):
+        with open(tmp_path / f"{name}.tar.gz", "rb") as f:
+            import_archive(target, f, prune=name == "incr")
+    assert target.load_sheet("enemy", "Goblin 3").gold == 99
+    assert "Goblin 4" not in target.names("enemy")
+    assert len(target.names("enemy")) == 11
+
+
+def _archive(members):
+    buffer = io.BytesIO()
+    with gzip.GzipFile(fileobj=buffer, mode="wb") as compressed, \
+            tarfile.open(fileobj=compressed, mode="w|", format=tarfile.PAX_FORMAT) as tar:
+        for name, data, headers in [("archive.json", {"format": 1}, None)] + members:
+            raw = json.dumps(data).encode("utf-8")
+            info = tarfile.TarInfo(name)
+            info.size = len(raw)
+            if headers:
+                info.pax_headers = {"DMBUDDY.name": headers, "DMBUDDY.sha256": hashlib.sha256(raw).hexdigest()}
+            tar.addfile(info, io.BytesIO(raw))
+    buffer.seek(0)
+    return buffer
+
+
+def test_member_name_cannot_escape_the_data_folder(target, tmp_path):
+    source = _archive([
+        ("sheets/player/ann.json", {"name": "Ann"}, "Ann"),
+        ("sheets/player/x.json", {"name": "x"}, "../../escaped"),
+    ])
+    with pytest.raises(ValueError, match="Damaged campaign archive"):
+        import_archive(target, source)
+    assert target.load_sheet("player", "Ann").name == "Ann"  # What came before the bad member is kept
+    assert not list(tmp_path.rglob("escaped*"))
+
+
+def test_truncated_archive_is_reported_as_damaged(campaign, target, tmp_path):
+    _fill(campaign, 200)
+    path = tmp_path / "campaign.tar.gz"
+    export_archive(campaign, path)
+    data = path.read_bytes()
+    with pytest.raises(ValueError, match="Damaged campaign archive"):
+        import_archive(target, io.BytesIO(data[:len(data) // 2]))
@@ -0,0 +1,81 @@
+import threading
+import time
+
+import pytest
+
+from dmbuddy.batch import parse_rules, plan_batch
+from dmbuddy.core import Campaign
+from dmbuddy.storage import SQLiteStorage
+
+from conftest import make_sheet
+
+
+def _party(campaign, **fields):
+    for name in ("Ann", "Bo", "Cy"):
+        campaign.save_sheet("player", name, make_sheet(name, **fields))
+    return [("player", name) for name in ("Ann", "Bo", "Cy")]
+
+
+def test_preview_is_the_diff_that_commit_writes(campaign):
+    selected = _party(campaign, gold=0, hit_points_max=12, hit_points_current=3)
+    plan = plan_batch(campaign, selected, "hit_points_current = hit_points_max\ngold split 10")
+    assert plan.preview() == [
+        ["player", "Ann", "hit_points_current", 3, 12], ["player", "Ann", "gold", 0, 4],
+        ["player", "Bo", "hit_points_current", 3, 12], ["player", "Bo", "gold", 0, 3],
+        ["player", "Cy", "hit_points_current", 3, 12], ["player", "Cy", "gold", 0, 3],
+    ]
+    assert plan.commit(campaign) == 3
+    assert [campaign.load_sheet("player", name).gold for name in ("Ann", "Bo", "Cy")] == [4, 3, 3]
+
+
+def test_commit_refuses_a_stale_preview(campaign):
+    selected = _party(campaign, gold=5)
+    plan = plan_batch(campaign, selected, "gold += 1")
+    campaign.save_sheet("player", "Bo", make_sheet("Bo", gold=100))
+    with pytest.raises(ValueError, match="changed since the preview"):
+        plan.commit(campaign)
+    assert [campaign.load_sheet("player", name).gold for name in ("Ann", "Bo", "Cy")] == [5, 100, 5]
+
+
+@pytest.mark.parametrize("rule", ["gold -= 10", "level = 0", "hit_points_current -= 20", "hit_points_max = -1"])
+def test_plan_refuses_values_out_of_range(campaign, rule):
+    selected = _party(campaign, gold=5, level=1, hit_points_max=10, hit_points_current=10)
+    with pytest.raises(ValueError, match="out of range"):
+        plan_batch(campaign, selected, rule)
+
+
+def test_parse_rules_names_the_bad_line():
+    with pytest.raises(ValueError, match="Rule 2"):
+        parse_rules("level += 1\nname = Bob")
+
+
+def test_a_save_during_commit_waits_for_the_batch(campaign, monkeypatch):
+    selected = _party(campaign, gold=5)
+    plan = plan_batch(campaign, selected, "gold += 1")
+    storage = campaign.storage
+    write = storage._write
+    saver = threading.Thread(target=storage.save, args=("player", "Cy", make_sheet("Cy", gold=100).to_dict()))
+
+    def slow_write(character_type, name, text):
+        if saver.ident is None:
+            saver.start()  # Somebody saves Cy from the sheet editor after the check passed
+            saver.join(0.2)
+            assert saver.is_alive()
+        write(character_type, name, text)
+
+    monkeypatch.setattr(storage, "_write", slow_write)
+    assert plan.commit(campaign) == 3
+    saver.join()
+    assert [campaign.load_sheet("player", name).gold for name in ("Ann", "Bo", "Cy")] == [6, 6, 100]
+
+
+def test_commit_refuses_a_stale_preview_on_sqlite(tmp_path):
+    campaign = Campaign(SQLiteStorage(tmp_path / "dmbuddy.db"))
+    selected = _party(campaign, gold=5)
+    plan = plan_batch(campaign, selected, "gold += 1")
+    time.sleep(0.001)  # Signatures carry the save time
+    campaign.save_sheet("player", "Ann", make_sheet("Ann", gold=100))
+    with pytest.raises(ValueError, match=r"1 sheet changed since the preview \(Ann\)"):
+        plan.commit(campaign)
+    assert [campaign.load_sheet("player", name).gold for name in ("Ann", "Bo", "Cy")] == [100, 5, 5]
+    campaign.close()
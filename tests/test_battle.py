@@ -0,0 +1,94 @@
+import io
+import json
+
+from dmbuddy.battle import BattleState
+from dmbuddy.cli import main
+
+
+def _names(battle):
+    return [battle.names[slot] for slot in battle.turn_order()]
+
+
+def _tied_battle():
+    battle = BattleState()
+    for name in ("A", "B", "C"):
+        battle.append("enemy", name, hp=10)
+    battle.roll_initiative([15, 15, 15])
+    battle.advance()
+    return battle
+
+
+def test_round_trip_keeps_tied_combatants_in_order():
+    battle = _tied_battle()
+    assert _names(battle) == ["B", "C", "A"]
+    restored = BattleState.from_dict(json.loads(json.dumps(battle.to_dict())))
+    assert _names(restored) == ["B", "C", "A"]
+    assert restored.to_dict() == battle.to_dict()
+
+
+def test_combatants_joining_after_a_round_trip_land_where_they_would_have():
+    battle = _tied_battle()
+    restored = BattleState.from_dict(battle.to_dict())
+    for state in (battle, restored):
+        state.append("enemy", "D", rolled_initiative=15)
+    assert _names(restored) == _names(battle) == ["B", "C", "D", "A"]
+
+
+def test_saves_without_join_sequences_still_load():
+    saved = _tied_battle().to_dict()
+    for combatant in saved["combatants"]:
+        del combatant["seq"]
+    del saved["next_seq"]
+    assert _names(BattleState.from_dict(saved)) == ["B", "C", "A"]
+
+
+def _cli(data, *argv, stdin=""):
+    out = io.StringIO()
+    assert main(["--data", str(data), *argv], io.StringIO(stdin), out) == 0
+    return out.getvalue()
+
+
+def test_cli_pipeline_keeps_the_turn_order_between_commands(tmp_path):
+    data = tmp_path / "data"
+    _cli(data, "import", "--type", "enemy", stdin=json.dumps([{"name": "Goblin", "hit_points_current": 7, "gold": 2}]))
+    battle = _cli(data, "add-to-battle", "Goblin", "--type", "enemy", "--count", "3")
+    battle = _cli(data, "start", "--no-auto-roll", stdin=battle)
+    battle = _cli(data, "next-turn", stdin=battle)
+    assert [c["name"] for c in json.loads(battle)["combatants"]] == ["Goblin 2", "Goblin 3", "Goblin 1"]
+    battle = _cli(data, "next-turn", "--damage", "Goblin 3=7", stdin=battle)
+    document = json.loads(battle)
+    assert [(c["name"], c["hp"]) for c in document["combatants"]] == [("Goblin 1", 7), ("Goblin 2", 7)]
+    assert document["loot"]["gold"] == 2
+
+
+def test_damage_removes_the_defeated_in_turn_order():
+    battle = BattleState()
+    for name, hp in (("A", 5), ("B", 8), ("C", 3)):
+        battle.append("enemy", name, hp=hp)
+    battle.roll_initiative([20, 15, 10])
+    battle.advance()
+    defeated = battle.apply_damage([9, 3, 4])  # B, C, A
+    assert [name for _, name, _ in defeated] == ["B", "C"]
+    assert _names(battle) == ["A"]
+    assert int(battle.hp[battle.turn_order()[0]]) == 1
+
+
+def test_anyone_already_at_zero_hp_is_removed_without_damage():
+    battle = BattleState()
+    for name in ("A", "B", "C"):
+        battle.append("enemy", name, hp=10)
+    battle.roll_initiative([20, 15, 10])
+    battle.hp[battle.turn_order()[2]] = 0  # An HP cell edited to 0
+    assert [name for _, name, _ in battle.apply_damage([0, 0, 0])] == ["C"]
+    assert _names(battle) == ["A", "B"]
+
+
+def test_turns_wrap_round_and_count_rounds():
+    battle = BattleState()
+    for name in ("A", "B"):
+        battle.append("enemy", name)
+    battle.roll_initiative([20, 10])
+    assert battle.round == 1
+    battle.advance()
+    battle.advance()
+    assert (_names(battle), battle.round) == (["A", "B"], 2)
@@ -0,0 +1,42 @@
+import json
+import os
+
+import pytest
+
+from dmbuddy.cache import SheetCache
+
+from conftest import make_sheet
+
+
+def test_entries_are_served_only_while_the_signature_matches():
+    cache = SheetCache()
+    cache.put("ann", (1, 100), "parsed")
+    assert cache.get("ann", (1, 100)) == "parsed"
+    assert cache.get("ann", (2, 100)) is None
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_least_recently_used_go_first_by_count_and_by_bytes():
+    cache = SheetCache(max_entries=2, max_bytes=250)
+    cache.put("a", (1, 100), "A")
+    cache.put("b", (1, 100), "B")
+    cache.get("a", (1, 100))
+    cache.put("c", (1, 100), "C")
+    assert cache.get("b", (1, 100)) is None and len(cache) == 2
+    cache.put("d", (1, 200), "D")
+    assert len(cache) == 1 and cache.get("d", (1, 200)) == "D"
+
+
+def test_campaign_rereads_a_sheet_edited_outside_the_app(campaign):
+    campaign.save_sheet("player", "Ann", make_sheet("Ann", gold=1))
+    first = campaign.load_sheet("player", "Ann")
+    assert campaign.load_sheet("player", "Ann") is first
+
+    path = campaign.storage.path_for("player", "Ann")
+    path.write_text(json.dumps(make_sheet("Ann", gold=2).to_dict()))
+    os.utime(path, ns=(path.stat().st_atime_ns, path.stat().st_mtime_ns + 10**9))
+    assert campaign.load_sheet("player", "Ann").gold == 2
+
+    path.unlink()
+    with pytest.raises(FileNotFoundError):
+        campaign.load_sheet("player", "Ann")
@@ -0,0 +1,47 @@
+import numpy as np
+
+from dmbuddy.battle import BattleState
+from dmbuddy.delta import TableView
+
+DAMAGE = 7  # Damage Taken, after type, name and five number columns
+
+
+def _battle():
+    battle = BattleState()
+    for name, initiative in (("A", 15), ("B", 10), ("C", 5)):
+        battle.append("enemy", name, hp=10, rolled_initiative=initiative)
+    return battle
+
+
+def test_render_sends_nothing_until_a_row_changes():
+    battle, view = _battle(), TableView()
+    table = view.render(battle)
+    assert [row[1] for row in table] == ["A", "B", "C"]
+    assert view.render(battle) is None
+    battle.apply_damage([0, 4, 0])
+    assert view.render(battle)[1][DAMAGE - 1] == 6  # B's HP
+    assert view.render(battle) is None
+
+
+def test_submitted_table_is_diffed_into_edits():
+    battle, view = _battle(), TableView()
+    table = [list(row) for row in view.render(battle)]  # As the browser sends it back
+    table[2][DAMAGE] = "3"
+    view.diff_table(table)
+    assert view.edits == {(2, DAMAGE): "3"}
+    assert view.edited_column(np.zeros(3, dtype=np.int64), DAMAGE).tolist() == [0, 0, 3]
+    assert view.render(battle) is not None  # Pending edits are cleared by sending the table again
+    assert view.edits == {}
+
+
+def test_edits_follow_their_combatant_when_someone_else_changed_the_order():
+    battle, view = _battle(), TableView()
+    view.render(battle)
+    view.record_edit(0, DAMAGE, 2)  # A
+    view.record_edit(1, DAMAGE, 5)  # B
+    # Another browser ends A's turn and defeats B before this one submits
+    battle.advance()
+    battle.apply_damage([10, 0, 0])
+    damage = view.edited_column(np.zeros(len(battle), dtype=np.int64), DAMAGE, battle.turn_order())
+    assert [battle.names[slot] for slot in battle.turn_order()] == ["C", "A"]
+    assert damage.tolist() == [0, 2]
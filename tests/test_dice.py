@@ -0,0 +1,40 @@
+import numpy as np
+import pytest
+
+from dmbuddy.dice import MAX_DICE, compile_dice, roll_many
+
+
+@pytest.mark.parametrize("text, minimum, maximum", [
+    ("1d20+5", 6, 25),
+    ("2d6 + 1d4 - 1", 2, 15),
+    ("4d6kh3", 3, 18),
+    ("d% - 1d4", -3, 99),
+    ("1d20+5 dis", 6, 25),
+    ("7", 7, 7),
+])
+def test_bounds_of_parsed_expressions(text, minimum, maximum):
+    expression = compile_dice(text)
+    assert (expression.minimum, expression.maximum) == (minimum, maximum)
+    rolls = expression.roll(2000, np.random.default_rng(1))
+    assert minimum <= rolls.min() and rolls.max() <= maximum
+
+
+def test_advantage_keeps_the_better_of_two():
+    term, = compile_dice("d20 adv").terms
+    assert (term.count, term.keep, term.highest) == (2, 1, True)
+    rolls = compile_dice("d20 adv").roll(4000, np.random.default_rng(2))
+    assert rolls.mean() > 12  # A plain d20 averages 10.5, advantage about 13.8
+
+
+@pytest.mark.parametrize("text", ["", "abc", "1d20 +", "2d", "0d6", f"{MAX_DICE + 1}d6", "1d0", "2d6 adv", "1d6 1d6"])
+def test_bad_expressions_are_refused(text):
+    with pytest.raises(ValueError):
+        compile_dice(text)
+
+
+def test_roll_many_applies_each_expressions_own_sign_and_constant():
+    totals = roll_many(["1d1+3", "-1d1", "2d1 + 1d1", "10"], np.random.default_rng(0))
+    assert totals.tolist() == [4, -1, 3, 10]
+    rolls = roll_many(["1d20"] * 500 + ["1d20+100"], np.random.default_rng(3))
+    assert 1 <= rolls[:500].min() and rolls[:500].max() <= 20
+    assert 101 <= rolls[500] <= 120
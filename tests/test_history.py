@@ -0,0 +1,52 @@
+from dmbuddy.battle import BattleState
+from dmbuddy.core import add_to_battle, next_turn, roll_initiative
+from dmbuddy.history import BattleHistory
+from dmbuddy.loot import LootLedger
+
+from conftest import make_sheet
+
+
+def _action(history, battle, label, action, drops_loot=False):
+    captured = battle.capture()
+    result = action()
+    history.record(label, battle.changes_since(captured), result if drops_loot else ())
+
+
+def test_undo_and_redo_restore_the_battle_and_the_loot(campaign):
+    campaign.save_sheet("enemy", "Goblin", make_sheet("Goblin", "enemy", hit_points_current=7, gold=3, equipment="Dagger"))
+    battle, ledger, history = BattleState(), LootLedger(), BattleHistory()
+    _action(history, battle, "Add", lambda: add_to_battle(campaign, battle, "enemy", "Goblin", count=4))
+    _action(history, battle, "Start", lambda: roll_initiative(battle, [4, 3, 2, 1]))
+    states = [(battle.to_dict(), ledger.to_dict())]
+
+    def turn():
+        _, loot = next_turn(campaign, battle, [0, 7, 0, 9])
+        ledger.add_many(loot)
+        return loot
+
+    _action(history, battle, "Next Turn", turn, drops_loot=True)
+    states.append((battle.to_dict(), ledger.to_dict()))
+    assert len(battle) == 2 and ledger.to_dict() != states[0][1]
+
+    assert history.next_undo() == "Next Turn"
+    assert history.undo(battle, ledger).label == "Next Turn"
+    assert (battle.to_dict(), ledger.to_dict()) == states[0]
+    assert history.next_redo() == "Next Turn"
+    history.redo(battle, ledger)
+    assert (battle.to_dict(), ledger.to_dict()) == states[1]
+
+    history.undo(battle, ledger)
+    history.undo(battle, ledger)
+    history.undo(battle, ledger)
+    assert len(battle) == 0 and history.undo(battle, ledger) is None
+    _action(history, battle, "Add", lambda: add_to_battle(campaign, battle, "enemy", "Goblin"))
+    assert history.next_redo() is None  # A new action drops what could have been redone
+
+
+def test_oldest_steps_are_forgotten_over_budget():
+    battle, ledger, history = BattleState(), LootLedger(), BattleHistory(budget=1)
+    for name in ("A", "B", "C"):
+        _action(history, battle, f"Add {name}", lambda name=name: battle.append("enemy", name))
+    assert history.undo(battle, ledger).label == "Add C"
+    assert history.undo(battle, ledger) is None  # Only the latest step is ever kept
+    assert [battle.names[slot] for slot in battle.turn_order()] == ["A", "B"]
@@ -0,0 +1,66 @@
+import json
+
+import pytest
+
+from dmbuddy.importer import BulkImport, iter_records
+
+GOBLIN = {
+    "name": "Goblin", "type": "humanoid", "subtype": "goblinoid", "armor_class": [{"type": "armor", "value": 15}],
+    "hit_points": 7, "hit_points_roll": "2d6", "speed": {"walk": "30 ft."}, "dexterity": 14, "strength": 8,
+    "challenge_rating": 0.25, "proficiencies": [{"proficiency": {"name": "Saving Throw: DEX"}}],
+    "actions": [{"name": "Scimitar", "desc": "Melee Weapon Attack: +4 to hit."}],
+}
+
+
+def _monsters(count):
+    return [dict(GOBLIN, name=f"Goblin {i}", hit_points=i + 1) for i in range(count)]
+
+
+def test_srd_dump_is_mapped_and_bad_records_are_reported(campaign, tmp_path):
+    records = _monsters(3) + [{"name": "Broken", "hit_points_max": "lots"}, [1, 2], {"hit_points": 4}]
+    source = tmp_path / "monsters.json"
+    source.write_text(json.dumps({"count": len(records), "results": records}))
+
+    report = BulkImport(campaign, source, items_key="results", batch_size=2).run()
+    assert (report["records"], report["imported"], report["skipped"], report["done"]) == (6, 3, 3, True)
+    assert [(error["record"], error["name"]) for error in report["errors"]] == [(4, "Broken"), (5, None), (6, None)]
+    goblin = campaign.load_sheet("enemy", "Goblin 2")
+    assert (goblin.armor_class, goblin.hit_points_max, goblin.hit_dice_total, goblin.speed) == (15, 3, "2d6", 30)
+    assert (goblin.initiative_bonus, goblin.level, goblin.race) == (2, 1, "humanoid (goblinoid)")
+    assert goblin.saving_throws[1] and "Scimitar" in goblin.features
+
+
+def test_json_lines_read_in_small_chunks(tmp_path):
+    source = tmp_path / "party.jsonl"
+    source.write_text("\n".join(json.dumps({"name": f"Zoë {i}"}) for i in range(5)) + "\n")
+    with open(source, 'rb') as f:
+        records = list(iter_records(f, chunk_size=7))
+    assert [record["name"] for record, _, _ in records] == [f"Zoë {i}" for i in range(5)]
+    assert {layout for _, layout, _ in records} == {"lines"}
+    with open(source, 'rb') as f:
+        rest = list(iter_records(f, offset=records[2][2], layout="lines", chunk_size=7))
+    assert [record["name"] for record, _, _ in rest] == ["Zoë 3", "Zoë 4"]
+
+
+def test_interrupted_import_resumes_from_its_checkpoint(campaign, tmp_path, monkeypatch):
+    source = tmp_path / "monsters.json"
+    source.write_text(json.dumps(_monsters(10)))
+    interrupted = []
+
+    def stop_once(report):
+        if not interrupted:
+            interrupted.append(report["records"])
+            raise KeyboardInterrupt
+
+    with pytest.raises(KeyboardInterrupt):
+        BulkImport(campaign, source, batch_size=3, workers=1, progress=stop_once).run()
+    saved = []
+    save_many = campaign.save_many
+    monkeypatch.setattr(campaign, "save_many", lambda records: saved.extend(records) or save_many(records))
+
+    report = BulkImport(campaign, source, batch_size=3, workers=1).run()
+    assert report["resumed"] and report["done"]
+    assert (report["records"], report["imported"]) == (10, 10)
+    assert 0 < len(saved) <= 10 - interrupted[0]
+    assert sorted(campaign.names("enemy")) == sorted(f"goblin {i}" for i in range(10))
+    assert BulkImport(campaign, source).run()["resumed"]  # Finished: nothing left to do
@@ -0,0 +1,49 @@
+import json
+
+from dmbuddy.battle import BattleState
+from dmbuddy.core import add_to_battle, next_turn, roll_initiative
+from dmbuddy.journal import BattleJournal
+
+from conftest import make_sheet
+
+
+def test_resume_ignores_and_cuts_off_a_torn_last_line(campaign, tmp_path):
+    campaign.save_sheet("enemy", "Goblin", make_sheet("Goblin", "enemy", hit_points_current=7))
+    journal = BattleJournal(tmp_path / "battles")
+    battle = BattleState()
+    add_to_battle(campaign, battle, "enemy", "Goblin", count=3, journal=journal)
+    roll_initiative(battle, [15, 10, 5], journal=journal)
+    next_turn(campaign, battle, [2, 0, 0], journal=journal)
+    journal.close()
+    with open(journal.path, "a") as f:
+        f.write('{"seq":4,"event":"tu')  # A crash in the middle of writing an event
+
+    resumed, restored, _ = BattleJournal.resume(tmp_path / "battles", journal.battle_id)
+    assert restored.to_dict() == battle.to_dict()
+    assert resumed.seq == 3
+    assert journal.path.read_bytes().endswith(b"\n")
+
+    next_turn(campaign, restored, [0, 0, 0], journal=resumed)
+    resumed.close()
+    _, again, _ = BattleJournal.resume(tmp_path / "battles", journal.battle_id)
+    assert again.to_dict() == restored.to_dict()
+
+
+def test_resume_from_a_mid_round_snapshot_keeps_tied_combatants_apart(campaign, tmp_path):
+    for name in ("A", "B", "C"):
+        campaign.save_sheet("enemy", name, make_sheet(name, "enemy", hit_points_current=10))
+    journal = BattleJournal(tmp_path / "battles")
+    battle = BattleState()
+    for name in ("A", "B", "C"):
+        add_to_battle(campaign, battle, "enemy", name, journal=journal)
+    roll_initiative(battle, [15, 15, 10], journal=journal)
+    next_turn(campaign, battle, [0, 0, 0], journal=journal)
+    journal.snapshot(battle)  # As the session store does when it evicts a battle
+    next_turn(campaign, battle, [0, 5, 0], journal=journal)
+    journal.close()
+    assert [(battle.names[slot], int(battle.hp[slot])) for slot in battle.turn_order()] == [("C", 5), ("A", 10), ("B", 10)]
+
+    _, restored, _ = BattleJournal.resume(tmp_path / "battles", journal.battle_id)
+    assert restored.to_dict() == battle.to_dict()
+    last = json.loads(journal.path.read_text().splitlines()[-1])
+    assert last["hits"] == [[2, 5]]  # C joined third
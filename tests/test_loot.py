@@ -0,0 +1,38 @@
+from dmbuddy.loot import LootLedger, item_key, parse_equipment, parse_item
+
+
+def test_counts_in_front_behind_and_in_brackets():
+    assert [parse_item(text) for text in ("2x Dagger", "Dagger x2", "Dagger (2)", "2 Daggers", "Dagger")] == [
+        ("Dagger", 2), ("Dagger", 2), ("Dagger", 2), ("Daggers", 2), ("Dagger", 1)]
+
+
+def test_a_number_followed_by_a_unit_is_not_a_count():
+    assert parse_equipment("50 ft hempen rope, 2 Daggers, Dagger") == [["50 ft hempen rope", 1], ["Daggers", 3]]
+    assert parse_equipment("10 gp\n5 lb. of flour") == [["10 gp", 1], ["5 lb. of flour", 1]]
+
+
+def test_singular_and_plural_spellings_share_a_key():
+    assert item_key("Daggers") == item_key("dagger")
+    assert item_key("Rubies") == item_key("Ruby")
+    assert item_key("Torches") == item_key("Torch")
+    assert item_key("Axes") == item_key("Axe")
+    assert item_key("Potions of Healing") == item_key("potion of healing")
+    assert item_key("Glass") != item_key("Gla")
+
+
+def test_ledger_merges_items_and_keeps_gold_per_source():
+    ledger = LootLedger()
+    assert ledger.add_many([("Goblin 1", 3, [["Dagger", 1]]), ("Goblin 2", 0, [["Daggers", 2], ["Rope", 1]])])
+    assert not ledger.add_many([("Goblin 3", 0, [])])
+    assert ledger.item_lines() == ["Dagger ×3", "Rope"]
+    assert ledger.gold_lines() == ["Goblin 1: 3 gp"]
+    assert LootLedger.from_dict(ledger.to_dict()).to_dict() == ledger.to_dict()
+
+
+def test_remove_many_takes_back_what_add_many_added():
+    ledger = LootLedger()
+    turn = [("Goblin 1", 3, [["Dagger", 2]])]
+    ledger.add_many([("Orc", 5, [["Dagger", 1]])])
+    ledger.add_many(turn)
+    ledger.remove_many(turn)
+    assert ledger.to_dict() == {"gold": 5, "gold_by_source": {"Orc": 5}, "items": [["Dagger", 1]]}
@@ -0,0 +1,29 @@
+from dmbuddy.roster import RosterIndex
+from dmbuddy.storage import JsonStorage
+
+from conftest import make_sheet
+
+
+def _roster(tmp_path, names, character_type="enemy"):
+    storage = JsonStorage(tmp_path / "data")
+    storage.save_many((character_type, name, make_sheet(name, character_type).to_dict()) for name in names)
+    roster = RosterIndex(storage)
+    roster.load()
+    return roster
+
+
+def test_page_filters_by_prefix_and_counts_every_match(tmp_path):
+    roster = _roster(tmp_path, [f"Goblin {i:02d}" for i in range(30)] + ["Gnoll", "Orc", "Ogre"])
+    page, total = roster.page("enemy", "gob", offset=10, limit=5)
+    assert page == [f"goblin {i:02d}" for i in range(10, 15)]
+    assert total == 30
+    assert roster.page("enemy", " O ", limit=50) == (["ogre", "orc"], 2)
+    assert roster.page("enemy", "goblin 2", offset=8) == (["goblin 28", "goblin 29"], 10)
+    assert roster.page("enemy", "troll") == ([], 0)
+    assert roster.page("enemy", "", offset=31) == (["ogre", "orc"], 33)
+
+
+def test_page_of_every_agent_uses_type_labels(tmp_path):
+    roster = _roster(tmp_path, ["Orc"])
+    roster.storage.save("player", "Olive", make_sheet("Olive").to_dict())
+    assert roster.page(None, "o") == (["olive (player)", "orc (enemy)"], 2)
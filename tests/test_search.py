@@ -0,0 +1,55 @@
+import json
+import os
+
+from dmbuddy.search import SearchIndex
+from dmbuddy.storage import JsonStorage
+
+from conftest import make_sheet
+
+
+def _save(storage, character_type, name, **fields):
+    storage.save(character_type, name, make_sheet(name, character_type, **fields).to_dict())
+
+
+def _storage(tmp_path):
+    storage = JsonStorage(tmp_path / "data")
+    _save(storage, "enemy", "Mage", spells="Fireball, Firebolt", level=5, **{"class": "Wizard"})
+    _save(storage, "enemy", "Orc", equipment="Greataxe", level=2, race="Orc")
+    _save(storage, "npc", "Sage", spells="Fire Bolt", level=9, **{"class": "Wizard"})
+    return storage
+
+
+def test_words_prefixes_facets_and_levels(tmp_path):
+    index = SearchIndex(_storage(tmp_path))
+    assert [name for _, name in index.search("fireball")] == ["mage"]
+    assert [name for _, name in index.search("fire*")] == ["mage", "sage"]
+    assert index.search("fire*", character_type="npc") == [("npc", "sage")]
+    assert index.search(filters={"class": "wizard"}, level_min=6) == [("npc", "sage")]
+    assert index.search(level_max=5) == [("enemy", "mage"), ("enemy", "orc")]
+    assert index.search("greataxe fireball") == []
+    counts = index.facet_counts(index.search(filters={"class": "Wizard"}))
+    assert counts["type"] == {"enemy": 1, "npc": 1}
+    assert counts["level"] == {5: 1, 9: 1}
+
+
+def test_saved_index_only_rereads_changed_sheets(tmp_path):
+    storage = _storage(tmp_path)
+    index = SearchIndex(storage)
+    index.load()
+    index.save()
+    path = storage.path_for("enemy", "Orc")
+    _save(storage, "enemy", "Orc", equipment="Longbow", level=2)
+    os.utime(path, ns=(path.stat().st_atime_ns, path.stat().st_mtime_ns + 10**9))
+
+    reopened = SearchIndex(storage)
+    assert reopened.search("greataxe") == []
+    assert reopened.search("longbow") == [("enemy", "orc")]
+
+
+def test_sheet_files_that_are_not_objects_are_skipped(tmp_path):
+    storage = _storage(tmp_path)
+    storage.get_directory("enemy").joinpath("junk-enemy.json").write_text("[]")
+    storage.sidecar_path("search-index.json").write_text(json.dumps([1, 2]))
+    index = SearchIndex(storage)
+    index.load()
+    assert [name for _, name in index.search()] == ["mage", "orc", "sage"]
@@ -0,0 +1,68 @@
+import threading
+import time
+
+from dmbuddy import sessions
+from dmbuddy.core import add_to_battle
+from dmbuddy.sessions import BattleView, SessionStore
+
+from conftest import make_sheet
+
+
+def _battle(store, campaign, name="Goblin"):
+    view = BattleView()
+    with store.use(view) as session:
+        add_to_battle(campaign, session.battle_state, "enemy", name, count=2, journal=session.journal)
+    return view
+
+
+def test_idle_battle_is_evicted_and_resumed_from_its_snapshot(campaign, tmp_path):
+    campaign.save_sheet("enemy", "Goblin", make_sheet("Goblin", "enemy", hit_points_current=7))
+    store = SessionStore(tmp_path / "battles", idle_timeout=3600)
+    view = _battle(store, campaign)
+    before = store.peek(view.session_id).battle_state.to_dict()
+    store.idle_timeout = 0
+    store.sweep()
+    assert store.peek(view.session_id) is None and store.evictions == 1
+    with store.use(view) as session:
+        assert session.battle_state.to_dict() == before
+    store.close()
+
+
+def test_least_recently_used_battles_go_first_over_the_memory_budget(campaign, tmp_path):
+    campaign.save_sheet("enemy", "Goblin", make_sheet("Goblin", "enemy"))
+    store = SessionStore(tmp_path / "battles")
+    views = [_battle(store, campaign) for _ in range(3)]
+    store.memory_budget = store.memory_usage() - 1  # One battle too many
+    store.sweep(keep=store.peek(views[2].session_id))
+    assert [store.peek(view.session_id) is not None for view in views] == [False, True, True]
+    store.close()
+
+
+def test_resuming_a_battle_doesnt_hold_up_the_others(campaign, tmp_path, monkeypatch):
+    campaign.save_sheet("enemy", "Goblin", make_sheet("Goblin", "enemy"))
+    store = SessionStore(tmp_path / "battles")
+    slow, other = _battle(store, campaign), _battle(store, campaign)
+    store.evict(store.peek(slow.session_id), wait=True)
+
+    started, release = threading.Event(), threading.Event()
+    resume = sessions.BattleJournal.resume
+
+    def slow_resume(*args):
+        started.set()
+        release.wait(10)
+        return resume(*args)
+
+    monkeypatch.setattr(sessions.BattleJournal, "resume", slow_resume)
+    results = []
+    readers = [threading.Thread(target=lambda: results.append(store.get(slow.session_id))) for _ in range(2)]
+    for reader in readers:
+        reader.start()
+    assert started.wait(10)
+    began = time.monotonic()
+    assert store.get(other.session_id) is store.peek(other.session_id)
+    assert time.monotonic() - began < 1
+    release.set()
+    for reader in readers:
+        reader.join(10)
+    assert len(results) == 2 and results[0] is results[1]  # Both waited for the one resume
+    store.close()
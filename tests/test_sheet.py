@@ -0,0 +1,52 @@
+import json
+
+import pytest
+
+from dmbuddy.sheet import SCHEMA_VERSION, CharacterSheet, decode, dumps, encode, loads, loads_dict
+
+from conftest import make_sheet
+
+
+def _full_sheet():
+    sheet = make_sheet(
+        "Zoë the Brave", "npc", level=7, gold=2**40, armor_class=17, race="Half-Elf",
+        abilities={"strength": 8, "dexterity": 18, "constitution": 14, "intelligence": 12, "wisdom": 10, "charisma": 16},
+        saving_throws={"dexterity": True, "charisma": True},
+        weapons=[{"name": "Rapier", "damage": "1d8"}], equipment="Rapier, 2 Daggers, 2 daggers",
+        homebrew_notes={"patron": "the Fey"},
+    )
+    sheet.parse_equipment()
+    return sheet
+
+
+def test_binary_round_trip_keeps_every_field():
+    sheet = _full_sheet()
+    raw = encode(sheet)
+    assert len(raw) < len(dumps(sheet))
+    assert decode(raw).to_dict() == sheet.to_dict()
+    assert loads(raw).to_dict() == loads(dumps(sheet)).to_dict() == sheet.to_dict()
+    assert loads_dict(raw)["homebrew_notes"] == {"patron": "the Fey"}
+    assert decode(raw).saving_throws == (False, True, False, False, False, True)
+
+
+@pytest.mark.parametrize("raw", [b"DMBS", encode(make_sheet("Ann"))[:-1], encode(make_sheet("Ann")) + b"x", b"JSON"])
+def test_decode_refuses_truncated_or_foreign_bytes(raw):
+    with pytest.raises(ValueError):
+        decode(raw)
+
+
+def test_encode_refuses_numbers_too_large_to_pack():
+    with pytest.raises(ValueError, match="too large"):
+        encode(make_sheet("Ann", gold=2**63))
+
+
+def test_version_1_sheets_are_migrated_and_checked():
+    saved = {"name": "Old Timer", "level": 4.0, "hit_points_current": "12", "abilities": {"strength": 15.0}}
+    sheet = CharacterSheet.from_dict(saved, "player")
+    assert sheet.to_dict()["schema"] == SCHEMA_VERSION
+    assert (sheet.level, sheet.hit_points_current, sheet.gold, sheet.ability("strength")) == (4, 12, 0, 15)
+    assert json.loads(dumps(sheet))["gold"] == 0
+    with pytest.raises(ValueError, match="Invalid level"):
+        CharacterSheet.from_dict({**saved, "level": "four"})
+    with pytest.raises(ValueError, match="schema version"):
+        CharacterSheet.from_dict({**saved, "schema": SCHEMA_VERSION + 1})
@@ -0,0 +1,70 @@
+import importlib.util
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+from dmbuddy import simulator
+from dmbuddy.simulator import combatant_from_sheet, simulate_encounter
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def _encounter():
+    party = [combatant_from_sheet({"hit_points_current": 30, "armor_class": 16}, "player") for _ in range(3)]
+    foes = [combatant_from_sheet({"hit_points_current": 7, "armor_class": 12}, "enemy") for _ in range(4)]
+    return party + foes
+
+
+def test_same_seed_gives_the_same_result_whatever_the_workers():
+    one = simulate_encounter(_encounter(), trials=12000, seed=7, batch_size=5000, workers=1)
+    two = simulate_encounter(_encounter(), trials=12000, seed=7, batch_size=5000, workers=2)
+    assert one == two
+    assert one["trials"] == 12000
+    assert 0.5 < one["party_win_probability"] <= 1
+
+
+def test_needs_both_sides():
+    with pytest.raises(ValueError, match="at least one player or NPC and one enemy"):
+        simulate_encounter(_encounter()[:3], trials=10)
+
+
+def test_app_module_opens_nothing_when_imported(tmp_path):
+    # Simulator workers re-import the main module when processes are spawned
+    code = (
+        "import importlib.util, sys\n"
+        f"spec = importlib.util.spec_from_file_location('__mp_main__', {str(ROOT / 'dnd-manager.py')!r})\n"
+        "app = importlib.util.module_from_spec(spec)\n"
+        "spec.loader.exec_module(app)\n"
+        "assert app.CAMPAIGN is None and app.BATTLES is None\n"
+    )
+    env = dict(os.environ, PYTHONPATH=str(ROOT))
+    subprocess.run([sys.executable, "-c", code], cwd=tmp_path, env=env, check=True, timeout=120)
+    assert not (tmp_path / "data").exists()
+
+
+def test_simulate_battle_clamps_the_number_of_trials(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    spec = importlib.util.spec_from_file_location("dnd_manager", ROOT / "dnd-manager.py")
+    app = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(app)
+    from dmbuddy.sessions import BattleView
+    from dmbuddy.storage import JsonStorage
+
+    app.set_storage(JsonStorage(tmp_path / "data"))
+    try:
+        for name, character_type in (("Ann", "player"), ("Goblin", "enemy")):
+            sheet = app.CharacterSheet(character_type)
+            sheet.update({"name": name, "hit_points_current": 10})
+            app.CAMPAIGN.save_sheet(character_type, name, sheet)
+        view = BattleView()
+        app.add_agent_to_battle(view, "Ann (player)")
+        app.add_agent_to_battle(view, "Goblin (enemy)")
+        asked = []
+        monkeypatch.setattr(app, "simulate_encounter", lambda combatants, trials, seed: asked.append(trials) or simulator.simulate_encounter(combatants, 10, seed, workers=1))
+        app.simulate_battle(view, 10**12, 1)
+        assert asked == [simulator.MAX_TRIALS]
+    finally:
+        app.flush_saves()
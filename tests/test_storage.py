@@ -0,0 +1,91 @@
+import json
+
+import pytest
+
+from dmbuddy.storage import PENDING_BATCH, JsonStorage, SQLiteStorage, import_json_tree
+
+from conftest import make_sheet
+
+
+def _records(names, **fields):
+    return [("player", name, make_sheet(name, **fields).to_dict()) for name in names]
+
+
+def test_save_all_writes_every_sheet_and_clears_the_pending_file(tmp_path):
+    storage = JsonStorage(tmp_path)
+    assert storage.save_all(_records(["Ann", "Bo", "Cy"], gold=5)) == 3
+    assert [storage.load("player", name)["gold"] for name in ("Ann", "Bo", "Cy")] == [5, 5, 5]
+    assert not storage.sidecar_path(PENDING_BATCH).exists()
+
+
+def test_save_all_puts_written_sheets_back_when_a_write_fails(tmp_path, monkeypatch):
+    storage = JsonStorage(tmp_path)
+    storage.save_many(_records(["Ann", "Bo"], gold=1))
+    write = storage._write
+
+    def failing_write(character_type, name, text):
+        if name == "Cy":
+            raise OSError("disk full")
+        write(character_type, name, text)
+
+    monkeypatch.setattr(storage, "_write", failing_write)
+    with pytest.raises(OSError, match="disk full"):
+        storage.save_all(_records(["Ann", "Bo", "Cy", "Di"], gold=9))
+    assert storage.load("player", "Ann")["gold"] == 1
+    assert storage.load("player", "Bo")["gold"] == 1
+    assert storage.signature("player", "Cy") is None
+    assert storage.signature("player", "Di") is None
+    assert not storage.sidecar_path(PENDING_BATCH).exists()
+
+
+def test_interrupted_batch_is_finished_on_the_next_start(tmp_path, monkeypatch):
+    storage = JsonStorage(tmp_path)
+    storage.save_many(_records(["Ann", "Bo", "Cy"], gold=1))
+    write = storage._write
+    written = []
+
+    def crashing_write(character_type, name, text):
+        if written:
+            raise KeyboardInterrupt  # Stands in for the process dying mid-batch
+        write(character_type, name, text)
+        written.append(name)
+
+    monkeypatch.setattr(storage, "_write", crashing_write)
+    with pytest.raises(KeyboardInterrupt):
+        storage.save_all(_records(["Ann", "Bo", "Cy"], gold=9))
+    assert storage.sidecar_path(PENDING_BATCH).exists()
+    # Somebody saves Cy before the restart; the replay must not overwrite that
+    write("player", "Cy", json.dumps(make_sheet("Cy", gold=42).to_dict()))
+
+    reopened = JsonStorage(tmp_path)
+    assert [reopened.load("player", name)["gold"] for name in ("Ann", "Bo", "Cy")] == [9, 9, 42]
+    assert not reopened.sidecar_path(PENDING_BATCH).exists()
+
+
+def test_torn_pending_file_writes_nothing(tmp_path):
+    storage = JsonStorage(tmp_path)
+    storage.save_many(_records(["Ann"], gold=1))
+    storage.sidecar_path(PENDING_BATCH).write_text('[["player","Ann","{')
+    reopened = JsonStorage(tmp_path)
+    assert reopened.load("player", "Ann")["gold"] == 1
+    assert not reopened.sidecar_path(PENDING_BATCH).exists()
+
+
+
+@pytest.mark.parametrize("binary", [False, True])
+def test_import_json_tree_skips_and_reports_sheets_it_cannot_read(tmp_path, binary):
+    source = JsonStorage(tmp_path / "data")
+    source.save_many(_records(["Ann", "Bo"], gold=3))
+    folder = source.get_directory("player")
+    (folder / "cy-player.json").write_text(json.dumps({"name": "Cy", "level": "abc"}))
+    (folder / "di-player.json").write_text("[]")
+    (folder / "ed-player.json").write_text('{"name": "Ed", ')
+
+    target = SQLiteStorage(tmp_path / "dmbuddy.db", binary)
+    report = import_json_tree(tmp_path / "data", target)
+    assert report["imported"] == 2
+    assert report["skipped"] == 3
+    assert sorted(str(error["name"]) for error in report["errors"]) == ["Cy", "None", "None"]
+    assert sorted(target.list_names("player")) == ["ann", "bo"]
+    assert target.load_sheet("player", "Bo").gold == 3
+    target.close()
@@ -0,0 +1,45 @@
+import pytest
+
+from dmbuddy import writer
+from dmbuddy.core import Campaign
+from dmbuddy.storage import JsonStorage, check_sheet_name
+
+from conftest import make_sheet
+
+
+def test_failing_save_is_given_up_on_and_reported(tmp_path, monkeypatch):
+    monkeypatch.setattr(writer, "RETRY_DELAY", 0.01)
+    campaign = Campaign(JsonStorage(tmp_path), write_behind=True, save_delay=0.01)
+    save = campaign.storage.save
+
+    def failing_save(character_type, name, data):
+        if name == "Bad":
+            raise OSError("disk full")
+        save(character_type, name, data)
+
+    monkeypatch.setattr(campaign.storage, "save", failing_save)
+    campaign.save_sheet("player", "Bad", make_sheet("Bad"))
+    campaign.save_sheet("player", "Good", make_sheet("Good"))
+    with pytest.raises(writer.SaveError, match="Bad"):
+        campaign.writer.flush(timeout=10)
+    assert campaign.writer.flush(timeout=10)  # Reported once, and nothing left to wait for
+    assert campaign.load_sheet("player", "Good").name == "Good"
+    campaign.close()
+
+
+def test_unstorable_name_is_refused_before_queueing(tmp_path):
+    campaign = Campaign(JsonStorage(tmp_path), write_behind=True)
+    with pytest.raises(ValueError):
+        campaign.save_sheet("player", "../Bad", make_sheet("../Bad"))
+    assert campaign.writer.flush(timeout=10)
+    campaign.close()
+
+
+@pytest.mark.parametrize("name", ["../evil", "a/b", "a\\b", "..", ".hidden", "", "  "])
+def test_check_sheet_name_refuses_names_that_are_not_plain_file_names(name):
+    with pytest.raises(ValueError):
+        check_sheet_name(name)
+
+
+def test_check_sheet_name_allows_ordinary_names():
+    assert check_sheet_name("Sir Reginald St. John") == "Sir Reginald St. John"